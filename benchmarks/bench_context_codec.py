@@ -0,0 +1,65 @@
+"""Save/load time and file size of session contexts for every ContextCodec format.
+
+Run from the repository root: python benchmarks/bench_context_codec.py [--turns 10 1000 100000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+from context_codec import ContextCodec
+from context_manager import LazyCipher
+
+RESPONSES = (
+    "Hello! How can I assist you today?",
+    "Goodbye! Have a great day!",
+    "How can I help you?",
+    "I'm not sure I understand. Could you clarify?",
+)
+FORMATS = (
+    ("json", "none", "fernet"),  # The legacy format
+    ("json", "zlib", "fernet"),
+    ("binary", "none", "fernet"),
+    ("binary", "none", "aesgcm"),
+    ("binary", "zlib", "aesgcm"),
+    ("binary", "lzma", "aesgcm"),
+)
+
+
+def synthetic_context(turns):
+    return {
+        "user_id": "bench", "last_intent": "greet", "last_entity": None, "topic": "python",
+        "history": [{"input": f"how do I fix error number {i} in my loop?", "response": RESPONSES[i % len(RESPONSES)]}
+                    for i in range(turns)],
+    }
+
+
+def best_ms(function, number):
+    return min(timeit.repeat(function, number=number, repeat=3)) / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 1000, 100000])
+    args = parser.parse_args()
+
+    cipher = LazyCipher(Fernet.generate_key())
+    for turns in args.turns:
+        context = synthetic_context(turns)
+        number = max(1, 20000 // (turns + 10))
+        print(f"{turns} turns:")
+        for serializer, compression, encryption in FORMATS:
+            codec = ContextCodec(serializer, compression, encryption)
+            data = codec.encode(context, cipher)
+            assert codec.decode(data, cipher) == context
+            save = best_ms(lambda: codec.encode(context, cipher), number)
+            load = best_ms(lambda: codec.decode(data, cipher), number)
+            print(f"  {serializer:>6} {compression:>4} {encryption:>6}: save {save:9.3f} ms, load {load:9.3f} ms, "
+                  f"{len(data):>10} bytes")
+
+
+if __name__ == "__main__":
+    main()
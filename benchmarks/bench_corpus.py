@@ -0,0 +1,37 @@
+"""Corpus ingestion throughput: texts per second into token-id shards, by worker count.
+
+Workers only pay off with spare cores: the main process still dedupes and
+maps each chunk's distinct tokens to corpus ids.
+
+Run from the repository root: python benchmarks/bench_corpus.py [--texts 200000] [--workers 0 2 4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.suite import prose_corpus
+from nlp_pipeline.corpus import ingest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--texts", type=int, default=200000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4])
+    args = parser.parse_args()
+
+    texts = prose_corpus(args.texts, seed=3)  # Random sentences, so nearly all of them are distinct
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as path:
+            started = time.perf_counter()
+            meta = ingest(iter(texts), path, workers=workers)
+            elapsed = time.perf_counter() - started
+        print(f"workers={workers}: {args.texts / elapsed:10.0f} texts/s, {meta['tokens'] / elapsed:10.0f} tokens/s, "
+              f"{meta['duplicates']} duplicates")
+
+
+if __name__ == "__main__":
+    main()
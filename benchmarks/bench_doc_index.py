@@ -0,0 +1,71 @@
+"""BM25 lookups over a synthetic docs corpus: DocIndex.search against exhaustive scoring.
+
+Run from the repository root: python benchmarks/bench_doc_index.py [--sections 100000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nlp_pipeline.doc_index import DocIndex, build_index
+from nlp_pipeline.tokenizer import Tokenizer
+
+
+def synthetic_sections(count, vocabulary=50000, length=80, seed=0):
+    """Sections whose words follow a Zipf-like distribution, like real docs text."""
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocabulary)]
+    cum_weights = list(accumulate(1 / (rank + 1) for rank in range(vocabulary)))
+    for section in range(count):
+        text = " ".join(rng.choices(words, cum_weights=cum_weights, k=length))
+        yield f"file:///docs/page{section // 10}.html#s{section}", f"Section {section}", text
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=300)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as path:
+        started = time.perf_counter()
+        build_index(synthetic_sections(args.sections), path, Tokenizer(detect_code=False).tokenize_prose)
+        print(f"Built index over {args.sections} sections in {time.perf_counter() - started:.1f} s")
+        index = DocIndex(path)
+        # The tokenizer drops stopwords, so typical queries are a few mid-frequency
+        # terms ("json dumps indent"); the second set adds a term found in nearly
+        # every section, the worst case for early termination.
+        typical = [[f"w{rng.randrange(20, 5000)}" for _ in range(rng.randint(1, 3))] for _ in range(args.queries)]
+        common = [terms + [f"w{rng.randrange(5)}"] for terms in typical]
+
+        for label, queries in (("typical", typical), ("with common term", common)):
+            print(f"{label} queries:")
+            for name, search in (("search", index.search), ("exhaustive", index.exhaustive_search)):
+                latencies = []
+                for terms in queries:
+                    started = time.perf_counter()
+                    search(terms, 5)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                print(f"  {name:>10}: mean {sum(latencies) / len(latencies):.3f} ms, "
+                      f"p50 {percentile(latencies, 0.5):.3f} ms, p99 {percentile(latencies, 0.99):.3f} ms")
+            mismatches = sum(
+                [doc for _, doc in index.search(terms, 5)] != [doc for _, doc in index.exhaustive_search(terms, 5)]
+                for terms in queries
+            )
+            print(f"  top-5 mismatches between the two: {mismatches}")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
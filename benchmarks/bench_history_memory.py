@@ -0,0 +1,79 @@
+"""Memory held by a 1M-turn conversation history, measured with tracemalloc.
+
+Compares the old list of {"input", "response"} dicts with TurnHistory kept
+fully in memory and with TurnHistory's default 1000-turn window spilling to
+disk. Inputs are distinct strings; responses come from the bot's small fixed
+set but arrive as fresh string objects, as they do from the pipeline.
+
+Run from the repository root: python benchmarks/bench_history_memory.py [--turns 1000000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+from turn_history import TurnHistory
+
+RESPONSES = (
+    "Hello! How can I assist you today?",
+    "Goodbye! Have a great day!",
+    "How can I help you?",
+    "I'm not sure I understand. Could you clarify?",
+)
+
+
+def turns(count):
+    for i in range(count):
+        # "".join builds a new string each time, like a freshly generated response
+        yield f"user message number {i}", "".join(RESPONSES[i % len(RESPONSES)])
+
+
+def measure(name, build, count):
+    tracemalloc.start()
+    started = time.perf_counter()
+    history = build(turns(count))
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<28} retained {current / 2**20:8.1f} MiB, peak {peak / 2**20:8.1f} MiB, {elapsed:6.2f} s")
+    return history
+
+
+def as_dicts(source):
+    return [{"input": input, "response": response} for input, response in source]
+
+
+def into(history):
+    def build(source):
+        for input, response in source:
+            history.append(input, response)
+        return history
+    return build
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    print(f"{args.turns} turns")
+    measure("list of dicts", as_dicts, args.turns)
+    measure("TurnHistory, all in memory", into(TurnHistory(window=None)), args.turns)
+    with tempfile.TemporaryDirectory() as path:
+        spill_path = os.path.join(path, "spill.log")
+        history = measure("TurnHistory, window 1000", into(TurnHistory(1000, spill_path, Fernet(Fernet.generate_key()))),
+                          args.turns)
+        history.close()
+        print(f"{'':<28} spill file {os.path.getsize(spill_path) / 2**20:.1f} MiB")
+        started = time.perf_counter()
+        count = sum(1 for _ in history)
+        print(f"{'':<28} lazy iteration over {count} turns: {time.perf_counter() - started:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Compares the compiled IntentMatcher with the original nested any() scan.
+
+Run from the repository root: python benchmarks/bench_intent_classifier.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nlp_pipeline.intent_matcher import IntentMatcher
+
+
+def legacy_classify_intent(intents, tokens):
+    # The implementation IntentClassifier used before the matcher was compiled
+    for intent, keywords in intents.items():
+        if any(keyword in tokens for keyword in keywords):
+            return intent
+    return "unknown"
+
+
+def synthetic_intents(count, keywords_per_intent=5, seed=0):
+    rng = random.Random(seed)
+    return {f"intent{i}": [f"kw{rng.randrange(count * 10)}" for _ in range(keywords_per_intent)] for i in range(count)}
+
+
+def synthetic_utterances(intents, count, length=20, seed=1):
+    rng = random.Random(seed)
+    keywords = [keyword for words in intents.values() for keyword in words]
+    utterances = []
+    for _ in range(count):
+        tokens = [f"word{rng.randrange(5000)}" for _ in range(length)]
+        if rng.random() < 0.5:
+            tokens[rng.randrange(length)] = rng.choice(keywords)
+        utterances.append(tokens)
+    return utterances
+
+
+def main():
+    for intent_count in (3, 100, 1000, 5000):
+        intents = synthetic_intents(intent_count)
+        utterances = synthetic_utterances(intents, 200)
+        matcher = IntentMatcher(intents)
+        for tokens in utterances:
+            expected = legacy_classify_intent(intents, tokens)
+            assert (matcher.match(tokens) or "unknown") == expected
+
+        legacy = min(timeit.repeat(lambda: [legacy_classify_intent(intents, t) for t in utterances], number=1, repeat=3))
+        compiled = min(timeit.repeat(lambda: [matcher.match(t) for t in utterances], number=1, repeat=3))
+        print(f"{intent_count:>5} intents: legacy {legacy / len(utterances) * 1e6:9.1f} us/utterance, "
+              f"compiled {compiled / len(utterances) * 1e6:6.1f} us/utterance ({legacy / compiled:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
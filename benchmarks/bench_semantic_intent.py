@@ -0,0 +1,54 @@
+"""Throughput of the NumPy intent model against the keyword IntentMatcher.
+
+Trains on nlp_pipeline/intent_examples.jsonl, then classifies synthetic
+utterances one at a time and in batches. Needs numpy.
+
+Run from the repository root: python benchmarks/bench_semantic_intent.py
+"""
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from nlp_pipeline.intent_classifier import IntentClassifier
+from nlp_pipeline.semantic_intent import SemanticIntentClassifier, read_examples, save_model, train
+from nlp_pipeline.tokenizer import Tokenizer
+
+
+def synthetic_utterances(examples, count, seed=1):
+    """Training utterances with random filler words around them."""
+    rng = random.Random(seed)
+    utterances = []
+    for _ in range(count):
+        tokens, _ = rng.choice(examples)
+        filler = [f"word{rng.randrange(5000)}" for _ in range(rng.randrange(12))]
+        utterances.append(filler[:len(filler) // 2] + tokens + filler[len(filler) // 2:])
+    return utterances
+
+
+def per_utterance_us(function, utterances):
+    return min(timeit.repeat(lambda: function(utterances), number=1, repeat=5)) / len(utterances) * 1e6
+
+
+def main():
+    examples = list(read_examples(os.path.join(ROOT, "nlp_pipeline", "intent_examples.jsonl"), Tokenizer().tokenize))
+    utterances = synthetic_utterances(examples, 5000)
+    with tempfile.TemporaryDirectory() as path:
+        save_model(path, *train(examples))
+        semantic = SemanticIntentClassifier(path)
+        rules = IntentClassifier()
+
+        print(f"keyword matcher:            {per_utterance_us(lambda batch: [rules.classify_intent(t) for t in batch], utterances):7.2f} us/utterance")
+        print(f"model, one at a time:       {per_utterance_us(lambda batch: [semantic.classify_intent(t) for t in batch], utterances):7.2f} us/utterance")
+        for batch_size in (32, 256, 5000):
+            batches = [utterances[i:i + batch_size] for i in range(0, len(utterances), batch_size)]
+            elapsed = per_utterance_us(lambda _: [semantic.classify_batch(batch) for batch in batches], utterances)
+            print(f"model, batches of {batch_size:<5}:  {elapsed:7.2f} us/utterance")
+
+
+if __name__ == "__main__":
+    main()
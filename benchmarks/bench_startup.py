@@ -0,0 +1,74 @@
+"""Cold-start budget for code_bot.py, measured with python -X importtime.
+
+Starts a fresh interpreter several times, imports code_bot and builds a CodeBot
+(everything that happens before the first prompt), then checks the median
+import time against a budget. Exits with status 1 when the budget is exceeded
+or when a module that should be deferred was imported.
+
+Run from the repository root: python benchmarks/bench_startup.py [--budget-ms 100]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP_CODE = "import code_bot; code_bot.CodeBot('startup_bench')"
+# Only needed once a context is saved or loaded, for process-pool batches or a trained intent model
+DEFERRED_MODULES = ("cryptography", "dotenv", "multiprocessing", "numpy")
+
+
+def measure_once():
+    """Returns (import time of code_bot in ms, wall time in ms, imported module names)."""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP_CODE],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    modules = set()
+    code_bot_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        if name.strip() == "code_bot":
+            code_bot_us = int(cumulative)
+    return code_bot_us / 1000, wall_ms, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="Median import time allowed for code_bot")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    import_times = []
+    wall_times = []
+    imported = set()
+    for _ in range(args.runs):
+        import_ms, wall_ms, modules = measure_once()
+        import_times.append(import_ms)
+        wall_times.append(wall_ms)
+        imported |= modules
+
+    median_import = statistics.median(import_times)
+    print(f"code_bot import: median {median_import:.1f} ms (budget {args.budget_ms:.1f} ms), "
+          f"interpreter start to CodeBot ready: median {statistics.median(wall_times):.1f} ms")
+
+    failed = False
+    eager = sorted({name.split(".")[0] for name in imported} & set(DEFERRED_MODULES))
+    if eager:
+        print(f"FAIL: imported at startup but should be deferred: {', '.join(eager)}")
+        failed = True
+    if median_import > args.budget_ms:
+        print("FAIL: startup import budget exceeded")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Compares the single-pass Tokenizer with the original findall-then-filter version on multi-MB inputs.
+
+Run from the repository root: python benchmarks/bench_tokenizer.py
+"""
+import keyword
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nlp_pipeline.tokenizer import Tokenizer
+
+STOPWORDS = {"the", "is", "a", "an", "in", "on", "of", "to", "and", "for"}
+PROGRAMMING_KEYWORDS = set(keyword.kwlist)
+
+
+def legacy_tokenize(text):
+    # The implementation Tokenizer used before the single-pass regex
+    tokens = re.findall(r"[a-zA-Z0-9_]+|[^\s\w]", text)
+    processed_tokens = []
+    for token in tokens:
+        if token in PROGRAMMING_KEYWORDS:
+            processed_tokens.append(token)
+        elif token.lower() not in STOPWORDS:
+            processed_tokens.append(token)
+    return processed_tokens
+
+
+def synthetic_text(size, seed=0):
+    rng = random.Random(seed)
+    words = ["The", "loop", "is", "written", "as", "for", "i", "in", "range", "(", "10", ")", ":",
+             "print", "of", "an", "And", "def", "x", "==", "->", "return", "a", "To", "+=", "\n"]
+    parts = []
+    length = 0
+    while length < size:
+        word = rng.choice(words)
+        parts.append(word)
+        length += len(word) + 1
+    return " ".join(parts)
+
+
+def main():
+    tokenizer = Tokenizer(detect_code=False)
+    for megabytes in (1, 4):
+        text = synthetic_text(megabytes * 1024 * 1024)
+        assert tokenizer.tokenize_prose(text) == legacy_tokenize(text)
+        legacy = min(timeit.repeat(lambda: legacy_tokenize(text), number=1, repeat=3))
+        single_pass = min(timeit.repeat(lambda: tokenizer.tokenize_prose(text), number=1, repeat=3))
+        offsets = min(timeit.repeat(lambda: sum(1 for _ in tokenizer.iter_tokens(text, offsets=True)), number=1, repeat=3))
+        print(f"{megabytes} MB: legacy {legacy * 1000:7.1f} ms, single pass {single_pass * 1000:7.1f} ms "
+              f"({legacy / single_pass:.2f}x), streaming offsets {offsets * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Benchmark suite for the NLP stages and context persistence, with JSON baselines.
+
+  python benchmarks/suite.py run [--quick] [--output results.json]   time every case
+  python benchmarks/suite.py save benchmarks/baseline.json           time every case and store a baseline
+  python benchmarks/suite.py compare benchmarks/baseline.json        time every case against a baseline
+  python benchmarks/suite.py compare baseline.json results.json      compare two stored result files
+
+compare exits with status 1 when any case's best round is slower than the
+baseline's by more than --threshold (10% by default); the best round is far
+less noisy than the mean or median. Inputs come from seeded synthetic
+prose and code corpora, so every run times the same work. Baselines only
+mean something on the machine that wrote them.
+
+Run from the repository root.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cryptography.fernet import Fernet
+from context_manager import ContextManager
+from nlp_pipeline.entity_recognizer import EntityRecognizer
+from nlp_pipeline.intent_classifier import IntentClassifier
+from nlp_pipeline.nlp_pipeline import NLPPipeline
+from nlp_pipeline.tokenizer import Tokenizer
+
+RESULTS_VERSION = 1
+HISTORY_SIZES = (10, 1000, 10000)
+
+WORDS = (
+    "the", "a", "my", "this", "is", "in", "of", "to", "and", "for", "how", "why", "what", "can", "you",
+    "loop", "list", "dict", "string", "error", "function", "class", "variable", "file", "module",
+    "python", "code", "help", "fix", "explain", "return", "value", "print", "import", "index",
+    "hello", "hi", "bye", "thanks", "please", "again", "works", "breaks", "slow", "crash",
+)
+OPENERS = ("hi", "hello", "can you help", "please explain", "why does", "how do I", "bye", "thanks")
+CODE_TEMPLATES = (
+    "def {name}(items):\n    total = 0\n    for item in items:\n        total += item * {n}\n    return total\n",
+    "class {Name}:\n    def __init__(self, value):\n        self.value = value\n\n    def {name}(self):\n        return self.value + {n}\n",
+    "import os\nfor path in os.listdir('.'):\n    if path.endswith('.py'):\n        print(path, {n})\n",
+    "result = [{name}(x) for x in range({n}) if x % 2 == 0]\n",
+)
+
+
+def prose_corpus(count, seed=1):
+    """Chat-style utterances of 3 to 25 words."""
+    rng = random.Random(seed)
+    return [" ".join([rng.choice(OPENERS)] + rng.choices(WORDS, k=rng.randrange(2, 25))) for _ in range(count)]
+
+
+def code_corpus(count, seed=2):
+    """Questions with a pasted Python snippet, like users send when asking about code."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        snippet = rng.choice(CODE_TEMPLATES).format(name=f"compute_{i % 50}", Name=f"Widget{i % 20}", n=i)
+        corpus.append(f"{rng.choice(OPENERS)} this code\n{snippet}")
+    return corpus
+
+
+def mixed_corpus(count):
+    prose = prose_corpus(count - count // 4)
+    return prose + code_corpus(count // 4)
+
+
+# Each case is (name, setup); setup returns (function timing one unit of work, units it does).
+# Results are reported per unit, so cases over a whole corpus read as time per utterance.
+
+def tokenize_case(corpus):
+    def setup():
+        tokenizer = Tokenizer()
+        return lambda: [tokenizer.tokenize(text) for text in corpus], len(corpus)
+    return setup
+
+
+def classify_case():
+    def setup():
+        tokenizer = Tokenizer()
+        classifier = IntentClassifier()
+        batch = [tokenizer.tokenize(text) for text in prose_corpus(500)]
+        return lambda: [classifier.classify_intent(tokens) for tokens in batch], len(batch)
+    return setup
+
+
+def entities_case():
+    def setup():
+        tokenizer = Tokenizer()
+        recognizer = EntityRecognizer()
+        batch = [tokenizer.tokenize(text) for text in mixed_corpus(500)]
+        return lambda: [recognizer.recognize_entities(tokens) for tokens in batch], len(batch)
+    return setup
+
+
+def process_input_case(corpus):
+    def setup():
+        pipeline = NLPPipeline()
+        return lambda: [pipeline.process_input(text) for text in corpus], len(corpus)
+    return setup
+
+
+def context_case(operation, turns, key):
+    def setup():
+        context_manager = ContextManager("bench", encryption_key=key, install_signal_handlers=False, history_window=None)
+        for text in prose_corpus(turns, seed=turns):
+            context_manager.update(intent="ask_for_help", input_text=text, response="How can I help you?")
+        context_manager.save_context()
+        if operation == "save":
+            return context_manager.save_context, 1
+        return ContextManager("bench", encryption_key=key, install_signal_handlers=False, history_window=None).load_context, 1
+    return setup
+
+
+def cases(key):
+    yield "tokenize/prose", tokenize_case(prose_corpus(500))
+    yield "tokenize/code", tokenize_case(code_corpus(200))
+    yield "classify_intent", classify_case()
+    yield "recognize_entities", entities_case()
+    yield "process_input/prose", process_input_case(prose_corpus(500))
+    yield "process_input/code", process_input_case(code_corpus(200))
+    for turns in HISTORY_SIZES:
+        yield f"save_context/{turns}", context_case("save", turns, key)
+        yield f"load_context/{turns}", context_case("load", turns, key)
+
+
+def measure(setup, repeat, min_seconds):
+    """Median and best time per unit, in microseconds, over `repeat` rounds of at least min_seconds each."""
+    function, units = setup()
+    function()  # Warm caches and build lazy stages outside the timing
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_seconds:
+        number *= 2
+    times = [elapsed / number / units * 1e6 for elapsed in timer.repeat(repeat=repeat, number=number)]
+    return {"median_us": statistics.median(times), "min_us": min(times), "rounds": repeat, "number": number}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(quick=False, only=None):
+    repeat, min_seconds = (3, 0.05) if quick else (7, 0.2)
+    key = Fernet.generate_key()
+    results = {}
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)  # Context files go to a scratch directory
+        try:
+            logging.disable(logging.INFO)  # "Context saved." on every round would swamp the output
+            for name, setup in cases(key):
+                if only and not any(pattern in name for pattern in only):
+                    continue
+                results[name] = measure(setup, repeat, min_seconds)
+                print(f"{name:<24} {results[name]['min_us']:12.2f} us", file=sys.stderr)
+        finally:
+            logging.disable(logging.NOTSET)
+            os.chdir(original_dir)
+    return {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=0.10):
+    """[(name, baseline us, current us, change, status)], status "regression", "improvement", "ok" or "new".
+
+    Compares the best round of each case.
+    """
+    rows = []
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        after = result["min_us"]
+        if before is None:
+            rows.append((name, None, after, None, "new"))
+            continue
+        change = after / before["min_us"] - 1
+        status = "regression" if change > threshold else "improvement" if change < -threshold else "ok"
+        rows.append((name, before["min_us"], after, change, status))
+    return rows
+
+
+def print_comparison(rows):
+    print(f"{'case':<24} {'baseline us':>12} {'current us':>12} {'change':>8}")
+    for name, before, after, change, status in rows:
+        before_text = f"{before:12.2f}" if before is not None else f"{'-':>12}"
+        change_text = f"{change:+8.1%}" if change is not None else f"{'-':>8}"
+        flag = "  REGRESSION" if status == "regression" else ""
+        print(f"{name:<24} {before_text} {after:12.2f} {change_text}{flag}")
+
+
+def read_results(path):
+    with open(path) as file:
+        results = json.load(file)
+    if results.get("version") != RESULTS_VERSION:
+        raise SystemExit(f"{path}: unsupported results version {results.get('version')}")
+    return results
+
+
+def write_results(path, results):
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+        file.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=["run", "save", "compare"])
+    parser.add_argument("paths", nargs="*", help="save: output file; compare: baseline [and current results]")
+    parser.add_argument("--output", help="Also write this run's results here")
+    parser.add_argument("--quick", action="store_true", help="Fewer, shorter rounds")
+    parser.add_argument("--only", nargs="+", help="Only cases whose name contains one of these")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    if args.mode in ("save", "compare") and not args.paths:
+        parser.error(f"{args.mode} needs a results file")
+    if args.mode == "compare" and len(args.paths) > 1:
+        current = read_results(args.paths[1])
+    else:
+        current = run_suite(args.quick, args.only)
+    if args.output:
+        write_results(args.output, current)
+
+    if args.mode == "run":
+        print(json.dumps(current, indent=2, sort_keys=True))
+    elif args.mode == "save":
+        write_results(args.paths[0], current)
+        print(f"Saved {len(current['results'])} results to {args.paths[0]}")
+    else:
+        rows = compare(read_results(args.paths[0]), current, args.threshold)
+        print_comparison(rows)
+        regressions = [row[0] for row in rows if row[4] == "regression"]
+        if regressions:
+            print(f"FAIL: {len(regressions)} regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
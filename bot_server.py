@@ -0,0 +1,331 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from nlp_pipeline.metrics import METRICS, PROFILER
+from nlp_pipeline.nlp_pipeline import NLPPipeline
+from context_manager import configure_logging
+from session_storage import SessionDirectory
+from session_store import SessionStore
+
+# Protocol: one JSON object per line in each direction.
+#   request:  {"user_id": "user123", "input": "hello", "id": 1}
+#   response: {"user_id": "user123", "id": 1, "response": "...", "intent": "greet"}
+# "id" is optional and echoed back. Responses on a connection come back in request order.
+
+
+class BotServer:
+    """Asyncio front-end serving many CodeBot sessions over line-delimited JSON."""
+
+    def __init__(self, session_store=None, pipeline=None, batch_size=32, batch_window=0.002,
+                 max_pending=1024, max_in_flight=64):
+        self.session_store = session_store if session_store is not None else SessionStore()
+        self.pipeline = pipeline if pipeline is not None else NLPPipeline()
+        self.batch_size = batch_size  # Most utterances handed to the pipeline in one go
+        self.batch_window = batch_window  # Seconds to wait for a batch to fill up
+        self.max_in_flight = max_in_flight  # Per-connection requests awaiting a response
+        self.pending = None  # Bounded queue of (user_id, text, future); a full queue stops socket reads
+        self.max_pending = max_pending
+        # One NLP thread resolves and records turns in arrival order, so a follow-up
+        # always sees its session's previous turn and context writes never overtake each other.
+        self.nlp_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nlp")
+        self.batcher = None
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=8765, unix_path=None):
+        self.pending = asyncio.Queue(self.max_pending)
+        self.batcher = asyncio.create_task(self._run_batches())
+        if unix_path:
+            self.server = await asyncio.start_unix_server(self._handle_connection, path=unix_path)
+        else:
+            self.server = await asyncio.start_server(self._handle_connection, host, port)
+        logging.info(f"Bot server listening on {self.address}.")
+        return self.server
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.nlp_executor, self.session_store.close)
+        self.nlp_executor.shutdown()
+
+    async def _handle_connection(self, reader, writer):
+        in_flight = deque()
+        slots = asyncio.Semaphore(self.max_in_flight)
+        has_work = asyncio.Event()
+        reading = True
+
+        async def write_responses():
+            # Await futures in request order so a session never sees replies reordered
+            try:
+                while reading or in_flight:
+                    if not in_flight:
+                        has_work.clear()
+                        await has_work.wait()
+                        continue
+                    pending = in_flight.popleft()
+                    try:
+                        message = await pending
+                        writer.write(json.dumps(message).encode() + b"\n")
+                        await writer.drain()
+                    finally:
+                        slots.release()
+            finally:
+                # Once replies can't be written, drop the queued requests and free their slots
+                # so the read loop below never waits on a slot that won't come back
+                while in_flight:
+                    in_flight.popleft().cancel()
+                    slots.release()
+
+        responder = asyncio.create_task(write_responses())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await slots.acquire()
+                if responder.done():
+                    break  # The connection can't be answered any more
+                in_flight.append(asyncio.ensure_future(self._submit(line)))
+                has_work.set()
+        finally:
+            reading = False
+            has_work.set()
+            try:
+                await responder
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def _submit(self, line):
+        try:
+            request = json.loads(line)
+            user_id = str(request["user_id"])
+            text = request["input"]
+        except (ValueError, KeyError, TypeError) as e:
+            return {"error": f"Invalid request: {e}"}
+        future = asyncio.get_running_loop().create_future()
+        await self.pending.put((user_id, text, future))
+        try:
+            response, intent = await future
+        except Exception as e:
+            return {"user_id": user_id, "error": f"Processing failed: {e}"}
+        message = {"user_id": user_id, "response": response, "intent": intent}
+        if "id" in request:
+            message["id"] = request["id"]
+        return message
+
+    async def _next_batch(self):
+        batch = [await self.pending.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.pending.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            turns = [(user_id, text) for user_id, text, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.nlp_executor, self._process_turns, turns)
+            except Exception as e:
+                logging.error(f"NLP batch failed: {e}")
+                for _, _, future in batch:
+                    if not future.done():  # Its request may have been cancelled meanwhile
+                        future.set_exception(e)
+                continue
+            for (_, _, future), (result, error) in zip(batch, results):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    def _process_turns(self, turns):
+        """Answers each (user_id, text) against its session's dialogue state and records it, in order.
+
+        Returns a ((response, intent), None) or (None, exception) pair per
+        turn, so a turn that fails only fails its own request.
+        """
+        results = []
+        for user_id, text in turns:
+            try:
+                context_manager = self.session_store.get(user_id)
+                response, intent, turn = self.pipeline.process_turn(text, context_manager.dialogue)
+            except Exception as e:
+                logging.error(f"NLP failed for user {user_id}: {e}")
+                results.append((None, e))
+                continue
+            try:
+                context_manager.update(intent=intent, entity=turn["entity"], entities=turn["entities"],
+                                       topic=turn["topic"], input_text=text, response=response)
+            except Exception as e:
+                logging.error(f"Failed to update context for user {user_id}: {e}")
+            results.append(((response, intent), None))
+        return results
+
+
+async def _handle_metrics_request(reader, writer):
+    # Just enough HTTP/1.0 for a Prometheus scrape or a curl:
+    #   GET /metrics                              Prometheus text
+    #   GET /metrics.json                         JSON snapshot
+    #   GET /profile?seconds=10&mode=sampling     profiles the running server, returns the report
+    try:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        while (await reader.readline()).strip():
+            pass  # Headers are not needed
+        if len(request_line) < 2 or request_line[0] != "GET":
+            status, content_type, body = "405 Method Not Allowed", "text/plain", "Only GET is supported\n"
+        else:
+            url = urlsplit(request_line[1])
+            query = parse_qs(url.query)
+            if url.path == "/metrics":
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4", METRICS.to_prometheus()
+            elif url.path == "/metrics.json":
+                status, content_type, body = "200 OK", "application/json", METRICS.to_json()
+            elif url.path == "/profile":
+                try:
+                    seconds = float(query.get("seconds", ["10"])[0])
+                    mode = query.get("mode", ["sampling"])[0]
+                    report = await asyncio.get_running_loop().run_in_executor(None, PROFILER.profile_for, seconds, mode)
+                    status, content_type, body = "200 OK", "text/plain", report
+                except ValueError as e:
+                    status, content_type, body = "400 Bad Request", "text/plain", f"{e}\n"
+                except RuntimeError as e:  # Already profiling
+                    status, content_type, body = "409 Conflict", "text/plain", f"{e}\n"
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", "Try /metrics, /metrics.json or /profile\n"
+        payload = body.encode()
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+        await writer.drain()
+    except ConnectionError as e:
+        logging.error(f"Metrics request failed: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host="127.0.0.1", port=9765):
+    """Serves METRICS and the profiling hook over HTTP, next to the bot server."""
+    server = await asyncio.start_server(_handle_metrics_request, host, port)
+    logging.info(f"Metrics served on http://{host}:{server.sockets[0].getsockname()[1]}/metrics.")
+    return server
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_load(connect, sessions=100, requests_per_session=20, utterances=("hi", "help me with this loop", "bye")):
+    """Drives `sessions` concurrent connections and returns latency stats in milliseconds.
+
+    connect is a coroutine function returning a (reader, writer) pair.
+    """
+    latencies = []
+
+    async def session(index):
+        reader, writer = await connect()
+        user_id = f"load{index}"
+        for number in range(requests_per_session):
+            request = {"user_id": user_id, "id": number, "input": utterances[number % len(utterances)]}
+            started = time.perf_counter()
+            writer.write(json.dumps(request).encode() + b"\n")
+            await writer.drain()
+            reply = json.loads(await reader.readline())
+            latencies.append((time.perf_counter() - started) * 1000)
+            if reply.get("id") != number:
+                raise RuntimeError(f"Out of order reply for {user_id}: {reply}")
+        writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(index) for index in range(sessions)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+    }
+
+
+async def _serve(args):
+    store = SessionStore(max_sessions=args.max_sessions, write_behind=args.write_behind,
+                         storage=SessionDirectory(args.session_root))
+    store.install_signal_handlers()
+    # With --nlp-pool the models live in nlp_worker_pool.py's workers, shared with other bot processes
+    if args.nlp_pool:
+        from nlp_worker_pool import NLPClient
+        pipeline = NLPClient(args.nlp_pool)
+    else:
+        pipeline = NLPPipeline(cache_size=args.cache_size)
+    server = BotServer(store, pipeline, batch_size=args.batch_size)
+    await server.start(args.host, args.port, args.unix)
+    if args.metrics_port is not None:
+        await start_metrics_server(args.host, args.metrics_port)
+    async with server.server:
+        await server.server.serve_forever()
+
+
+async def _bench(args):
+    store = SessionStore(max_sessions=args.max_sessions, write_behind=args.write_behind)
+    server = BotServer(store, NLPPipeline(cache_size=args.cache_size), batch_size=args.batch_size)
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        # Keep the load generator's session files out of the working directory
+        os.chdir(scratch)
+        await server.start("127.0.0.1", 0)
+        host, port = server.address[:2]
+        try:
+            stats = await run_load(lambda: asyncio.open_connection(host, port),
+                                   sessions=args.sessions, requests_per_session=args.requests)
+        finally:
+            await server.close()
+            os.chdir(original_dir)
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve CodeBot over line-delimited JSON.")
+    parser.add_argument("mode", choices=["serve", "bench"], nargs="?", default="serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="Listen on this Unix socket path instead of TCP")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-sessions", type=int, default=10000)
+    parser.add_argument("--cache-size", type=int, default=0, help="Cache results for this many distinct utterances")
+    parser.add_argument("--nlp-pool", help="Send NLP work to the nlp_worker_pool.py listening on this Unix socket")
+    parser.add_argument("--write-behind", type=float, help="Save each session this many seconds after its first unsaved update")
+    parser.add_argument("--session-root", help="Keep session files in this directory, sharded by user id, "
+                                               "instead of the working directory")
+    parser.add_argument("--metrics-port", type=int, help="Serve /metrics, /metrics.json and /profile over HTTP on this port")
+    parser.add_argument("--sessions", type=int, default=100, help="Concurrent sessions for bench mode")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per session for bench mode")
+    args = parser.parse_args()
+    configure_logging()
+    asyncio.run(_serve(args) if args.mode == "serve" else _bench(args))
@@ -1,15 +1,34 @@
-from context_manager import ContextManager
+from context_manager import ContextManager, configure_logging
 from nlp_pipeline.nlp_pipeline import NLPPipeline
+from nlp_pool_errors import NLPPoolError
 import logging
+import os
 import sys
 class CodeBot:
-    def __init__(self, user_id):
-        self.context_manager = ContextManager(user_id)
-        self.nlp_pipeline = NLPPipeline()
+    def __init__(self, user_id, session_store=None, nlp_pipeline=None):
+        # Bots serving many users share one SessionStore instead of owning a ContextManager each
+        if session_store is not None:
+            self.context_manager = session_store.get(user_id)
+        else:
+            self.context_manager = ContextManager(user_id)
+        if nlp_pipeline is not None:
+            self.nlp_pipeline = nlp_pipeline
+        elif os.environ.get("NLP_POOL_SOCKET"):
+            # Bot processes on one machine share the models loaded by nlp_worker_pool.py
+            from nlp_worker_pool import NLPClient
+            self.nlp_pipeline = NLPClient(os.environ["NLP_POOL_SOCKET"])
+        else:
+            self.nlp_pipeline = NLPPipeline()
 
     def handle_input(self, user_input):
-        response, intent = self.nlp_pipeline.process_input(user_input)
-        self.context_manager.update(intent=intent, input_text=user_input, response=response)
+        # Follow-ups like "what about that?" are resolved against what this session talked about
+        try:
+            response, intent, turn = self.nlp_pipeline.process_turn(user_input, self.context_manager.dialogue)
+        except NLPPoolError as e:
+            logging.error(f"NLP pool unavailable: {e}")
+            return "Sorry, I can't answer right now. Please try again in a moment."  # The turn isn't recorded
+        self.context_manager.update(intent=intent, entity=turn["entity"], entities=turn["entities"], topic=turn["topic"],
+                                    input_text=user_input, response=response)
         return response
     
     def start(self):
@@ -29,6 +48,7 @@ class CodeBot:
                     logging.info(response)
 
 if __name__ == "__main__":
+    configure_logging()
     user_id = "user123"
     bot = CodeBot(user_id)
     bot.context_manager.load_context()  # Simulate loading the saved context
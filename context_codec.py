@@ -0,0 +1,219 @@
+import json
+import os
+import struct
+import sys
+from array import array
+
+# Files written by a ContextCodec start with this header; anything else is a
+# legacy file (a bare Fernet token over JSON), so old session_context_*.json
+# files keep loading. Fernet tokens are base64 text and never start with NUL.
+MAGIC = b"\x00CB"
+FORMAT_VERSION = 1
+FILE_HEADER = struct.Struct(">3sBBBB")  # magic, version, serializer, compression, encryption
+
+SERIALIZERS = {"json": 0, "binary": 1}
+COMPRESSIONS = {"none": 0, "zlib": 1, "lzma": 2}
+ENCRYPTIONS = {"fernet": 0, "aesgcm": 1}
+
+# The binary layout: meta JSON (every context key but history), then the
+# distinct responses, one response index per turn and the turn inputs, each
+# string list stored as a uint32 length array plus the concatenated UTF-8.
+BINARY_HEADER = struct.Struct("<IIII")  # meta bytes, turns, distinct responses, input bytes
+AESGCM_NONCE_SIZE = 12
+
+
+def _lengths(encoded):
+    lengths = array("I", map(len, encoded))
+    if sys.byteorder == "big":
+        lengths.byteswap()  # The file layout is little-endian
+    return lengths
+
+
+def _read_array(data, offset, count):
+    values = array("I")
+    end = offset + count * values.itemsize
+    values.frombytes(data[offset:end])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values, end
+
+
+def _read_strings(data, offset, lengths):
+    strings = []
+    for length in lengths:
+        end = offset + length
+        strings.append(str(data[offset:end], "utf-8"))
+        offset = end
+    return strings, offset
+
+
+def serialize_binary(context):
+    """Packs a context dict whose history is a sequence of {"input", "response"} turns."""
+    meta = json.dumps({key: value for key, value in context.items() if key != "history"}).encode()
+    history = context.get("history") or ()
+    response_ids = {}
+    indexes = array("I")
+    inputs = []
+    for turn in history:
+        indexes.append(response_ids.setdefault(turn["response"], len(response_ids)))
+        inputs.append(turn["input"].encode())
+    if sys.byteorder == "big":
+        indexes.byteswap()
+    responses = [response.encode() for response in response_ids]
+    input_blob = b"".join(inputs)
+    return b"".join((
+        BINARY_HEADER.pack(len(meta), len(inputs), len(responses), len(input_blob)),
+        meta,
+        _lengths(responses).tobytes(), *responses,
+        indexes.tobytes(),
+        _lengths(inputs).tobytes(), input_blob,
+    ))
+
+
+def deserialize_binary(data):
+    data = memoryview(data)
+    try:
+        meta_size, turn_count, response_count, input_size = BINARY_HEADER.unpack_from(data)
+        offset = BINARY_HEADER.size
+        context = json.loads(str(data[offset:offset + meta_size], "utf-8"))
+        offset += meta_size
+        response_lengths, offset = _read_array(data, offset, response_count)
+        responses, offset = _read_strings(data, offset, response_lengths)
+        indexes, offset = _read_array(data, offset, turn_count)
+        input_lengths, offset = _read_array(data, offset, turn_count)
+        inputs, offset = _read_strings(data, offset, input_lengths)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed binary context: {e}") from e
+    if offset != len(data) or len(inputs) != turn_count:
+        raise ValueError("Malformed binary context: unexpected length")
+    context["history"] = [{"input": text, "response": responses[index]} for text, index in zip(inputs, indexes)]
+    return context
+
+
+def _compress(compression, data):
+    if compression == "zlib":
+        import zlib
+        return zlib.compress(data, 6)
+    if compression == "lzma":
+        import lzma
+        return lzma.compress(data, preset=1)
+    return data
+
+
+def _decompress(compression_id, data):
+    if compression_id == COMPRESSIONS["zlib"]:
+        import zlib
+        return zlib.decompress(data)
+    if compression_id == COMPRESSIONS["lzma"]:
+        import lzma
+        return lzma.decompress(data)
+    return data
+
+
+def aesgcm_for(key):
+    """The AES-GCM cipher for a Fernet key, through HKDF so the two never share key material."""
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+    key_bytes = key.encode() if isinstance(key, str) else key
+    derived = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                   info=b"codebot session context aes-gcm").derive(key_bytes)
+    return AESGCM(derived)
+
+
+class ContextCodec:
+    """Turns a context dict into the bytes of a session_context_* file and back.
+
+    serializer is "json" or "binary" (see serialize_binary), compression is
+    "none", "zlib" or "lzma" and is applied before encryption, and encryption
+    is "fernet" or "aesgcm". AES-GCM writes nonce + ciphertext + tag with no
+    base64 layer, using a key derived from the session's Fernet key with HKDF.
+
+    The default codec writes the legacy format, a bare Fernet token over JSON.
+    Any other combination writes a small header naming the format, and decode()
+    reads the header, so files in any format (legacy included) load with any codec.
+    """
+
+    def __init__(self, serializer="json", compression="none", encryption="fernet", key=None):
+        for name, value, choices in (("serializer", serializer, SERIALIZERS), ("compression", compression, COMPRESSIONS),
+                                     ("encryption", encryption, ENCRYPTIONS)):
+            if value not in choices:
+                raise ValueError(f"Unknown {name} {value!r}, expected one of {', '.join(choices)}")
+        self.serializer = serializer
+        self.compression = compression
+        self.encryption = encryption
+        self.key = key  # Fernet key for AES-GCM; by default it comes from the cipher
+        self.aead = None
+        self.aead_key = None
+
+    @property
+    def legacy(self):
+        return (self.serializer, self.compression, self.encryption) == ("json", "none", "fernet")
+
+    def _aesgcm(self, cipher):
+        key = self.key or getattr(cipher, "key", lambda: None)()
+        if not key:
+            raise ValueError("AES-GCM needs the Fernet key: pass key= or use a LazyCipher")
+        if self.aead is None or key != self.aead_key:
+            self.aead = aesgcm_for(key)
+            self.aead_key = key
+        return self.aead
+
+    def _aesgcm_open(self, cipher, nonce, sealed, header):
+        # The main key first; the cipher's decryption-only keys are tried only if it fails
+        from cryptography.exceptions import InvalidTag
+        try:
+            return self._aesgcm(cipher).decrypt(nonce, sealed, header)
+        except InvalidTag:
+            others = [] if self.key else getattr(cipher, "keys", lambda: [])()[1:]
+            for key in others:
+                try:
+                    return aesgcm_for(key).decrypt(nonce, sealed, header)
+                except InvalidTag:
+                    continue
+            raise
+
+    def encode(self, context, cipher):
+        if self.serializer == "binary":
+            payload = serialize_binary(context)
+        else:
+            payload = json.dumps(context).encode()
+        if self.legacy:
+            return cipher.encrypt(payload)
+        payload = _compress(self.compression, payload)
+        header = FILE_HEADER.pack(MAGIC, FORMAT_VERSION, SERIALIZERS[self.serializer],
+                                  COMPRESSIONS[self.compression], ENCRYPTIONS[self.encryption])
+        if self.encryption == "aesgcm":
+            nonce = os.urandom(AESGCM_NONCE_SIZE)
+            # The header is authenticated too, so it can't be swapped for another format
+            return header + nonce + self._aesgcm(cipher).encrypt(nonce, payload, header)
+        return header + cipher.encrypt(payload)
+
+    def decrypt(self, data, cipher):
+        """Returns (serializer id, plaintext) for a file in any supported format.
+
+        Raises whatever the cipher raises for a wrong key or tampered file.
+        """
+        if not data.startswith(MAGIC):
+            return SERIALIZERS["json"], cipher.decrypt(data)
+        if len(data) < FILE_HEADER.size:
+            raise ValueError("Truncated context file header")
+        _, version, serializer_id, compression_id, encryption_id = FILE_HEADER.unpack_from(data)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported context file version {version}")
+        header = data[:FILE_HEADER.size]
+        body = data[FILE_HEADER.size:]
+        if encryption_id == ENCRYPTIONS["aesgcm"]:
+            plaintext = self._aesgcm_open(cipher, body[:AESGCM_NONCE_SIZE], body[AESGCM_NONCE_SIZE:], header)
+        else:
+            plaintext = cipher.decrypt(body)
+        return serializer_id, _decompress(compression_id, plaintext)
+
+    def deserialize(self, serializer_id, plaintext):
+        """Builds the context dict from decrypt()'s output; raises ValueError for malformed data."""
+        if serializer_id == SERIALIZERS["binary"]:
+            return deserialize_binary(plaintext)
+        return json.loads(plaintext)
+
+    def decode(self, data, cipher):
+        return self.deserialize(*self.decrypt(data, cipher))
@@ -1,51 +1,180 @@
-import json
 import logging
 import signal
 import sys
 import time
-from threading import Timer
+from threading import Lock, RLock, Timer
 import os
-from cryptography.fernet import Fernet  # For encryption (requires installation via `pip install cryptography`)
-from dotenv import load_dotenv, set_key  # Import functions for loading and saving to .env file
+from context_codec import ContextCodec
+from history_log import HistoryLog
+from nlp_pipeline.dialogue_state import DialogueState
+from nlp_pipeline.metrics import METRICS
+from session_storage import SessionDirectory
+from turn_history import TurnHistory
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+SAVE_SECONDS = METRICS.histogram("codebot_context_save_seconds", "Time to encode and atomically write a context snapshot.")
+LOAD_SECONDS = METRICS.histogram("codebot_context_load_seconds", "Time to read, decrypt and decode a context file.")
+BYTES_WRITTEN = METRICS.counter("codebot_context_bytes_written_total", "Bytes of context snapshots written.")
+BYTES_READ = METRICS.counter("codebot_context_bytes_read_total", "Bytes of context files read.")
+
+def configure_logging():
+    """Logging setup for the command-line entry points, kept out of import time."""
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+    sys.stdout.flush()  # Force flush to ensure logs are printed immediately
+
+def decryption_keys_from_env():
+    """Extra keys from DECRYPTION_KEYS (comma-separated) that are accepted for reading but never used to write."""
+    return [key for key in os.getenv("DECRYPTION_KEYS", "").split(",") if key.strip()]
+
+def load_cipher(encryption_key=None, decryption_keys=None):
+    """Builds the Fernet cipher from ENCRYPTION_KEY, generating and storing a key in .env if missing.
+
+    An explicit encryption_key is used as is and leaves .env alone. With
+    decryption keys (by default DECRYPTION_KEYS, for the .env key only) the
+    result is a MultiFernet: it encrypts with the main key and decrypts with
+    any of them, which is what lets key_rotation.py change keys online.
+    """
+    # cryptography and dotenv are slow to import, so they wait until the first save or load
+    from cryptography.fernet import Fernet, MultiFernet  # For encryption (requires installation via `pip install cryptography`)
+    if encryption_key:
+        primary = Fernet(encryption_key)
+    else:
+        from dotenv import load_dotenv, set_key  # Import functions for loading and saving to .env file
+
+        # Load environment variables from .env file
+        load_dotenv()
+
+        # Check if the key already exists in the .env file
+        if "ENCRYPTION_KEY" not in os.environ:
+            encryption_key = Fernet.generate_key()
+            set_key('.env', 'ENCRYPTION_KEY', encryption_key.decode())
+            os.environ["ENCRYPTION_KEY"] = encryption_key.decode()
+            logging.debug("Encryption key generated and stored in .env file.")
+        else:
+            logging.debug("Encryption key already exists in .env file.")
+
+        # Use the encryption key from the environment
+        primary = Fernet(os.getenv("ENCRYPTION_KEY"))
+        if decryption_keys is None:
+            decryption_keys = decryption_keys_from_env()
+    if not decryption_keys:
+        return primary
+    return MultiFernet([primary] + [Fernet(key.strip()) for key in decryption_keys])
+
+FSYNC_POLICIES = ("none", "file", "full")
+
+def atomic_write(path, data, fsync_policy="full"):
+    """Replaces the file at path with data so a crash leaves either the old or the new file, never a torn one.
+
+    fsync_policy "file" forces the data onto disk before the rename, "full"
+    also syncs the directory so the rename itself survives a power loss, and
+    "none" leaves both to the OS. Every call writes its own temp file, so
+    concurrent writers of one path (another process, a key rotation sweep)
+    can't publish each other's half-written data.
+    """
+    import tempfile  # Only needed once something is saved
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                     prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+            if fsync_policy != "none":
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    if fsync_policy == "full" and hasattr(os, "O_DIRECTORY"):
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+class LazyCipher:
+    """Stands in for the Fernet cipher and only builds it on the first encrypt or decrypt."""
+
+    def __init__(self, encryption_key=None, decryption_keys=None):
+        self.encryption_key = encryption_key
+        self.decryption_keys = decryption_keys
+        self.cipher = None
+
+    def load(self):
+        if self.cipher is None:
+            self.cipher = load_cipher(self.encryption_key, self.decryption_keys)
+        return self.cipher
+
+    def encrypt(self, data):
+        return self.load().encrypt(data)
+
+    def decrypt(self, token):
+        return self.load().decrypt(token)
+
+    def key(self):
+        """The Fernet key itself, for codecs that derive their own keys from it."""
+        self.load()
+        return self.encryption_key or os.getenv("ENCRYPTION_KEY")
+
+    def keys(self):
+        """The main key followed by the decryption-only keys."""
+        key = self.key()
+        if self.decryption_keys is not None:
+            return [key] + list(self.decryption_keys)
+        return [key] + ([] if self.encryption_key else decryption_keys_from_env())
 
-sys.stdout.flush()  # Force flush to ensure logs are printed immediately
 class ContextManager:
-    def __init__(self, user_id, inactivity_timeout=600, timeout=300, encryption_key=None):
+    def __init__(self, user_id, inactivity_timeout=600, timeout=300, encryption_key=None, append_log=False, compact_every=1000,
+                 cipher=None, scheduler=None, install_signal_handlers=True, history_window=1000, codec=None,
+                 write_behind=None, fsync_policy="full", storage=None):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync_policy must be one of {', '.join(FSYNC_POLICIES)}")
         self.user_id = user_id
+        # Where this session's files live; by default the working directory, as always
+        self.storage = storage if storage is not None else SessionDirectory()
+        self.storage.prepare(user_id)
+        # A SessionStore hands every session the same cipher instead of re-reading .env
+        self.cipher = cipher if cipher is not None else LazyCipher(encryption_key)
+        # Format of the context file; loading detects the format of whatever file is there
+        self.codec = codec if codec is not None else ContextCodec()
+        # Only the newest history_window turns stay in memory, older ones are spilled to an encrypted file
+        self.history = TurnHistory(history_window, self.storage.path(user_id, "history"), self.cipher)
+        # Entity -> latest turn and topic changes, for NLPPipeline.process_turn() to resolve follow-ups with
+        self.dialogue = DialogueState()
         self.context = {
             "user_id": user_id,
             "last_intent": None,
             "last_entity": None,
             "topic": None,
-            "history": []
+            "history": self.history,
+            "dialogue": self.dialogue,
         }
         self.last_interaction_time = time.time()
         self.inactivity_timeout = inactivity_timeout  # Timeout for inactivity (e.g., 600 seconds)
         self.timeout = timeout  # Timeout for periodic archival (e.g., 300 seconds)
-        self.context_file_path = f"session_context_{user_id}.json"
+        self.context_file_path = self.storage.path(user_id, "context")
         self.timer = None
         self.is_terminated = False
+        self.append_log = append_log  # Append each update to a log instead of rewriting the whole file
+        self.compact_every = compact_every  # Number of logged updates before save_context() writes a new snapshot
+        self.log_seq = 0  # Sequence number of the last update applied to the context
+        self.dirty = False  # True while there are updates that save_context() hasn't written yet
+        self.scheduler = scheduler  # Shared InactivityScheduler, replaces the per-session Timer thread
+        # With write_behind (seconds), updates mark the context dirty and a background write
+        # follows that long after the first of them, so a burst of updates costs one write
+        self.write_behind = write_behind
+        self.fsync_policy = fsync_policy
+        self.lock = RLock()  # Guards the context while it is updated or copied for a snapshot
+        self.write_lock = Lock()  # One writer at a time for the context file
+        self.written_seq = 0  # log_seq of the newest snapshot on disk
+        self.history_log = HistoryLog(self.storage.path(user_id, "log"), self.cipher) if append_log else None
 
-         # Load environment variables from .env file
-        load_dotenv()
-
-        # Check if the key already exists in the .env file
-        if "ENCRYPTION_KEY" not in os.environ:
-            encryption_key = Fernet.generate_key()
-            set_key('.env', 'ENCRYPTION_KEY', encryption_key.decode())
-            logging.debug("Encryption key generated and stored in .env file.")
-        else:
-            logging.debug("Encryption key already exists in .env file.")
-        
-        # Use the encryption key from the environment
-        self.cipher = Fernet(os.getenv("ENCRYPTION_KEY"))
-
-        # Set up signal handlers for graceful exit
-        signal.signal(signal.SIGINT, self.signal_handler)  # Catch Ctrl+C
-        signal.signal(signal.SIGTERM, self.signal_handler)  # Catch termination requests
+        if install_signal_handlers:
+            # Set up signal handlers for graceful exit
+            signal.signal(signal.SIGINT, self.signal_handler)  # Catch Ctrl+C
+            signal.signal(signal.SIGTERM, self.signal_handler)  # Catch termination requests
 
     def signal_handler(self, sig, frame):
         """Handles termination signals and gracefully archives context."""
@@ -56,45 +185,133 @@ class ContextManager:
     def update(self, **kwargs):
         """Updates the context based on new input and response."""
         self.last_interaction_time = time.time()  # Update the timestamp of the last interaction
-        if "intent" in kwargs:
-            self.context["last_intent"] = kwargs["intent"]
-        if "entity" in kwargs:
-            self.context["last_entity"] = kwargs["entity"]
-        if "topic" in kwargs:
-            self.context["topic"] = kwargs["topic"]
+        record = {key: kwargs[key] for key in ("intent", "entity", "entities", "topic") if key in kwargs}
         if "input_text" in kwargs and "response" in kwargs:
-            self.context["history"].append({"input": kwargs["input_text"], "response": kwargs["response"]})
-        
+            record["input"] = kwargs["input_text"]
+            record["response"] = kwargs["response"]
+        with self.lock:
+            record["seq"] = self.log_seq + 1
+            self.apply_record(record)
+            self.dirty = True
+            if self.history_log:
+                try:
+                    self.history_log.append(record)
+                except Exception as e:
+                    logging.error(f"Failed to append to history log: {e}")
+        if self.write_behind is not None:
+            self.schedule_flush()
+
         # Reset the inactivity timer and log the context
         self.reset_timer()
-        logging.debug(f"Context updated for user {self.user_id}. Current context: {self.context}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Context updated for user {self.user_id}. Current context: {self.context}")
+
+    def apply_record(self, record):
+        """Applies one update record, either a live update or one replayed from the history log."""
+        if "intent" in record:
+            self.context["last_intent"] = record["intent"]
+        if "entity" in record:
+            self.context["last_entity"] = record["entity"]
+        if "topic" in record:
+            self.context["topic"] = record["topic"]
+        if "input" in record and "response" in record:
+            self.history.append(record["input"], record["response"])
+            entities = record.get("entities")
+            if entities is None:
+                entities = [(record["entity"], None)] if record.get("entity") is not None else ()
+            self.dialogue.record(record.get("intent"), entities, record.get("topic"))
+        self.log_seq = record["seq"]
 
     def reset_timer(self):
         """Resets the inactivity timer."""
+        if self.scheduler:
+            self.scheduler.schedule(self.user_id, self.timeout, self.on_timeout)
+            return
         if self.timer:
             self.timer.cancel()
         self.timer = Timer(self.timeout, self.on_timeout)
         self.timer.daemon = True
         self.timer.start()
 
+    def schedule_flush(self):
+        """Queues a background save write_behind seconds from now, unless one is already queued."""
+        if self.scheduler is None:
+            from session_store import InactivityScheduler
+            self.scheduler = InactivityScheduler()
+        self.scheduler.schedule(("flush", self.user_id), self.write_behind, self.save_context, coalesce=True)
+
+    def flush(self):
+        """Writes any pending updates now and returns once they are on disk."""
+        if self.scheduler:
+            self.scheduler.cancel(("flush", self.user_id))
+        if self.dirty:
+            self.save_context()
+
     def on_timeout(self):
         """Saves context after inactivity timeout without terminating the session."""
         logging.info("Inactivity timeout reached. Saving context...")
         self.save_context()
 
     def save_context(self):
-        """Saves the current context to an encrypted JSON file."""
+        """Saves the current context to an encrypted JSON file.
+
+        With the append-only history log enabled, updates are already on disk, so
+        this only syncs the log and rewrites the snapshot every compact_every updates.
+
+        Safe to call from any thread. Updates that arrive while a save is in
+        progress keep the context dirty for the next one.
+        """
         try:
             if not self.is_terminated:
-                # Encrypt context before saving
-                context_data = json.dumps(self.context).encode()
-                encrypted_data = self.cipher.encrypt(context_data)
-                with open(self.context_file_path, "wb") as file:
-                    file.write(encrypted_data)
+                if self.history_log and self.history_log.record_count < self.compact_every:
+                    with self.lock:
+                        seq = self.log_seq
+                        self.history_log.sync()
+                    self.mark_clean(seq)
+                    logging.info(f"Context saved.")
+                    return
+                seq = self.write_snapshot()
+                if self.history_log:
+                    with self.lock:
+                        if self.log_seq == seq:
+                            self.history_log.truncate()
+                        # Otherwise newer records stay in the log; replay skips the ones the snapshot covers
+                self.mark_clean(seq)
                 logging.info(f"Context saved.")
         except Exception as e:
             logging.error(f"Failed to save context: {e}")
 
+    def mark_clean(self, seq):
+        with self.lock:
+            if self.log_seq == seq:
+                self.dirty = False
+
+    def write_snapshot(self):
+        """Encrypts the full context and atomically replaces the context file; returns the log_seq it covers."""
+        with self.lock:
+            # Spilled turns must be on disk before a snapshot that counts them
+            self.history.sync()
+            turns, spilled, spill_size = self.history.to_snapshot()
+            context = dict(self.context, history=turns, dialogue=self.dialogue.to_dict())
+            if spilled:
+                context["history_spilled"] = spilled
+                context["history_spill_size"] = spill_size
+            seq = self.log_seq
+            if self.history_log:
+                # Remember which log records the snapshot already covers
+                context["log_seq"] = seq
+        with self.write_lock:
+            if seq < self.written_seq:
+                return seq  # A newer snapshot was written while this one waited
+            started = time.perf_counter()
+            # Serialize and encrypt context before saving
+            encrypted_data = self.codec.encode(context, self.cipher)
+            atomic_write(self.context_file_path, encrypted_data, self.fsync_policy)
+            self.written_seq = seq
+            SAVE_SECONDS.observe(time.perf_counter() - started)
+            BYTES_WRITTEN.inc(len(encrypted_data))
+        return seq
+
     def manual_save(self):
         """Allows the user to manually save the context."""
         logging.info("Saving context...")
@@ -109,44 +326,86 @@ class ContextManager:
         sys.exit(0)  # Terminate the session manually
 
     def load_context(self):
-        """Load the context from the encrypted JSON file if it exists."""
+        """Load the context from the encrypted JSON file if it exists.
+
+        Returns True when a saved context was loaded, False when there was none or it couldn't be read.
+        """
+        loaded = False
         if os.path.exists(self.context_file_path):
             logging.debug("os path exists")
+            started = time.perf_counter()
             try:
                 with open(self.context_file_path, "rb") as file:
                     encrypted_data = file.read()
                     logging.debug("Encrypted data read.")
+                    BYTES_READ.inc(len(encrypted_data))
                 
                     # Try decrypting and decoding
                     try:
-                        context_data = self.cipher.decrypt(encrypted_data).decode()
+                        serializer, context_data = self.codec.decrypt(encrypted_data, self.cipher)
                         logging.debug("Decryption successful.")
                     except Exception as decryption_error:
                         logging.error(f"Decryption failed: {decryption_error}")
-                        return  # Exit the method early, as decryption failed
+                        return False  # Exit the method early, as decryption failed
                     
-                    # Try loading the context as JSON
+                    # Try loading the context (JSON or the binary layout)
                     try:
-                        self.context = json.loads(context_data)
+                        self.context = self.codec.deserialize(serializer, context_data)
+                        self.log_seq = self.context.pop("log_seq", 0)
+                        self.history.restore(self.context.get("history") or [],
+                                             self.context.pop("history_spilled", 0),
+                                             self.context.pop("history_spill_size", 0))
+                        self.context["history"] = self.history
+                        self.dialogue.restore(self.context.get("dialogue"), len(self.history))
+                        self.context["dialogue"] = self.dialogue
+                        LOAD_SECONDS.observe(time.perf_counter() - started)
+                        loaded = True
                         logging.info("Context loaded.")
                         logging.debug(f"Context for user {self.user_id} loaded.")
-                    except json.JSONDecodeError as json_error:
-                        logging.error(f"Error decoding JSON: {json_error}")
-                        self.clear_context()
+                    except ValueError as decode_error:  # Includes json.JSONDecodeError
+                        logging.error(f"Error decoding context: {decode_error}")
+                        self.reset_context()
             except Exception as e:
                 # Catch any unexpected errors and log them
                 logging.error(f"Decryption failed for user {self.user_id}: {e}")
-                self.clear_context()
+                self.reset_context()
         else:
             logging.info(f"No saved context found. Starting fresh.")
+            # A spill file without a snapshot was left by a session that died before
+            # its first save; none of its blocks belong to this history
+            self.history.restore([], 0, 0)
+        if self.history_log:
+            self.replay_history_log()
+        return loaded
+
+    def replay_history_log(self):
+        """Applies the logged updates that are newer than the loaded snapshot."""
+        replayed = 0
+        try:
+            for record in self.history_log.replay():
+                if record["seq"] > self.log_seq:
+                    self.apply_record(record)
+                    replayed += 1
+        except Exception as e:
+            logging.error(f"Failed to replay history log for user {self.user_id}: {e}")
+        self.history_log.record_count = replayed
+        logging.debug(f"Replayed {replayed} logged updates.")
 
 
     def clear_context(self):
-        """Clear the current context."""
+        """Clear the current context, spilled history on disk included."""
+        self.reset_context()
+        self.history.clear()
+        logging.info(f"Context cleared.")
+
+    def reset_context(self):
+        """Starts over in memory after a failed load; nothing on disk is touched, so a later load can still succeed."""
         self.context = {key: None for key in self.context.keys()}
-        self.context["history"] = []
+        self.history.reset()
+        self.context["history"] = self.history
+        self.dialogue.restore(None)
+        self.context["dialogue"] = self.dialogue
         self.last_interaction_time = time.time()
-        logging.info(f"Context cleared.")
 
     def get_summary(self):
         """Retrieve a summary of the current context."""
@@ -174,6 +433,7 @@ class ContextManager:
                 logging.info(response) """
 
 if __name__ == "__main__":
+    configure_logging()
     logging.info("Context Manager is running...")
     # Example usage:
 # context_manager = ContextManager(user_id="user123")
@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import struct
+
+# Every record is a 4-byte big-endian length followed by one encrypted token.
+RECORD_HEADER = struct.Struct(">I")
+
+
+class HistoryLog:
+    """Append-only encrypted log of context updates that sits next to a snapshot file."""
+
+    def __init__(self, log_file_path, cipher):
+        self.log_file_path = log_file_path
+        self.cipher = cipher
+        self.file = None
+        self.record_count = 0
+        self.torn_at = None  # Where the last replay() found a record cut short, see _open()
+
+    def _open(self):
+        if self.file is not None:
+            # Key rotation replaces the log with a re-encrypted copy; appending to
+            # the old inode would write records nobody will ever read
+            try:
+                replaced = os.stat(self.log_file_path).st_ino != os.fstat(self.file.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = True
+            if replaced:
+                self.close()
+        if self.file is None:
+            if self.torn_at is not None:
+                # Records appended after a torn one would never be replayed
+                try:
+                    os.truncate(self.log_file_path, self.torn_at)
+                except FileNotFoundError:
+                    pass
+                self.torn_at = None
+            self.file = open(self.log_file_path, "ab")
+        return self.file
+
+    def append(self, record):
+        """Encrypts a single update record and appends it to the end of the log."""
+        token = self.cipher.encrypt(json.dumps(record).encode())
+        file = self._open()
+        file.write(RECORD_HEADER.pack(len(token)) + token)
+        file.flush()
+        self.record_count += 1
+
+    def sync(self):
+        """Forces appended records onto disk."""
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def replay(self):
+        """Yields decrypted records in the order they were appended.
+
+        A partially written record at the end of the log (e.g. after a crash
+        mid-append) is ignored, everything before it is still returned, and
+        it is cut off before this log next appends.
+        """
+        self.torn_at = None
+        if not os.path.exists(self.log_file_path):
+            return
+        offset = 0
+        with open(self.log_file_path, "rb") as file:
+            while True:
+                header = file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    if header:
+                        self.torn_at = offset
+                    break
+                (length,) = RECORD_HEADER.unpack(header)
+                token = file.read(length)
+                if len(token) < length:
+                    logging.warning(f"Truncated record at the end of {self.log_file_path}, ignoring it.")
+                    self.torn_at = offset
+                    break
+                offset += RECORD_HEADER.size + length
+                yield json.loads(self.cipher.decrypt(token).decode())
+
+    def size(self):
+        """Bytes of records written so far."""
+        if self.file is not None:
+            file = self._open()
+            file.flush()
+            return file.tell()
+        return os.path.getsize(self.log_file_path) if os.path.exists(self.log_file_path) else 0
+
+    def truncate(self, size=0):
+        """Drops every record after the first size bytes; by default all of them, once a snapshot covers them."""
+        self.close()
+        self.torn_at = None
+        if size:
+            if os.path.exists(self.log_file_path) and os.path.getsize(self.log_file_path) > size:
+                os.truncate(self.log_file_path, size)
+        elif os.path.exists(self.log_file_path):
+            with open(self.log_file_path, "wb"):
+                pass
+        self.record_count = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,348 @@
+"""Online rotation of the session encryption key.
+
+Every process reads ENCRYPTION_KEY and DECRYPTION_KEYS from .env when it
+starts, encrypts with the first and decrypts with either (see load_cipher),
+so a rotation never has a moment where some saved session is unreadable:
+
+  python key_rotation.py add-key    new key becomes readable everywhere; restart processes one at a time
+  python key_rotation.py promote    new key encrypts, the old one is kept for reading; restart again
+  python key_rotation.py sweep      re-encrypt every stored session with the new key
+  python key_rotation.py retire     drop the old key once a sweep reported nothing busy or failed
+
+The sweep runs batches of sessions across a process pool, logs progress and
+throughput, and checkpoints how far it got so an interrupted sweep resumes
+where it stopped. Re-running it is always safe: files already under the
+current key are only decrypted, not rewritten.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter as Tally
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from context_codec import AESGCM_NONCE_SIZE, ENCRYPTIONS, FILE_HEADER, MAGIC, aesgcm_for
+from context_manager import atomic_write, decryption_keys_from_env
+from history_log import RECORD_HEADER
+from session_storage import SessionDirectory, _storage
+
+STATE_VERSION = 1
+
+
+def fingerprint(key):
+    """A short, non-secret name for a key, safe to log and to store in the sweep state."""
+    key_bytes = key.encode() if isinstance(key, str) else key
+    return hashlib.sha256(key_bytes).hexdigest()[:16]
+
+
+class KeyRing:
+    """The current key plus the keys being rotated away from, for both Fernet and AES-GCM files."""
+
+    def __init__(self, keys):
+        from cryptography.fernet import Fernet, MultiFernet
+        if not keys:
+            raise ValueError("A key ring needs at least the current key")
+        self.keys = list(keys)
+        self.primary = Fernet(self.keys[0])
+        self.fernet = MultiFernet([Fernet(key) for key in self.keys])
+        self.aeads = [aesgcm_for(key) for key in self.keys]
+
+    def rotate_token(self, token):
+        """The Fernet token under the current key, or None when it already is."""
+        from cryptography.fernet import InvalidToken
+        try:
+            self.primary.decrypt(token)
+            return None
+        except InvalidToken:
+            return self.fernet.rotate(token)  # Keeps the original timestamp
+
+    def rotate_aesgcm(self, header, body):
+        from cryptography.exceptions import InvalidTag
+        nonce, sealed = body[:AESGCM_NONCE_SIZE], body[AESGCM_NONCE_SIZE:]
+        for index, aead in enumerate(self.aeads):
+            try:
+                plaintext = aead.decrypt(nonce, sealed, header)
+            except InvalidTag:
+                continue
+            if index == 0:
+                return None
+            nonce = os.urandom(AESGCM_NONCE_SIZE)
+            return nonce + self.aeads[0].encrypt(nonce, plaintext, header)
+        raise InvalidTag()
+
+    def rotate_context(self, data):
+        """A session_context_* file in any codec format under the current key, or None when it already is."""
+        if not data.startswith(MAGIC):
+            return self.rotate_token(data)
+        header, body = data[:FILE_HEADER.size], data[FILE_HEADER.size:]
+        encryption_id = FILE_HEADER.unpack(header)[4]
+        if encryption_id == ENCRYPTIONS["aesgcm"]:
+            rotated = self.rotate_aesgcm(header, body)
+        else:
+            rotated = self.rotate_token(body)
+        return header + rotated if rotated is not None else None
+
+    def rotate_log(self, data):
+        """A HistoryLog or spill file with every record under the current key, or None when they all are."""
+        records = []
+        changed = False
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            (length,) = RECORD_HEADER.unpack_from(data, offset)
+            end = offset + RECORD_HEADER.size + length
+            if end > len(data):
+                break
+            token = data[offset + RECORD_HEADER.size:end]
+            rotated = self.rotate_token(token)
+            if rotated is not None:
+                changed = True
+                token = rotated
+            records.append(RECORD_HEADER.pack(len(token)) + token)
+            offset = end
+        if not changed:
+            return None
+        records.append(data[offset:])  # A torn last record is kept as it was; replay() skips it
+        return b"".join(records)
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def rotate_file(path, rotate, fsync_policy="file", idle_seconds=None):
+    """Re-encrypts one file in place; returns (status, bytes read).
+
+    status is "missing", "current", "rotated", "failed" or "busy". A file
+    that changed while it was being rotated is left alone and reported busy,
+    since a live process just wrote it with the current key or will again;
+    so is a file modified within idle_seconds, for logs that are appended
+    to in place rather than replaced. A live HistoryLog notices that its log
+    was replaced and reopens it before the next append.
+    """
+    try:
+        before = _signature(path)
+    except FileNotFoundError:
+        return "missing", 0
+    if idle_seconds is not None and time.time() - before[1] / 1e9 < idle_seconds:
+        return "busy", 0
+    with open(path, "rb") as file:
+        data = file.read()
+    try:
+        rotated = rotate(data)
+    except Exception as e:
+        logging.error(f"Could not rotate {path}: {type(e).__name__} {e}")
+        return "failed", len(data)
+    if rotated is None:
+        return "current", len(data)
+    # Not a lock: a save landing between this check and the rename is lost, but
+    # that window is microseconds against the whole read-decrypt-encrypt above
+    if _signature(path) != before:
+        return "busy", len(data)
+    atomic_write(path, rotated, fsync_policy)
+    return "rotated", len(data)
+
+
+# Set in each worker process by _init_worker, so batches only carry user ids
+_worker = {}
+
+
+def _init_worker(keys, root, shard_depth, log_idle, fsync_policy):
+    _worker.update(keyring=KeyRing(keys), storage=SessionDirectory(root, shard_depth),
+                   log_idle=log_idle, fsync_policy=fsync_policy)
+
+
+def _rotate_batch(user_ids):
+    keyring, storage = _worker["keyring"], _worker["storage"]
+    counts = Tally()
+    for user_id in user_ids:
+        status, size = rotate_file(storage.path(user_id, "context"), keyring.rotate_context, _worker["fsync_policy"])
+        counts[status] += 1
+        counts["bytes"] += size
+        for kind in ("history", "log"):
+            status, size = rotate_file(storage.path(user_id, kind), keyring.rotate_log, _worker["fsync_policy"],
+                                       _worker["log_idle"])
+            if status != "missing":
+                counts[status] += 1
+                counts["bytes"] += size
+    return counts
+
+
+def _order(storage, user_id):
+    # The order SessionDirectory.user_ids() yields sessions in
+    return storage.directory(user_id), os.path.basename(storage.path(user_id))
+
+
+def _load_state(state_path, key):
+    if not state_path or not os.path.exists(state_path):
+        return None
+    with open(state_path) as file:
+        state = json.load(file)
+    if state.get("version") != STATE_VERSION or state.get("key") != fingerprint(key):
+        logging.info(f"{state_path} is from another rotation, starting over.")
+        return None
+    return state.get("done_through")
+
+
+def _save_state(state_path, key, done_through):
+    if state_path:
+        state = {"version": STATE_VERSION, "key": fingerprint(key), "done_through": done_through}
+        atomic_write(state_path, json.dumps(state).encode(), "file")
+
+
+def sweep(storage, keys, workers=None, batch_size=256, state_path=None, log_idle=300.0,
+          fsync_policy="file", progress_every=5.0):
+    """Re-encrypts every stored session under keys[0]; returns a Tally of file statuses plus "bytes".
+
+    Batches of batch_size sessions run on a pool of workers processes
+    (os.cpu_count() by default; 0 runs them in this process), with at most
+    two batches per worker in flight. With state_path, the last session of
+    the longest finished prefix of batches is checkpointed, and a sweep
+    that was interrupted resumes after it when run with the same current
+    key; the checkpoint is removed once a sweep finishes. Sessions created
+    after promote sort anywhere, but they are written with the current key,
+    so skipping them on resume loses nothing.
+    """
+    started = time.perf_counter()
+    done_through = _load_state(state_path, keys[0])
+    user_ids = list(storage.user_ids())
+    total = len(user_ids)
+    if done_through is not None:
+        resume_after = _order(storage, done_through)
+        user_ids = [user_id for user_id in user_ids if _order(storage, user_id) > resume_after]
+        logging.info(f"Resuming after {done_through!r}: {total - len(user_ids)} of {total} session(s) already done.")
+    batches = [user_ids[start:start + batch_size] for start in range(0, len(user_ids), batch_size)]
+    initargs = (keys, storage.root, storage.shard_depth, log_idle, fsync_policy)
+    workers = os.cpu_count() if workers is None else workers
+
+    counts = Tally()
+    finished = set()
+    next_checkpoint = 0  # Index of the first batch not yet covered by the checkpoint
+    sessions_done = total - len(user_ids)
+    last_report = started
+
+    def finish(index, batch_counts):
+        nonlocal next_checkpoint, sessions_done, last_report
+        counts.update(batch_counts)
+        finished.add(index)
+        sessions_done += len(batches[index])
+        if next_checkpoint in finished:
+            while next_checkpoint in finished:
+                finished.discard(next_checkpoint)
+                next_checkpoint += 1
+            _save_state(state_path, keys[0], batches[next_checkpoint - 1][-1])
+        now = time.perf_counter()
+        if now - last_report >= progress_every:
+            last_report = now
+            _report(sessions_done, total, counts, now - started)
+
+    if workers == 0:
+        _init_worker(*initargs)
+        for index, batch in enumerate(batches):
+            finish(index, _rotate_batch(batch))
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as executor:
+            pending = {}
+            queue = iter(enumerate(batches))
+            for index, batch in queue:
+                pending[executor.submit(_rotate_batch, batch)] = index
+                if len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(pending.pop(future), future.result())
+            for future in list(pending):
+                finish(pending.pop(future), future.result())
+    if state_path and os.path.exists(state_path):
+        os.remove(state_path)  # Finished: a rerun, for busy files, goes over everything again
+    _report(sessions_done, total, counts, time.perf_counter() - started)
+    return counts
+
+
+def _report(done, total, counts, elapsed):
+    files = sum(counts[status] for status in ("current", "rotated", "failed", "busy"))
+    percent = done / total if total else 1.0
+    logging.info(f"{done}/{total} sessions ({percent:.0%}): {counts['rotated']} rotated, {counts['current']} current, "
+                 f"{counts['busy']} busy, {counts['failed']} failed; "
+                 f"{files / elapsed if elapsed else 0:.0f} files/s, {counts['bytes'] / 1e6 / elapsed if elapsed else 0:.1f} MB/s")
+
+
+def _env_keys(env_path):
+    from dotenv import load_dotenv
+    load_dotenv(env_path, override=True)
+    primary = os.getenv("ENCRYPTION_KEY")
+    if not primary:
+        raise SystemExit(f"No ENCRYPTION_KEY in {env_path}")
+    return primary, decryption_keys_from_env()
+
+
+def _set_decryption_keys(env_path, keys):
+    from dotenv import set_key, unset_key
+    if keys:
+        set_key(env_path, "DECRYPTION_KEYS", ",".join(keys))
+    else:
+        unset_key(env_path, "DECRYPTION_KEYS")
+
+
+def add_key(env_path=".env"):
+    """Step 1: adds a new key that every process accepts but none writes with yet; returns it."""
+    from cryptography.fernet import Fernet
+    primary, others = _env_keys(env_path)
+    key = Fernet.generate_key().decode()
+    _set_decryption_keys(env_path, others + [key])
+    return key
+
+
+def promote(env_path=".env"):
+    """Step 2: the newest decryption key becomes ENCRYPTION_KEY and the old one is kept for reading."""
+    from dotenv import set_key
+    primary, others = _env_keys(env_path)
+    if not others:
+        raise SystemExit("No key to promote; run add-key first")
+    set_key(env_path, "ENCRYPTION_KEY", others[-1])
+    _set_decryption_keys(env_path, [primary] + others[:-1])
+    return others[-1]
+
+
+def retire(env_path=".env"):
+    """Step 4: forgets every decryption key; anything still encrypted with them becomes unreadable."""
+    _env_keys(env_path)
+    _set_decryption_keys(env_path, [])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rotate the session encryption key without downtime.")
+    parser.add_argument("--env", default=".env", help="The .env file holding the keys")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("add-key", help="Generate a key every process will accept")
+    commands.add_parser("promote", help="Encrypt with the newest key, keep the old one for reading")
+    sweep_parser = commands.add_parser("sweep", help="Re-encrypt every stored session with the current key")
+    sweep_parser.add_argument("--root", default=".", help="Session root; '.' is the flat working-directory layout")
+    sweep_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    sweep_parser.add_argument("--batch-size", type=int, default=256)
+    sweep_parser.add_argument("--state", default="key_rotation_state.json", help="Checkpoint file for resuming")
+    sweep_parser.add_argument("--log-idle", type=float, default=300.0,
+                              help="Only rewrite logs untouched for this many seconds")
+    sweep_parser.add_argument("--fsync", choices=["none", "file", "full"], default="file")
+    commands.add_parser("retire", help="Drop the old keys after a clean sweep")
+    args = parser.parse_args()
+
+    from context_manager import configure_logging
+    configure_logging()
+    if args.command == "add-key":
+        logging.info(f"Added key {fingerprint(add_key(args.env))}; restart every process, then run promote.")
+    elif args.command == "promote":
+        logging.info(f"Now encrypting with {fingerprint(promote(args.env))}; restart every process, then run sweep.")
+    elif args.command == "sweep":
+        primary, others = _env_keys(args.env)
+        counts = sweep(_storage(args.root), [primary] + others, args.workers, args.batch_size, args.state,
+                       args.log_idle, args.fsync)
+        if counts["busy"] or counts["failed"]:
+            logging.info("Some files were busy or failed; run sweep again before retire.")
+            sys.exit(1)
+        logging.info("Every session is under the current key; retire can drop the old keys.")
+    else:
+        retire(args.env)
+        logging.info("Old keys dropped; restart every process.")
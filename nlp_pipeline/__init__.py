@@ -1,2 +1,9 @@
-from .tokenizer import Tokenizer
-from .intent_classifier import IntentClassifier
\ No newline at end of file
+# Stages are imported on first access so that importing the package stays cheap
+def __getattr__(name):
+    if name == "Tokenizer":
+        from .tokenizer import Tokenizer
+        return Tokenizer
+    if name == "IntentClassifier":
+        from .intent_classifier import IntentClassifier
+        return IntentClassifier
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
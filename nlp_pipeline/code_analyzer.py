@@ -0,0 +1,297 @@
+import ast
+import hashlib
+import time
+import warnings
+from collections import OrderedDict
+
+from nlp_pipeline.code_lexer import top_level_chunks
+
+MODULE_SCOPE = "<module>"
+
+
+class FunctionInfo:
+    __slots__ = ("name", "qualname", "lineno", "args", "calls", "is_async")
+
+    def __init__(self, name, qualname, lineno, args, calls, is_async=False):
+        self.name = name
+        self.qualname = qualname  # "Class.method" for methods, "outer.inner" for nested functions
+        self.lineno = lineno
+        self.args = args  # tuple of parameter names
+        self.calls = calls  # tuple of called names, e.g. ("print", "self.save", "os.path.join")
+        self.is_async = is_async
+
+    def moved(self, offset):
+        return FunctionInfo(self.name, self.qualname, self.lineno + offset, self.args, self.calls, self.is_async)
+
+    def __repr__(self):
+        return f"FunctionInfo({self.qualname!r}, line {self.lineno})"
+
+
+class ClassInfo:
+    __slots__ = ("name", "qualname", "lineno", "bases", "methods")
+
+    def __init__(self, name, qualname, lineno, bases, methods):
+        self.name = name
+        self.qualname = qualname
+        self.lineno = lineno
+        self.bases = bases  # tuple of base class names as written
+        self.methods = methods  # tuple of method names
+
+    def moved(self, offset):
+        return ClassInfo(self.name, self.qualname, self.lineno + offset, self.bases, self.methods)
+
+    def __repr__(self):
+        return f"ClassInfo({self.qualname!r}, line {self.lineno})"
+
+
+class ImportInfo:
+    __slots__ = ("module", "names", "lineno")
+
+    def __init__(self, module, names, lineno):
+        self.module = module  # None for "import x", the package for "from x import y"
+        self.names = names  # tuple of (name, alias or None)
+        self.lineno = lineno
+
+    def moved(self, offset):
+        return ImportInfo(self.module, self.names, self.lineno + offset)
+
+    def __repr__(self):
+        return f"ImportInfo({self.module!r}, {self.names!r})"
+
+
+class CodeAnalysis:
+    """What CodeAnalyzer found in one piece of code.
+
+    truncated is True when the size, node or time budget cut the analysis
+    short; everything before the cut is still reported.
+    """
+
+    __slots__ = ("functions", "classes", "imports", "module_calls", "truncated", "errors")
+
+    def __init__(self):
+        self.functions = []
+        self.classes = []
+        self.imports = []
+        self.module_calls = []  # calls made at module level, outside any function
+        self.truncated = False
+        self.errors = 0  # top-level chunks that don't parse
+
+    def call_graph(self):
+        """{function qualname or "<module>": tuple of called names}."""
+        graph = {function.qualname: function.calls for function in self.functions}
+        if self.module_calls:
+            graph[MODULE_SCOPE] = tuple(self.module_calls)
+        return graph
+
+    def entity_names(self):
+        """{name: "function" | "class"} for labeling tokens; called names count as functions."""
+        names = {}
+        for calls in self.call_graph().values():
+            for call in calls:
+                names[call.rpartition(".")[2]] = "function"
+        for function in self.functions:
+            names[function.name] = "function"
+        for cls in self.classes:
+            names[cls.name] = "class"  # Instantiating a class looks like a call, the definition wins
+        return names
+
+
+class _ChunkAnalysis:
+    # The records of one top-level chunk, with line numbers relative to the chunk
+    __slots__ = ("functions", "classes", "imports", "module_calls", "truncated")
+
+    def __init__(self, functions, classes, imports, module_calls, truncated):
+        self.functions = functions
+        self.classes = classes
+        self.imports = imports
+        self.module_calls = module_calls
+        self.truncated = truncated
+
+
+class _NodeBudgetExceeded(Exception):
+    pass
+
+
+class _Extractor(ast.NodeVisitor):
+    """Collects records from one chunk's tree, stopping after max_nodes nodes."""
+
+    def __init__(self, max_nodes):
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.scopes = []  # qualname parts of the enclosing defs and classes
+        self.calls = [[]]  # calls of the innermost function (or the module)
+        self.functions = []
+        self.classes = []
+        self.imports = []
+
+    def visit(self, node):
+        self.nodes += 1
+        if self.nodes > self.max_nodes:
+            raise _NodeBudgetExceeded()
+        return super().visit(node)
+
+    def _qualname(self, name):
+        return ".".join(self.scopes + [name])
+
+    def _visit_function(self, node, is_async):
+        qualname = self._qualname(node.name)
+        arguments = node.args
+        args = tuple(arg.arg for arg in arguments.posonlyargs + arguments.args + arguments.kwonlyargs)
+        if arguments.vararg:
+            args += (arguments.vararg.arg,)
+        if arguments.kwarg:
+            args += (arguments.kwarg.arg,)
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        self.scopes.append(node.name)
+        self.calls.append([])
+        try:
+            for statement in node.body:
+                self.visit(statement)
+        finally:
+            self.scopes.pop()
+            calls = self.calls.pop()
+            self.functions.append(FunctionInfo(node.name, qualname, node.lineno, args, tuple(calls), is_async))
+
+    def visit_FunctionDef(self, node):
+        self._visit_function(node, False)
+
+    def visit_AsyncFunctionDef(self, node):
+        self._visit_function(node, True)
+
+    def visit_ClassDef(self, node):
+        qualname = self._qualname(node.name)
+        bases = tuple(filter(None, map(_dotted_name, node.bases)))
+        methods = tuple(
+            statement.name for statement in node.body
+            if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef))
+        )
+        self.classes.append(ClassInfo(node.name, qualname, node.lineno, bases, methods))
+        for expression in node.decorator_list + node.bases:
+            self.visit(expression)
+        self.scopes.append(node.name)
+        try:
+            for statement in node.body:
+                self.visit(statement)
+        finally:
+            self.scopes.pop()
+
+    def visit_Import(self, node):
+        self.imports.append(ImportInfo(None, tuple((alias.name, alias.asname) for alias in node.names), node.lineno))
+
+    def visit_ImportFrom(self, node):
+        module = "." * node.level + (node.module or "")
+        self.imports.append(ImportInfo(module, tuple((alias.name, alias.asname) for alias in node.names), node.lineno))
+
+    def visit_Call(self, node):
+        name = _dotted_name(node.func)
+        if name is not None:
+            self.calls[-1].append(name)
+        self.generic_visit(node)
+
+
+def _dotted_name(node):
+    """Dotted name like "os.path.join" for a Name/Attribute chain, None for anything else (calls, subscripts, ...)."""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+class CodeAnalyzer:
+    """Pipeline stage that parses pasted Python code with ast into compact records.
+
+    Code is split into top-level chunks, like CodeLexer does, and each chunk's
+    records are cached by a hash of its text: a snippet pasted again, or pasted
+    again with one function edited, only re-parses the chunks that changed.
+    Each chunk's tree is dropped as soon as its records are extracted, so memory
+    stays proportional to the records, not the source.
+
+    Large inputs are bounded three ways: only the first max_source_chars
+    characters are analyzed, a chunk stops being walked after max_nodes AST
+    nodes, and no new chunk is started once time_budget seconds have passed.
+    """
+
+    def __init__(self, cache_size=512, max_source_chars=1_000_000, max_nodes=100_000, time_budget=0.5):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # chunk digest -> _ChunkAnalysis, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.max_source_chars = max_source_chars
+        self.max_nodes = max_nodes
+        self.time_budget = time_budget
+
+    def analyze(self, code):
+        """Returns a CodeAnalysis of code; chunks that don't parse are counted in errors and skipped."""
+        analysis = CodeAnalysis()
+        if len(code) > self.max_source_chars:
+            code = code[:self.max_source_chars]
+            analysis.truncated = True
+        deadline = time.perf_counter() + self.time_budget
+        line = 0  # Lines before the current chunk
+        pending = ""  # Chunks that didn't parse yet, and the line they start at
+        pending_line = 0
+        for chunk in top_level_chunks(code):
+            if time.perf_counter() > deadline:
+                analysis.truncated = True
+                break
+            chunk_line = line
+            line += chunk.count("\n")
+            if pending:
+                # A chunk that ends inside a bracket or string parses once joined with the next one
+                result = self._analyze_chunk(pending + chunk)
+                if result is not None:
+                    self._add(analysis, result, pending_line)
+                    pending = ""
+                    continue
+            result = self._analyze_chunk(chunk)
+            if result is not None:
+                if pending:
+                    analysis.errors += 1  # The pending chunks were just broken code
+                    pending = ""
+                self._add(analysis, result, chunk_line)
+            else:
+                if not pending:
+                    pending_line = chunk_line
+                pending += chunk
+        if pending:
+            analysis.errors += 1
+        return analysis
+
+    def _add(self, analysis, result, offset):
+        analysis.functions.extend(function.moved(offset) for function in result.functions)
+        analysis.classes.extend(cls.moved(offset) for cls in result.classes)
+        analysis.imports.extend(imported.moved(offset) for imported in result.imports)
+        analysis.module_calls.extend(result.module_calls)
+        analysis.truncated = analysis.truncated or result.truncated
+
+    def _analyze_chunk(self, chunk):
+        key = hashlib.blake2b(chunk.encode(), digest_size=16).digest()
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return cached
+        self.misses += 1
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", SyntaxWarning)
+                tree = ast.parse(chunk)
+        except (SyntaxError, ValueError, RecursionError, MemoryError):
+            return None
+        extractor = _Extractor(self.max_nodes)
+        truncated = False
+        try:
+            extractor.visit(tree)
+        except (_NodeBudgetExceeded, RecursionError):
+            truncated = True  # Keep what was collected before the budget ran out
+        result = _ChunkAnalysis(extractor.functions, extractor.classes, extractor.imports,
+                                extractor.calls[0], truncated)
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
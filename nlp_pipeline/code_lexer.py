@@ -0,0 +1,158 @@
+import ast
+import hashlib
+import io
+import re
+import time
+import tokenize
+import warnings
+from collections import OrderedDict
+
+# Lexer tokens that only describe layout or comments, not code entities
+SKIPPED_TOKEN_TYPES = {
+    tokenize.NEWLINE, tokenize.NL, tokenize.INDENT, tokenize.DEDENT,
+    tokenize.ENDMARKER, tokenize.COMMENT, tokenize.ENCODING,
+}
+# Characters that prose rarely contains but nearly every line of code does
+CODE_MARKERS = re.compile(r"[()\[\]{}=:.]")
+BLOCK_OPENER = re.compile(r"\s*(?:async\s+)?(?:def|class|if|elif|else|for|while|with|try|except|finally)\b.*:\s*(?:#.*)?$")
+FENCE = "```"
+INVALID = object()  # Cached for chunks that don't lex, so a pasted snippet that isn't code is only tried once
+
+def top_level_chunks(code):
+    """Splits code into chunks that each start at a line with no indentation."""
+    chunk = []
+    for line in code.splitlines(keepends=True):
+        if chunk and line.strip() and not line[:1].isspace():
+            yield "".join(chunk)
+            chunk = []
+        chunk.append(line)
+    if chunk:
+        yield "".join(chunk)
+
+class CodeLexer:
+    """Finds Python code in a message and lexes it with the stdlib tokenize module.
+
+    Code is split into top-level chunks (a new chunk starts at every line with
+    no indentation) and each chunk's tokens are cached by a hash of its text, so
+    a file pasted again, or pasted again with one function changed, only
+    re-lexes the chunks that differ. Chunks that don't lex are cached too.
+
+    Like CodeAnalyzer, lexing is bounded: a span longer than max_code_chars,
+    unlexable text piling up past max_pending_chars, or a span still lexing
+    after time_budget seconds is given up on and tokenized as prose instead.
+    """
+
+    def __init__(self, cache_size=1024, max_code_chars=200_000, max_pending_chars=1000, time_budget=0.05):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # chunk digest -> tuple of tokens (INVALID if it doesn't lex), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.max_code_chars = max_code_chars
+        self.max_pending_chars = max_pending_chars
+        self.time_budget = time_budget
+
+    def may_contain_code(self, text):
+        """Cheap check that lets prose skip span detection entirely."""
+        if "\n" in text or FENCE in text:
+            return True
+        return self.looks_like_code(text)
+
+    def looks_like_code(self, line):
+        """True for a single line that parses as Python and has code punctuation in it."""
+        if len(line) > self.max_code_chars or not CODE_MARKERS.search(line):
+            return False
+        if BLOCK_OPENER.match(line):
+            return True
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", SyntaxWarning)
+                ast.parse(line.strip())
+        except (SyntaxError, ValueError, RecursionError, MemoryError):  # Deep nesting overflows the parser
+            return False
+        return True
+
+    def split_spans(self, text):
+        """Splits text into (is_code, segment) pairs, in order.
+
+        Fenced ``` blocks are always code. Outside fences, a whole multi-line
+        message that parses is code; otherwise runs of code-looking lines (plus
+        the indented lines that follow them) become code spans.
+        """
+        spans = []
+        parts = text.split(FENCE)
+        for index, part in enumerate(parts):
+            if index % 2 == 1:
+                # Inside a fence, drop the optional language tag on the first line
+                first, _, rest = part.partition("\n")
+                code = rest if first.strip().isidentifier() else part
+                spans.append((True, code))
+            elif part.strip():
+                spans.extend(self._split_unfenced(part))
+        return spans
+
+    def _split_unfenced(self, text):
+        if "\n" in text.strip() and len(text) <= self.max_code_chars and CODE_MARKERS.search(text):
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", SyntaxWarning)
+                    ast.parse(text.strip("\n"))
+                return [(True, text)]
+            except (SyntaxError, ValueError, RecursionError, MemoryError):
+                pass
+        spans = []
+        in_code = False
+        for line in text.splitlines(keepends=True):
+            if in_code and (not line.strip() or line[:1].isspace()):
+                is_code = True  # Blank or indented lines continue the current code block
+            else:
+                is_code = self.looks_like_code(line)
+            if spans and spans[-1][0] == is_code:
+                spans[-1] = (is_code, spans[-1][1] + line)
+            else:
+                spans.append((is_code, line))
+            in_code = is_code
+        return spans
+
+    def lex(self, code):
+        """Returns the code tokens of a code span, or None if it isn't valid Python source or is over budget."""
+        if len(code) > self.max_code_chars:
+            return None
+        deadline = time.perf_counter() + self.time_budget
+        tokens = []
+        pending = ""
+        for chunk in top_level_chunks(code):
+            if time.perf_counter() > deadline:
+                return None
+            # A chunk that ends inside a bracket or string is joined with the next one
+            chunk_tokens = self._lex_chunk(pending + chunk)
+            if chunk_tokens is None:
+                pending += chunk
+                if len(pending) > self.max_pending_chars:
+                    return None  # Re-lexing an ever longer prefix would be quadratic; it's not code
+                continue
+            tokens.extend(chunk_tokens)
+            pending = ""
+        if pending:
+            return None
+        return tokens
+
+    def _lex_chunk(self, chunk):
+        key = hashlib.blake2b(chunk.encode(), digest_size=16).digest()
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return cached if cached is not INVALID else None
+        self.misses += 1
+        try:
+            tokens = tuple(
+                token.string
+                for token in tokenize.generate_tokens(io.StringIO(chunk).readline)
+                if token.type not in SKIPPED_TOKEN_TYPES and token.string
+            )
+        except (tokenize.TokenError, SyntaxError):
+            tokens = None
+        self.cache[key] = tokens if tokens is not None else INVALID
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return tokens
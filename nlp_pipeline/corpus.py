@@ -0,0 +1,329 @@
+import hashlib
+import json
+import os
+import re
+import sys
+from array import array
+from bisect import bisect_right
+from collections import deque
+from itertools import chain
+
+from nlp_pipeline.doc_index import map_array
+
+# An ingested corpus is a directory of flat native-endian arrays, like a DocIndex,
+# so the classifier and retrieval code can memory-map it without loading it:
+#   vocab.bin               token strings, utf-8, concatenated in id order
+#   vocab_offsets           uint64[V + 1] byte offsets of each token in vocab.bin
+#   vocab_counts            uint64[V]     occurrences of each token
+#   shard-NNNNN.ids         uint32[T]     token ids of the shard's documents, concatenated
+#   shard-NNNNN.offsets     uint64[D + 1] where each document starts in the .ids file
+#   meta.json               counts, shards and byte order; written last, so its presence marks a complete corpus
+# Ids are in order of first appearance, so the most common tokens tend to get small ids.
+# The arrays are raw, with no .npy header: numpy.memmap(path, dtype="uint32") reads them as is.
+BRACKETS = {"-LRB-": "(", "-RRB-": ")", "-LCB-": "{", "-RCB-": "}"}
+BROWN_FILE = re.compile(r"c[a-r]\d\d\Z")
+CORNELL_SEPARATOR = " +++$+++ "
+
+
+def iter_lines(path):
+    """One utterance per non-blank line of a text file."""
+    with open(path, encoding="utf-8", errors="replace") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def iter_jsonl(path, field="text"):
+    """The field of every JSON object in a JSON lines file, like intent_examples.jsonl."""
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                text = json.loads(line).get(field)
+                if text:
+                    yield text
+
+
+def iter_cornell(path):
+    """Utterances from the Cornell Movie-Dialogs movie_lines.txt, or the directory holding it."""
+    if os.path.isdir(path):
+        path = os.path.join(path, "movie_lines.txt")
+    with open(path, encoding="iso-8859-1") as file:
+        for line in file:
+            text = line.rstrip("\n").split(CORNELL_SEPARATOR)[-1].strip()
+            if text:
+                yield text
+
+
+def iter_brown(path):
+    """Sentences from the Brown Corpus in NLTK's word/tag format, one file or the whole corpus directory."""
+    if os.path.isdir(path):
+        paths = [os.path.join(path, name) for name in sorted(os.listdir(path)) if BROWN_FILE.match(name)]
+    else:
+        paths = [path]
+    for file_path in paths:
+        with open(file_path, encoding="utf-8", errors="replace") as file:
+            for line in file:
+                words = [item.rsplit("/", 1)[0] for item in line.split()]
+                if words:
+                    yield " ".join(BRACKETS.get(word, word) for word in words)
+
+
+READERS = {"lines": iter_lines, "jsonl": iter_jsonl, "cornell": iter_cornell, "brown": iter_brown}
+
+
+def read_corpora(paths, format="lines"):
+    """Chains the texts of several corpus files, one at a time."""
+    reader = READERS[format]
+    return chain.from_iterable(reader(path) for path in paths)
+
+
+# Each worker process builds its own Tokenizer once, in the pool initializer
+_worker = {}
+
+
+def _init_worker(stopwords):
+    from nlp_pipeline.tokenizer import Tokenizer
+    _worker["tokenize"] = Tokenizer(detect_code=False, stopwords=stopwords).tokenize_prose
+
+
+def _tokenize_chunk(texts):
+    """Encodes a chunk against its own small vocabulary: (distinct tokens, their counts, ids, document lengths).
+
+    The per-token work happens here, in the worker; the main process only maps
+    each chunk's distinct tokens to corpus ids.
+    """
+    tokenize = _worker["tokenize"]
+    local = {}
+    ids = array("I")
+    lengths = array("I")
+    for text in texts:
+        tokens = tokenize(text)
+        for token in tokens:
+            ids.append(local.setdefault(token, len(local)))
+        lengths.append(len(tokens))
+    counts = array("Q", bytes(8 * len(local)))
+    for token_id in ids:
+        counts[token_id] += 1
+    return list(local), counts, ids, lengths
+
+
+def _chunks(texts, chunk_size, seen, counts):
+    """Lists of chunk_size texts, leaving out exact repeats (after trimming) when seen is a set."""
+    chunk = []
+    for text in texts:
+        counts["read"] += 1
+        if seen is not None:
+            digest = hashlib.blake2b(text.strip().encode(), digest_size=8).digest()
+            if digest in seen:
+                counts["duplicates"] += 1
+                continue
+            seen.add(digest)
+        chunk.append(text)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _ShardWriter:
+    """Appends documents to shard files, starting a new shard once one holds shard_tokens tokens."""
+
+    def __init__(self, path, shard_tokens):
+        self.path = path
+        self.shard_tokens = shard_tokens
+        self.shards = []  # {"name", "documents", "tokens"} per finished or open shard
+        self.ids_file = self.offsets_file = None
+
+    def _open(self):
+        name = f"shard-{len(self.shards):05d}"
+        self.shards.append({"name": name, "documents": 0, "tokens": 0})
+        self.ids_file = open(os.path.join(self.path, f"{name}.ids"), "wb")
+        self.offsets_file = open(os.path.join(self.path, f"{name}.offsets"), "wb")
+        array("Q", [0]).tofile(self.offsets_file)
+
+    def write(self, ids, lengths):
+        """Writes a chunk of documents: their token ids concatenated, and each one's length."""
+        written = end = 0  # The documents in ids[written:end] go to the open shard
+        offsets = array("Q")
+        for length in lengths:
+            if self.ids_file is None or self.shards[-1]["tokens"] >= self.shard_tokens:
+                self._flush(ids[written:end], offsets)
+                written = end
+                offsets = array("Q")
+                self.close()
+                self._open()
+            shard = self.shards[-1]
+            shard["tokens"] += length
+            shard["documents"] += 1
+            offsets.append(shard["tokens"])
+            end += length
+        self._flush(ids[written:end], offsets)
+
+    def _flush(self, ids, offsets):
+        if self.ids_file is not None:
+            ids.tofile(self.ids_file)
+            offsets.tofile(self.offsets_file)
+
+    def close(self):
+        if self.ids_file is not None:
+            self.ids_file.close()
+            self.offsets_file.close()
+            self.ids_file = self.offsets_file = None
+
+
+def ingest(texts, path, workers=0, chunk_size=1024, shard_tokens=1 << 24, stopwords=None, dedupe=True):
+    """Tokenizes texts into a token-id corpus directory at path; returns its meta dict.
+
+    texts is any iterable, normally a read_corpora() generator, and is read
+    one chunk at a time: memory holds the vocabulary, one 8-byte hash per
+    distinct text for dedupe, and at most two chunks per worker. With
+    workers > 0 chunks are tokenized in that many processes, in order, so
+    the output doesn't depend on the worker count. stopwords replaces the
+    tokenizer's default list, as Tokenizer(stopwords=...) does.
+    """
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)  # Incomplete until rewritten
+    stopwords = sorted(stopwords) if stopwords is not None else None
+    counts = {"read": 0, "duplicates": 0}
+    chunks = _chunks(texts, chunk_size, set() if dedupe else None, counts)
+    vocabulary = {}  # token -> id
+    token_counts = array("Q")
+    writer = _ShardWriter(path, shard_tokens)
+
+    def add(encoded):
+        tokens, local_counts, local_ids, lengths = encoded
+        table = []  # Chunk id -> corpus id
+        for token, count in zip(tokens, local_counts):
+            token_id = vocabulary.get(token)
+            if token_id is None:
+                token_id = vocabulary[token] = len(vocabulary)
+                token_counts.append(0)
+            token_counts[token_id] += count
+            table.append(token_id)
+        writer.write(array("I", map(table.__getitem__, local_ids)), lengths)
+
+    try:
+        if workers == 0:
+            _init_worker(stopwords)
+            for chunk in chunks:
+                add(_tokenize_chunk(chunk))
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(stopwords,)) as executor:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(executor.submit(_tokenize_chunk, chunk))
+                    if len(pending) >= 2 * workers:
+                        add(pending.popleft().result())
+                while pending:
+                    add(pending.popleft().result())
+    finally:
+        writer.close()
+
+    offsets = array("Q", [0])
+    with open(os.path.join(path, "vocab.bin"), "wb") as file:
+        for token in vocabulary:  # Dicts keep insertion order, which is id order
+            encoded = token.encode()
+            file.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    for name, values in (("vocab_offsets", offsets), ("vocab_counts", token_counts)):
+        with open(os.path.join(path, name), "wb") as file:
+            values.tofile(file)
+    meta = {
+        "documents": sum(shard["documents"] for shard in writer.shards),
+        "tokens": sum(shard["tokens"] for shard in writer.shards),
+        "vocabulary": len(vocabulary),
+        "read": counts["read"],
+        "duplicates": counts["duplicates"],
+        "shards": writer.shards,
+        "byteorder": sys.byteorder,
+    }
+    with open(meta_path, "w") as file:
+        json.dump(meta, file)
+    return meta
+
+
+class TokenCorpus:
+    """Read-only, memory-mapped corpus written by ingest()."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as file:
+            self.meta = json.load(file)
+        if self.meta["byteorder"] != sys.byteorder:
+            raise ValueError(f"Corpus at {path} was written on a {self.meta['byteorder']}-endian machine")
+        self.maps = []
+        self.vocab = map_array(os.path.join(path, "vocab.bin"), "B", self.maps)
+        self.vocab_offsets = map_array(os.path.join(path, "vocab_offsets"), "Q", self.maps)
+        self.vocab_counts = map_array(os.path.join(path, "vocab_counts"), "Q", self.maps)
+        self.shards = []
+        self.starts = []  # Index of each shard's first document
+        start = 0
+        for shard in self.meta["shards"]:
+            self.shards.append((map_array(os.path.join(path, f"{shard['name']}.ids"), "I", self.maps),
+                                map_array(os.path.join(path, f"{shard['name']}.offsets"), "Q", self.maps)))
+            self.starts.append(start)
+            start += shard["documents"]
+        self.token_ids = None
+
+    def __len__(self):
+        return self.meta["documents"]
+
+    def document(self, index):
+        """The token ids of one document, as a uint32 memoryview into the shard."""
+        if not 0 <= index < len(self):
+            raise IndexError(f"Document {index} out of range")
+        shard = bisect_right(self.starts, index) - 1
+        ids, offsets = self.shards[shard]
+        local = index - self.starts[shard]
+        return ids[offsets[local]:offsets[local + 1]]
+
+    def __iter__(self):
+        for ids, offsets in self.shards:
+            for local in range(len(offsets) - 1):
+                yield ids[offsets[local]:offsets[local + 1]]
+
+    def token(self, token_id):
+        return str(self.vocab[self.vocab_offsets[token_id]:self.vocab_offsets[token_id + 1]], "utf-8")
+
+    def decode(self, ids):
+        return [self.token(token_id) for token_id in ids]
+
+    def encode(self, tokens):
+        """Token ids for tokens, None for tokens the corpus never saw; builds the lookup on first use."""
+        if self.token_ids is None:
+            self.token_ids = {self.token(token_id): token_id for token_id in range(self.meta["vocabulary"])}
+        return [self.token_ids.get(token) for token in tokens]
+
+    def close(self):
+        for view in (self.vocab, self.vocab_offsets, self.vocab_counts, *chain.from_iterable(self.shards)):
+            view.release()
+        for mapped in self.maps:
+            mapped.close()
+
+
+if __name__ == "__main__":
+    # python -m nlp_pipeline.corpus cornell corpus/ cornell_movie_dialogs/ --workers 4 --stopwords nltk_data/corpora/stopwords
+    import argparse
+    import time
+    from nlp_pipeline.tokenizer import load_stopwords
+    parser = argparse.ArgumentParser(description="Tokenize corpora into memory-mapped token-id shards.")
+    parser.add_argument("format", choices=sorted(READERS))
+    parser.add_argument("output")
+    parser.add_argument("inputs", nargs="+")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--shard-tokens", type=int, default=1 << 24)
+    parser.add_argument("--stopwords", help="Stopword list, or NLTK's stopwords directory")
+    parser.add_argument("--keep-duplicates", action="store_true")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    meta = ingest(read_corpora(args.inputs, args.format), args.output, args.workers, args.chunk_size, args.shard_tokens,
+                  load_stopwords(args.stopwords) if args.stopwords else None, not args.keep_duplicates)
+    elapsed = time.perf_counter() - started
+    print(f"{meta['documents']} documents ({meta['duplicates']} duplicates dropped), {meta['tokens']} tokens, "
+          f"{meta['vocabulary']} distinct, {len(meta['shards'])} shard(s) in {elapsed:.1f} s "
+          f"({meta['read'] / elapsed if elapsed else 0:.0f} texts/s)")
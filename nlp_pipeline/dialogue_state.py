@@ -0,0 +1,121 @@
+from collections import OrderedDict, deque
+
+# Words that point back at something said earlier ("what about that?"), lowercase
+REFERENCES = frozenset({"it", "that", "this", "those", "these", "them", "its"})
+# Follow-ups that keep the previous question going with a new subject ("what about lists?")
+FOLLOW_UP_OPENERS = (("what", "about"), ("how", "about"))
+# Entity labels always worth remembering; other identifiers only when they look like code
+CODE_LABELS = frozenset({"function", "class"})
+
+
+class DialogueState:
+    """What recent turns talked about, indexed so a reply never rescans the history.
+
+    entities maps each remembered entity to (turn, label) of its latest
+    mention, most recent last, and topics keeps the last max_topics
+    (turn, topic) transitions. Turns are numbered from 1 like positions in
+    the session's history, so history[turn - 1] is the turn itself. Every
+    operation is O(1) per entity, whatever the length of the history.
+    """
+
+    def __init__(self, max_entities=256, max_topics=32):
+        self.max_entities = max_entities
+        self.turn = 0
+        self.last_intent = None
+        self.entities = OrderedDict()  # name -> (turn, label)
+        self.topics = deque(maxlen=max_topics)  # (turn, topic) whenever the topic changed
+
+    @property
+    def topic(self):
+        return self.topics[-1][1] if self.topics else None
+
+    def record(self, intent=None, entities=(), topic=None):
+        """Moves on to the next turn, remembering its intent, (name, label) entities and topic."""
+        self.turn += 1
+        if intent is not None:
+            self.last_intent = intent
+        for name, label in entities:
+            self.entities[name] = (self.turn, label)
+            self.entities.move_to_end(name)
+        while len(self.entities) > self.max_entities:
+            self.entities.popitem(last=False)
+        if topic is not None and topic != self.topic:
+            self.topics.append((self.turn, topic))
+
+    def last_entity(self):
+        """(name, label) of the most recently mentioned entity, or None."""
+        if not self.entities:
+            return None
+        name = next(reversed(self.entities))
+        return name, self.entities[name][1]
+
+    def last_mention(self, name):
+        """The turn that last mentioned name, or None if it was never mentioned or has been forgotten."""
+        entry = self.entities.get(name)
+        return entry[0] if entry is not None else None
+
+    def to_dict(self):
+        return {
+            "turn": self.turn,
+            "last_intent": self.last_intent,
+            "entities": [[name, turn, label] for name, (turn, label) in self.entities.items()],
+            "topics": [list(transition) for transition in self.topics],
+        }
+
+    def restore(self, state, turns=0):
+        """Loads a to_dict() result; without one (an older context), starts over at turn `turns`."""
+        self.entities.clear()
+        self.topics.clear()
+        self.last_intent = None
+        self.turn = turns
+        if state:
+            self.turn = state.get("turn", turns)
+            self.last_intent = state.get("last_intent")
+            self.entities.update((name, (turn, label)) for name, turn, label in state.get("entities", ()))
+            self.topics.extend((turn, topic) for turn, topic in state.get("topics", ()))
+
+    def __repr__(self):
+        return f"DialogueState(turn={self.turn}, topic={self.topic!r}, last_entity={self.last_entity()!r})"
+
+
+def _code_like(tokens, index):
+    token = tokens[index]
+    return ("_" in token.strip("_") or any(c.isupper() for c in token[1:])
+            or (index + 1 < len(tokens) and tokens[index + 1] == "("))
+
+
+def mentions(tokens, entities):
+    """The (name, label) entities of a turn worth remembering: names from pasted code, and code-like identifiers."""
+    found = []
+    for index, (token, label) in enumerate(entities):
+        if label in CODE_LABELS or (label == "identifier" and _code_like(tokens, index)):
+            found.append((token, label))
+    return found
+
+
+def resolve_turn(state, tokens, intent, entities, carries_over=None):
+    """Resolves references against the state; returns (intent, entities, turn).
+
+    Reference words ("it", "that") in entities are replaced by the most
+    recent entity, so the rest of the pipeline sees what the user meant.
+    An unrecognised follow-up ("what about that?") keeps the previous
+    intent when carries_over(previous intent) is true. turn is
+    {"entity", "entities", "topic"} for ContextManager.update(); the state
+    itself only changes when that update is applied.
+    """
+    lowered = [token.lower() for token in tokens]
+    referenced = state.last_entity() if REFERENCES.intersection(lowered) else None
+    if referenced is not None:
+        entities = [referenced if token.lower() in REFERENCES else (token, label) for token, label in entities]
+    follow_up = referenced is not None or tuple(lowered[:2]) in FOLLOW_UP_OPENERS
+    if (intent == "unknown" and follow_up and state.last_intent is not None
+            and (carries_over is None or carries_over(state.last_intent))):
+        intent = state.last_intent
+    mentioned = mentions(tokens, entities)
+    if referenced is not None and referenced not in mentioned:
+        mentioned.append(referenced)
+    new = [name for name, _ in mentioned if name not in state.entities]
+    # A newly mentioned entity becomes the topic; a reference keeps the conversation on what it points at
+    topic = new[0] if new else referenced[0] if referenced is not None else state.topic
+    entity = mentioned[-1][0] if mentioned else None
+    return intent, entities, {"entity": entity, "entities": mentioned, "topic": topic}
@@ -0,0 +1,330 @@
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+# One index is a directory of flat native-endian arrays, memory-mapped read-only
+# so every bot process on the machine shares the same page-cache pages:
+#   terms.bin        sorted index terms, utf-8, concatenated
+#   term_offsets     uint64[V + 1] byte offsets of each term in terms.bin
+#   term_postings    uint64[V + 1] offsets of each term's postings
+#   term_max         float32[V]    largest impact in each postings list (MaxScore bound)
+#   term_top         uint64[V + 1] offsets of each term's entries in top_impacts
+#   top_impacts      float32[T]    each term's TOP_IMPACTS largest impacts (fewer if it has fewer postings), descending
+#   postings_docs    uint32[P]     document ids, ascending within a term
+#   postings_impact  float32[P]    BM25 score of the term in that document, precomputed
+#   docs.bin         one JSON record per document, concatenated
+#   doc_offsets      uint64[N + 1] byte offsets of each record in docs.bin
+#   meta.json        document count, average length and the BM25 parameters
+ARRAY_FILES = {
+    "term_offsets": "Q",
+    "term_postings": "Q",
+    "term_max": "f",
+    "term_top": "Q",
+    "top_impacts": "f",
+    "postings_docs": "I",
+    "postings_impact": "f",
+    "doc_offsets": "Q",
+}
+TERM = re.compile(r"[a-z0-9_]+\Z")
+TOP_IMPACTS = 16  # Largest impacts kept per term, so search() reads its k-th best instead of scanning the list
+OPTIONAL_ARRAYS = ("term_top", "top_impacts")  # Missing from indexes built before they were added
+SNIPPET_LENGTH = 300
+
+
+def index_terms(tokens):
+    """Lowercased word tokens; punctuation from the tokenizer isn't indexed."""
+    terms = []
+    for token in tokens:
+        term = token.lower()
+        if TERM.match(term):
+            terms.append(term)
+    return terms
+
+
+def map_array(file_path, typecode, maps):
+    """A read-only memoryview of a flat array file; the mmap backing it is appended to maps for closing."""
+    with open(file_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return memoryview(array(typecode))  # mmap can't map an empty file
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    maps.append(mapped)
+    return memoryview(mapped).cast(typecode)
+
+
+def build_index(documents, path, tokenize, k1=1.2, b=0.75):
+    """Builds an index directory from (url, title, text) tuples.
+
+    tokenize is normally Tokenizer().tokenize_prose. Each posting stores the
+    document's full BM25 term score, so queries only add floats up.
+    """
+    os.makedirs(path, exist_ok=True)
+    postings = defaultdict(list)  # term -> [(doc id, term frequency)]
+    lengths = []
+    doc_offsets = array("Q", [0])
+    with open(os.path.join(path, "docs.bin"), "wb") as docs_file:
+        for doc_id, (url, title, text) in enumerate(documents):
+            terms = index_terms(tokenize(f"{title} {text}"))
+            lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                postings[term].append((doc_id, frequency))
+            record = json.dumps({"url": url, "title": title, "snippet": text[:SNIPPET_LENGTH]}).encode()
+            docs_file.write(record)
+            doc_offsets.append(doc_offsets[-1] + len(record))
+
+    count = len(lengths)
+    average_length = sum(lengths) / count if count else 0.0
+    arrays = {name: array(typecode) for name, typecode in ARRAY_FILES.items()}
+    arrays["doc_offsets"] = doc_offsets
+    arrays["term_offsets"].append(0)
+    arrays["term_postings"].append(0)
+    arrays["term_top"].append(0)
+    with open(os.path.join(path, "terms.bin"), "wb") as terms_file:
+        for term in sorted(postings):
+            entries = postings[term]
+            idf = math.log(1 + (count - len(entries) + 0.5) / (len(entries) + 0.5))
+            start = len(arrays["postings_impact"])
+            for doc_id, frequency in entries:
+                norm = k1 * (1 - b + b * lengths[doc_id] / average_length) if average_length else k1
+                impact = idf * frequency * (k1 + 1) / (frequency + norm)
+                arrays["postings_docs"].append(doc_id)
+                arrays["postings_impact"].append(impact)
+            # Taken from the stored float32 values, so they compare equal to the postings at query time
+            top = heapq.nlargest(TOP_IMPACTS, arrays["postings_impact"][start:])
+            best = top[0]
+            arrays["top_impacts"].extend(top)
+            arrays["term_top"].append(len(arrays["top_impacts"]))
+            encoded = term.encode()
+            terms_file.write(encoded)
+            arrays["term_offsets"].append(arrays["term_offsets"][-1] + len(encoded))
+            arrays["term_postings"].append(len(arrays["postings_docs"]))
+            arrays["term_max"].append(best)
+
+    for name, values in arrays.items():
+        with open(os.path.join(path, name), "wb") as file:
+            values.tofile(file)
+    with open(os.path.join(path, "meta.json"), "w") as file:
+        json.dump({"documents": count, "terms": len(postings), "average_length": average_length,
+                   "k1": k1, "b": b, "byteorder": sys.byteorder}, file)
+    return count
+
+
+class DocIndex:
+    """Read-only, memory-mapped BM25 index built by build_index()."""
+
+    # Below this many postings in total, adding every impact up in a plain loop
+    # is faster than MaxScore's bookkeeping
+    exhaustive_limit = 8192
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as file:
+            self.meta = json.load(file)
+        if self.meta["byteorder"] != sys.byteorder:
+            raise ValueError(f"Index at {path} was built on a {self.meta['byteorder']}-endian machine")
+        self.maps = []
+        self.terms = self._map(path, "terms.bin", "B")
+        self.docs = self._map(path, "docs.bin", "B")
+        for name, typecode in ARRAY_FILES.items():
+            if name in OPTIONAL_ARRAYS and not os.path.exists(os.path.join(path, name)):
+                setattr(self, name, None)
+                continue
+            setattr(self, name, self._map(path, name, typecode))
+        self.term_count = len(self.term_max)
+
+    def _map(self, path, name, typecode):
+        return map_array(os.path.join(path, name), typecode, self.maps)
+
+    def __len__(self):
+        return self.meta["documents"]
+
+    def _term(self, index):
+        return bytes(self.terms[self.term_offsets[index]:self.term_offsets[index + 1]])
+
+    def term_id(self, term):
+        """Binary search over the sorted term dictionary, without loading it."""
+        encoded = term.encode()
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self._term(low) == encoded:
+            return low
+        return None
+
+    def document(self, doc_id):
+        return json.loads(bytes(self.docs[self.doc_offsets[doc_id]:self.doc_offsets[doc_id + 1]]))
+
+    def _lists(self, terms):
+        lists = []
+        for term in set(terms):
+            term_id = self.term_id(term)
+            if term_id is not None:
+                start, end = self.term_postings[term_id], self.term_postings[term_id + 1]
+                lists.append((self.term_max[term_id], self.postings_docs[start:end], self.postings_impact[start:end],
+                              term_id))
+        return lists
+
+    def kth_impact(self, term_id, k):
+        """The k-th largest impact in a term's postings list, 0.0 if it has fewer than k."""
+        if self.term_top is not None:
+            start, end = self.term_top[term_id], self.term_top[term_id + 1]
+            if k <= end - start:
+                return self.top_impacts[start + k - 1]
+            if end - start < TOP_IMPACTS:
+                return 0.0  # The whole list is stored, and it's shorter than k
+        # Older index, or k beyond the stored prefix
+        start, end = self.term_postings[term_id], self.term_postings[term_id + 1]
+        return heapq.nlargest(k, self.postings_impact[start:end])[-1] if end - start >= k else 0.0
+
+    def search(self, terms, k=5):
+        """Top-k (score, doc id) for the query terms, best first, using MaxScore.
+
+        Lists are ordered by their score bound. The lowest-bound lists whose
+        bounds together can't lift a document past the current k-th score are
+        "non-essential": they are never walked, only probed by binary search for
+        documents found in the essential lists, and probing stops as soon as the
+        remaining bounds can't change the outcome.
+        """
+        lists = sorted(self._lists(terms), key=lambda entry: entry[0])
+        if not lists:
+            return []
+        if sum(len(entry[1]) for entry in lists) <= self.exhaustive_limit:
+            return self._score_all(lists, k)
+        docs = [entry[1] for entry in lists]
+        impacts = [entry[2] for entry in lists]
+        lengths = [len(doc_ids) for doc_ids in docs]
+        prefix = [0.0]
+        for bound, _, _, _ in lists:
+            prefix.append(prefix[-1] + bound)
+        cursors = [0] * len(lists)
+        heap = []  # (score, -doc id) of the current top k
+
+        # Every document's score is at least its impact in the top-bound list,
+        # so that list's k-th best impact is a floor for the final k-th score.
+        # Seeding with it prunes the common terms before the heap has filled up.
+        # A document scoring exactly the floor can still win on doc id, hence <.
+        floor = self.kth_impact(lists[-1][3], k)
+        threshold = 0.0  # k-th score in the heap once it is full; ties lose to earlier docs, hence <=
+
+        def can_enter(upper_bound):
+            return upper_bound > threshold and upper_bound >= floor
+
+        first_essential = 0
+        while first_essential < len(lists) and not can_enter(prefix[first_essential + 1]):
+            first_essential += 1
+        essential = range(first_essential, len(lists))
+
+        while first_essential < len(lists) - 1:
+            # Smallest current document among the essential lists
+            candidate = None
+            for index in essential:
+                if cursors[index] < lengths[index]:
+                    doc_id = docs[index][cursors[index]]
+                    if candidate is None or doc_id < candidate:
+                        candidate = doc_id
+            if candidate is None:
+                break
+
+            score = 0.0
+            for index in essential:
+                cursor = cursors[index]
+                if cursor < lengths[index] and docs[index][cursor] == candidate:
+                    score += impacts[index][cursor]
+                    cursors[index] = cursor + 1
+            # Probe non-essential lists, largest bound first, while they can still matter
+            for index in range(first_essential - 1, -1, -1):
+                if not can_enter(score + prefix[index + 1]):
+                    break
+                position = bisect_left(docs[index], candidate, cursors[index])
+                cursors[index] = position
+                if position < lengths[index] and docs[index][position] == candidate:
+                    score += impacts[index][position]
+
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -candidate))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -candidate))
+            else:
+                continue
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while first_essential < len(lists) and not can_enter(prefix[first_essential + 1]):
+                    first_essential += 1
+                if first_essential == len(lists):
+                    break  # No unseen document can enter the top k any more
+                essential = range(first_essential, len(lists))
+
+        if first_essential == len(lists) - 1:
+            # Only the top list is left to walk. Most of its postings can't reach
+            # the threshold even with every other list's bound added, and those
+            # are skipped without probing anything.
+            last = first_essential
+            rest = prefix[last]
+            start = cursors[last]
+            for candidate, impact in zip(docs[last][start:], impacts[last][start:]):
+                if not can_enter(impact + rest):
+                    continue
+                score = impact
+                for index in range(last - 1, -1, -1):
+                    if not can_enter(score + prefix[index + 1]):
+                        break
+                    position = bisect_left(docs[index], candidate, cursors[index])
+                    cursors[index] = position
+                    if position < lengths[index] and docs[index][position] == candidate:
+                        score += impacts[index][position]
+                if len(heap) < k:
+                    heapq.heappush(heap, (score, -candidate))
+                elif score > heap[0][0]:
+                    heapq.heapreplace(heap, (score, -candidate))
+                else:
+                    continue
+                if len(heap) == k:
+                    threshold = heap[0][0]
+
+        return [(score, -negative_id) for score, negative_id in sorted(heap, reverse=True)]
+
+    def exhaustive_search(self, terms, k=5):
+        """Scores every matching document; the reference MaxScore is checked against."""
+        return self._score_all(self._lists(terms), k)
+
+    def _score_all(self, lists, k):
+        scores = defaultdict(float)
+        for _, doc_ids, impacts, _ in lists:
+            for doc_id, impact in zip(doc_ids, impacts):
+                scores[doc_id] += impact
+        return [(score, doc_id) for doc_id, score in heapq.nsmallest(k, scores.items(), key=lambda item: (-item[1], item[0]))]
+
+    def close(self):
+        for view in (self.terms, self.docs, *(getattr(self, name) for name in ARRAY_FILES)):
+            if view is not None:
+                view.release()
+        for mapped in self.maps:
+            mapped.close()
+
+
+def iter_store_sections(store_path):
+    """Yields (url, title, text) for every section in a python_docs_scraper DocsStore file."""
+    import sqlite3
+    connection = sqlite3.connect(store_path)
+    try:
+        for url, anchor, title, text in connection.execute("SELECT url, anchor, title, text FROM sections ORDER BY id"):
+            yield f"{url}#{anchor}", title, text
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    # python -m nlp_pipeline.doc_index python_docs.sqlite3 doc_index/
+    from nlp_pipeline.tokenizer import Tokenizer
+    store_path, index_path = sys.argv[1], sys.argv[2]
+    built = build_index(iter_store_sections(store_path), index_path, Tokenizer(detect_code=False).tokenize_prose)
+    print(f"Indexed {built} sections into {index_path}")
@@ -1,29 +1,32 @@
-import keyword
+from nlp_pipeline.token_labels import KEYWORDS, OPERATORS, label_token
 
 class EntityRecognizer:
     def __init__(self):
         # Define entity types (keywords, identifiers, operators, etc.)
         self.entity_types = {
-            "keyword": keyword.kwlist,
-            "operator": ["+", "-", "*", "/", "=", ":", ">", "<", "(", ")", "{", "}", "[", "]", "!","|"],
-            "function": set(),  # You can add logic to identify function names
+            "keyword": KEYWORDS,
+            "operator": OPERATORS,
+            "function": set(),  # Filled from pasted code by add_code_analysis()
             "class": set()     # Logic for class names
             # Add more as needed
         }
-    
-    def recognize_entities(self, tokens):
 
-        recognized = []
+    def add_code_analysis(self, analysis):
+        """Remembers the function and class names a CodeAnalyzer found."""
+        for name, entity in analysis.entity_names().items():
+            self.entity_types[entity].add(name)
 
+    def recognize_entities(self, tokens):
+        """Labels every token using the precomputed table in token_labels."""
+        classes = self.entity_types["class"]
+        functions = self.entity_types["function"]
+        entities = []
         for token in tokens:
-            if token in self.entity_types["keyword"]:
-                recognized.append((token, "keyword"))
-            elif token in self.entity_types["operator"]:
-                recognized.append((token, "operator"))
-            elif token.isidentifier():
-                recognized.append((token, "identifier"))
-            elif token.isnumeric():
-                recognized.append((token, "number"))
-            else:
-                recognized.append((token, "unknown"))
-        return recognized
+            entity = label_token(token)[0]
+            if entity == "identifier":
+                if token in classes:
+                    entity = "class"
+                elif token in functions:
+                    entity = "function"
+            entities.append((token, entity))
+        return entities
@@ -1,14 +1,21 @@
+from nlp_pipeline.intent_matcher import IntentMatcher
+
 class IntentClassifier:
     
-    def __init__(self):
+    def __init__(self, priorities=None):
         self.intents = {
             "greet": ["hi", "hello", "hey", "howdy"],
             "bye": ["bye", "goodbye", "see you", "exit"],
             "ask_for_help": ["help", "assist", "support"]
         }
+        # Optional {intent: priority}, higher wins when several intents match
+        self.priorities = priorities or {}
+        self.compile()
+
+    def compile(self):
+        """Rebuilds the matcher, call it after changing self.intents or self.priorities."""
+        self.matcher = IntentMatcher(self.intents, self.priorities)
 
     def classify_intent(self, tokens):
-        for intent, keywords in self.intents.items():
-            if any(keyword in tokens for keyword in keywords):
-                return intent
-        return "unknown"  # If no match, return 'unknown'
+        intent = self.matcher.match(tokens)
+        return intent if intent is not None else "unknown"  # If no match, return 'unknown'
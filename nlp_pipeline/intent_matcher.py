@@ -0,0 +1,78 @@
+class IntentMatcher:
+    """Aho-Corasick automaton over token sequences, built once from an intent table.
+
+    Every keyword is split on whitespace into a phrase of one or more tokens, so
+    "see you" matches the two tokens "see", "you" in a row. A match costs time
+    linear in the number of tokens, however many intents and keywords there are.
+    When several intents match, the highest priority wins; ties go to the intent
+    listed first.
+    """
+
+    def __init__(self, intents, priorities=None):
+        priorities = priorities or {}
+        self.intent_names = list(intents)
+        # rank[i] orders intent i: lower rank wins
+        self.ranks = [(-priorities.get(name, 0), order) for order, name in enumerate(self.intent_names)]
+        self.goto = [{}]  # node -> {token: next node}, node 0 is the root
+        self.best = [None]  # node -> index of the best intent whose phrase ends at that node (or a suffix of it)
+        for index, name in enumerate(self.intent_names):
+            for keyword in intents[name]:
+                phrase = keyword.split()
+                if phrase:
+                    self._add(phrase, index)
+        self.fail = [0] * len(self.goto)
+        self._link()
+        self.top_intent = min(range(len(self.ranks)), key=self.ranks.__getitem__) if self.ranks else None
+
+    def _better(self, a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return a if self.ranks[a] <= self.ranks[b] else b
+
+    def _add(self, phrase, index):
+        node = 0
+        for token in phrase:
+            next_node = self.goto[node].get(token)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][token] = next_node
+                self.goto.append({})
+                self.best.append(None)
+            node = next_node
+        self.best[node] = self._better(self.best[node], index)
+
+    def _link(self):
+        # Breadth-first so every fail target is finished before it is used
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for token, child in self.goto[node].items():
+                fallback = self.fail[node]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(token, 0)
+                self.best[child] = self._better(self.best[child], self.best[self.fail[child]])
+                queue.append(child)
+
+    def match(self, tokens):
+        """Returns the name of the best matching intent, or None."""
+        goto = self.goto
+        fail = self.fail
+        best = self.best
+        ranks = self.ranks
+        node = 0
+        found = None
+        for token in tokens:
+            while node and token not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(token, 0)
+            hit = best[node]
+            if hit is not None and (found is None or ranks[hit] < ranks[found]):
+                found = hit
+                if hit == self.top_intent:
+                    break  # Nothing can beat it
+        return None if found is None else self.intent_names[found]
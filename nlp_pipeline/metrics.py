@@ -0,0 +1,306 @@
+import json
+import math
+import sys
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from collections import Counter as Tally
+
+# Upper bounds, in seconds, of the latency histogram buckets (Prometheus "le"),
+# from 10 microseconds, below the cheapest stage, to 10 seconds. Anything slower
+# lands in the implicit +Inf bucket.
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their sum, like a Prometheus histogram."""
+
+    __slots__ = ("buckets", "counts", "sum", "count", "lock")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self):
+        """[(upper bound, observations <= bound)], ending with (inf, count)."""
+        with self.lock:
+            counts = list(self.counts)
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile, 0.0 when empty."""
+        cumulative = self.cumulative()
+        target = fraction * cumulative[-1][1]
+        for bound, total in cumulative:
+            if total and total >= target:
+                return bound
+        return 0.0
+
+
+class Counter:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+def _series_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+class Metrics:
+    """Process-wide registry of counters and histograms, exported as Prometheus text or JSON.
+
+    Metrics are created on first use by name and labels, and callers keep the
+    returned object so the hot path is a single observe() or inc(). Per-call
+    timings are sampled: callers time one call in sample_every, which keeps
+    the cost under 1% of a pipeline call; set sample_every to 1 to time every
+    call. With enabled False nothing is timed at all.
+
+    Objects that keep their own statistics, like caches, register a collector
+    instead of paying for a metric on every lookup; collectors run only when a
+    snapshot is taken.
+    """
+
+    def __init__(self, sample_every=64):
+        self.enabled = True
+        self.sample_every = sample_every
+        self.lock = threading.Lock()
+        self.metrics = {}  # name -> (type, help, {label key: Counter or Histogram})
+        self.collectors = weakref.WeakKeyDictionary()  # owner -> function(owner) yielding samples
+
+    def _get(self, kind, factory, name, help, labels):
+        with self.lock:
+            entry = self.metrics.get(name)
+            if entry is None:
+                entry = self.metrics[name] = (kind, help, {})
+            elif entry[0] != kind:
+                raise ValueError(f"Metric {name} is a {entry[0]}, not a {kind}")
+            series = entry[2]
+            key = _series_key(labels)
+            metric = series.get(key)
+            if metric is None:
+                metric = series[key] = factory()
+            return metric
+
+    def counter(self, name, help="", **labels):
+        return self._get("counter", Counter, name, help, labels)
+
+    def histogram(self, name, help="", buckets=LATENCY_BUCKETS, **labels):
+        return self._get("histogram", lambda: Histogram(buckets), name, help, labels)
+
+    def add_collector(self, owner, collect):
+        """Calls collect(owner) at every snapshot while owner is alive.
+
+        collect yields (name, type, help, labels dict, value) with type "counter"
+        or "gauge"; samples from several owners with the same name and labels are summed.
+        """
+        self.collectors[owner] = collect
+
+    def _collected(self):
+        samples = {}  # name -> (type, help, {label key: value})
+        for owner, collect in list(self.collectors.items()):
+            for name, kind, help, labels, value in collect(owner):
+                entry = samples.setdefault(name, (kind, help, {}))
+                key = _series_key(labels)
+                entry[2][key] = entry[2].get(key, 0) + value
+        return samples
+
+    def _registered(self):
+        with self.lock:
+            return [(name, kind, help, list(series.items())) for name, (kind, help, series) in self.metrics.items()]
+
+    def snapshot(self):
+        """{"metrics": every metric as a JSON-ready dict, "cache_hit_rates": {cache: hit rate}}."""
+        result = {}
+        for name, kind, help, series in self._registered():
+            values = []
+            for key, metric in series:
+                if kind == "histogram":
+                    values.append({
+                        "labels": dict(key), "count": metric.count, "sum": metric.sum,
+                        "buckets": [[_format_bound(bound), total] for bound, total in metric.cumulative()],
+                        "p50": metric.quantile(0.5), "p99": metric.quantile(0.99),
+                    })
+                else:
+                    values.append({"labels": dict(key), "value": metric.value})
+            result[name] = {"type": kind, "help": help, "series": values}
+        for name, (kind, help, series) in self._collected().items():
+            result[name] = {"type": kind, "help": help,
+                            "series": [{"labels": dict(key), "value": value} for key, value in series.items()]}
+        return {"metrics": result, "cache_hit_rates": self._hit_rates(result)}
+
+    @staticmethod
+    def _hit_rates(result):
+        hits = {entry["labels"].get("cache"): entry["value"] for entry in result.get("codebot_cache_hits_total", {}).get("series", ())}
+        misses = {entry["labels"].get("cache"): entry["value"] for entry in result.get("codebot_cache_misses_total", {}).get("series", ())}
+        rates = {}
+        for cache, hit_count in hits.items():
+            lookups = hit_count + misses.get(cache, 0)
+            rates[cache] = hit_count / lookups if lookups else 0.0
+        return rates
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        """The Prometheus text exposition format, version 0.0.4."""
+        lines = []
+        for name, kind, help, series in self._registered():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, metric in series:
+                if kind == "histogram":
+                    for bound, total in metric.cumulative():
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', _format_bound(bound))])} {total}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {metric.sum!r}")
+                    lines.append(f"{name}_count{_format_labels(key)} {metric.count}")
+                else:
+                    lines.append(f"{name}{_format_labels(key)} {metric.value}")
+        for name, (kind, help, series) in self._collected().items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in series.items():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class Profiler:
+    """A profiling hook that can be switched on and off while the process runs.
+
+    "cprofile" mode runs cProfile around each pipeline call made through
+    run(), one call at a time. "sampling" mode starts a thread that records
+    every other thread's stack each interval seconds; it needs no cooperation
+    from the code being profiled and costs nothing per call. stop() returns
+    the report as text.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profile = None  # cProfile.Profile while cprofile mode is on
+        self.sampler = None
+        self.samples = None
+        self.stopping = None
+
+    @property
+    def active(self):
+        return self.profile is not None or self.sampler is not None
+
+    def start(self, mode="cprofile", interval=0.005):
+        with self.lock:  # Two /profile requests at once must not both start
+            if self.active:
+                raise RuntimeError("Profiling is already running")
+            if mode == "cprofile":
+                import cProfile
+                self.profile = cProfile.Profile()
+            elif mode == "sampling":
+                self.samples = (Tally(), Tally())  # own time, on-stack time per (file, line, function)
+                self.stopping = threading.Event()
+                self.sampler = threading.Thread(target=self._sample, args=(interval,), name="profiler", daemon=True)
+                self.sampler.start()
+            else:
+                raise ValueError(f"Unknown profiling mode {mode!r}, expected cprofile or sampling")
+
+    def run(self, function, *args):
+        """Calls function(*args), under cProfile when cprofile mode is on."""
+        profile = self.profile
+        if profile is None:
+            return function(*args)
+        with self.lock:
+            return profile.runcall(function, *args)
+
+    def _sample(self, interval):
+        own = threading.get_ident()
+        own_time, on_stack = self.samples
+        while not self.stopping.wait(interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                own_time[_frame_key(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    key = _frame_key(frame)
+                    if key not in seen:  # Recursion counts a function once per sample
+                        seen.add(key)
+                        on_stack[key] += 1
+                    frame = frame.f_back
+
+    def stop(self, limit=30):
+        """Stops profiling and returns the report, most expensive functions first."""
+        if self.profile is not None:
+            import io
+            import pstats
+            with self.lock:
+                profile, self.profile = self.profile, None
+            output = io.StringIO()
+            pstats.Stats(profile, stream=output).sort_stats("cumulative").print_stats(limit)
+            return output.getvalue()
+        if self.sampler is not None:
+            self.stopping.set()
+            self.sampler.join()
+            self.sampler = None
+            own_time, on_stack = self.samples
+            total = sum(own_time.values()) or 1
+            lines = [f"{sum(own_time.values())} samples", f"{'own %':>7} {'total %':>7}  function"]
+            for key, count in on_stack.most_common(limit):
+                filename, lineno, function = key
+                lines.append(f"{own_time[key] / total:7.1%} {count / total:7.1%}  {function} ({filename}:{lineno})")
+            return "\n".join(lines) + "\n"
+        raise RuntimeError("Profiling is not running")
+
+    def profile_for(self, seconds, mode="sampling", interval=0.005):
+        """Profiles for the given number of seconds and returns the report."""
+        if not (math.isfinite(seconds) and seconds >= 0):
+            raise ValueError(f"seconds must be a finite number >= 0, got {seconds!r}")
+        self.start(mode, interval)
+        try:
+            time.sleep(seconds)
+        finally:
+            report = self.stop()
+        return report
+
+
+def _frame_key(frame):
+    code = frame.f_code
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+PROFILER = Profiler()
@@ -1,34 +1,369 @@
-from nlp_pipeline.tokenizer import Tokenizer
-from nlp_pipeline.pos_tagger import POSTagger
-from nlp_pipeline.intent_classifier import IntentClassifier
-from nlp_pipeline.entity_recognizer import EntityRecognizer
-from nlp_pipeline.response_generator import ResponseGenerator
+from collections import deque
+from functools import cached_property
+from itertools import islice
+from time import perf_counter
 import logging
+import os
+
+from nlp_pipeline.metrics import METRICS, PROFILER
+
+# Stages with latency histograms; see stage_graph() for what they do. "entities"
+# is the ast analysis of pasted code, "label" gives every token its entity and
+# "resolve" is process_turn()'s reference resolution.
+STAGES = ("tokenize", "intent", "tag", "entities", "label", "resolve", "generate")
 
 class NLPPipeline:
-    def __init__(self):
-        self.tokenizer = Tokenizer()
-        self.pos_tagger = POSTagger()
-        self.intent_classifier = IntentClassifier()
-        self.entity_recognizer = EntityRecognizer()
-        self.response_generator = ResponseGenerator()
+    """Runs user input through the NLP stages.
+
+    Stages (and the modules that define them) are only built the first time
+    they are used, so creating a pipeline costs next to nothing and stages a
+    session never needs are never loaded. Assigning a stage attribute replaces it.
+
+    After tokenization, stages run from a plan compiled out of stage_graph(),
+    which skips work no later stage needs: POS tags are only computed for the
+    debug log, and entities only for intents whose reply uses them.
+
+    With cache_size > 0, results are cached on the utterance's tokens, so
+    repeated inputs like "hi" or "help" skip every stage after the tokenizer.
+    A stage that sets context_dependent = True turns the cache off.
+
+    Stage latencies, input counts and cache hit rates are reported to
+    nlp_pipeline.metrics.METRICS, and calls run under PROFILER when it is on.
+    """
+
+    def __init__(self, cache_size=0, stage_workers=0):
+        self.response_cache = None
+        if cache_size > 0:
+            from nlp_pipeline.response_cache import ResponseCache
+            self.response_cache = ResponseCache(cache_size)
+        # With stage_workers > 0, stages that don't depend on each other run on a thread pool
+        self.stage_executor = None
+        if stage_workers > 0:
+            from concurrent.futures import ThreadPoolExecutor
+            self.stage_executor = ThreadPoolExecutor(stage_workers, thread_name_prefix="nlp-stage")
+        self.stage_seconds = {
+            stage: METRICS.histogram("codebot_stage_seconds", "Time spent in each stage of process_input (sampled).", stage=stage)
+            for stage in STAGES
+        }
+        self.input_seconds = METRICS.histogram("codebot_input_seconds", "Time process_input took, cache hits included (sampled).")
+        self.batch_stage_seconds = {
+            stage: METRICS.histogram("codebot_batch_stage_seconds", "Time each stage took for a whole process_batch chunk.", stage=stage)
+            for stage in STAGES
+        }
+        self.inputs = 0  # Read by the metrics collector; one plain add per input is all the hot path pays
+        METRICS.add_collector(self, NLPPipeline._collect_stats)
+
+    @cached_property
+    def tokenizer(self):
+        from nlp_pipeline.tokenizer import Tokenizer
+        return Tokenizer()
+
+    @cached_property
+    def pos_tagger(self):
+        from nlp_pipeline.pos_tagger import POSTagger
+        return POSTagger()
+
+    @cached_property
+    def intent_classifier(self):
+        if os.environ.get("INTENT_MODEL_PATH"):
+            # Trained with `python -m nlp_pipeline.semantic_intent`; needs numpy
+            from nlp_pipeline.semantic_intent import SemanticIntentClassifier
+            return SemanticIntentClassifier()
+        from nlp_pipeline.intent_classifier import IntentClassifier
+        return IntentClassifier()
+
+    @cached_property
+    def entity_recognizer(self):
+        from nlp_pipeline.entity_recognizer import EntityRecognizer
+        return EntityRecognizer()
+
+    @cached_property
+    def response_generator(self):
+        from nlp_pipeline.response_generator import ResponseGenerator
+        return ResponseGenerator()
+
+    @cached_property
+    def token_labeler(self):
+        # Does the work of pos_tagger and entity_recognizer in one pass over the tokens
+        from nlp_pipeline.token_labels import TokenLabeler
+        return TokenLabeler()
+
+    @cached_property
+    def code_analyzer(self):
+        from nlp_pipeline.code_analyzer import CodeAnalyzer
+        return CodeAnalyzer()
+
+    def preload(self):
+        """Builds every stage the plans use now instead of on first use; returns the pipeline.
+
+        For servers that fork workers after loading, so the workers share one
+        copy of the loaded stages instead of each building its own.
+        """
+        for stage in ("tokenizer", "intent_classifier", "token_labeler", "code_analyzer", "response_generator"):
+            getattr(self, stage)
+        load_doc_index = getattr(self.response_generator, "load_doc_index", None)
+        if load_doc_index is not None:
+            load_doc_index()
+        self.plans
+        return self
+
+    def code_entities(self, code):
+        """{name: "function" | "class"} defined or called in the code spans of a message, or None."""
+        if not code:
+            return None
+        return self.code_analyzer.analyze("".join(code)).entity_names()
 
     def process_input(self, user_input):
-        logging.debug(f"User Input: {user_input}")
+        if PROFILER.profile is not None:
+            return PROFILER.run(self._process_input, user_input)
+        return self._process_input(user_input)
+
+    def process_turn(self, user_input, dialogue):
+        """process_input for one turn of a conversation, with dialogue the session's DialogueState.
 
-        tokens = self.tokenizer.tokenize(user_input)
-        logging.debug(f"Tokens: {tokens}")
+        References like "what about that?" are resolved against the state
+        before the response is generated. Returns (response, intent, turn);
+        passing turn to ContextManager.update() records it in the state. The
+        response cache is skipped, since the reply depends on the state.
+        """
+        if PROFILER.profile is not None:
+            return PROFILER.run(self._process_input, user_input, dialogue)
+        return self._process_input(user_input, dialogue)
 
-        pos_tags = self.pos_tagger.tag(tokens)
-        logging.debug(f"POS Tags: {pos_tags}")
+    def _process_input(self, user_input, dialogue=None):
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        if debug:
+            logging.debug(f"User Input: {user_input}")
+        self.inputs += 1
+        timed = METRICS.enabled and self.inputs % METRICS.sample_every == 0
+        if timed:
+            started = perf_counter()
 
-        intent = self.intent_classifier.classify_intent(tokens)
-        logging.debug(f"Detected Intent: {intent}")
+        tokens, code = self.tokenizer.split_code(user_input)
+        if timed:
+            self.stage_seconds["tokenize"].observe(perf_counter() - started)
+        if debug:
+            logging.debug(f"Tokens: {tokens}")
 
-        entities = self.entity_recognizer.recognize_entities(tokens)
-        logging.debug(f"Recognized Entities: {entities}")
+        cache = self.active_cache() if dialogue is None else None
+        if cache is not None:
+            key = tuple(tokens)
+            cached = cache.get(key)
+            if cached is not None:
+                if timed:
+                    self.input_seconds.observe(perf_counter() - started)
+                if debug:
+                    logging.debug(f"Cached response: {cached[0]}")
+                return cached
 
-        response = self.response_generator.generate(intent, entities)
-        logging.debug(f"Response: {response}")
+        timings = {} if timed else None
+        if dialogue is None:
+            values = self.plans["debug" if debug else "default"].run(
+                {"tokens": tokens, "code": code}, self.stage_executor, timings)
+            intent = values["intent"]
+        else:
+            values = self.plans["dialogue_debug" if debug else "dialogue"].run(
+                {"tokens": tokens, "code": code, "dialogue": dialogue}, self.stage_executor, timings)
+            intent = values["turn_intent"]
+        response = values["response"]
+        if timed:
+            self._observe_stages(timings)
+            self.input_seconds.observe(perf_counter() - started)
+        if debug:
+            logging.debug(f"POS Tags: {values['pos_tags']}")
+            logging.debug(f"Detected Intent: {intent}")
+            logging.debug(f"Recognized Entities: {values['entities']}")
+            logging.debug(f"Response: {response}")
 
+        if dialogue is not None:
+            return response, intent, values["turn"]
+        if cache is not None:
+            cache.put(key, (response, intent))
         return response, intent
+
+    def stage_graph(self, dialogue=False):
+        """The stages that run after tokenization, as a StageGraph over named values.
+
+        Stages are looked up on the pipeline each time they run, so assigning
+        a stage attribute still replaces it. "entities" and "label" only run
+        when the response generator will look at the entities for the intent.
+
+        With dialogue, a "resolve" stage reads the session's DialogueState
+        (the "dialogue" value) and the reply is generated from the intent and
+        entities it resolved; entities then always run, since the state
+        remembers them.
+        """
+        from nlp_pipeline.stage_graph import Stage, StageGraph
+        when_needed = None if dialogue else (("intent",), self.uses_entities)
+        stages = [
+            Stage("intent", lambda tokens: self.intent_classifier.classify_intent(tokens), ("tokens",), ("intent",)),
+            Stage("tag", lambda tokens: self.token_labeler.tags(tokens), ("tokens",), ("pos_tags",)),
+            Stage("entities", self.code_entities, ("code",), ("code_entities",), when=when_needed),
+            Stage("label", lambda tokens, code_entities: self.token_labeler.entities(tokens, code_entities),
+                  ("tokens", "code_entities"), ("entities",), when=when_needed, skipped=([],)),
+        ]
+        if dialogue:
+            from nlp_pipeline.dialogue_state import resolve_turn
+            stages.append(Stage("resolve", lambda state, tokens, intent, entities: resolve_turn(
+                state, tokens, intent, entities, self.uses_entities), ("dialogue", "tokens", "intent", "entities"),
+                ("turn_intent", "turn_entities", "turn")))
+            stages.append(Stage("generate", lambda intent, entities: self.response_generator.generate(intent, entities),
+                                ("turn_intent", "turn_entities"), ("response",)))
+        else:
+            stages.append(Stage("generate", lambda intent, entities: self.response_generator.generate(intent, entities),
+                                ("intent", "entities"), ("response",)))
+        return StageGraph(stages)
+
+    @cached_property
+    def plans(self):
+        """Execution plans compiled once from stage_graph().
+
+        "default" computes only the response and intent, so POS tagging is
+        dropped; "debug" also keeps the POS tags and entities for the log.
+        The batch plans start from intents process_batch classified already,
+        and the dialogue plans serve process_turn().
+        """
+        graph = self.stage_graph()
+        dialogue = self.stage_graph(dialogue=True)
+        return {
+            "default": graph.compile(("response", "intent"), given=("tokens", "code")),
+            "debug": graph.compile(("response", "intent", "pos_tags", "entities"), given=("tokens", "code")),
+            "batch": graph.compile(("response",), given=("tokens", "code", "intent")),
+            "batch_debug": graph.compile(("response", "pos_tags", "entities"), given=("tokens", "code", "intent")),
+            "dialogue": dialogue.compile(("response", "turn_intent", "turn"), given=("tokens", "code", "dialogue")),
+            "dialogue_debug": dialogue.compile(("response", "turn_intent", "turn", "pos_tags"),
+                                               given=("tokens", "code", "dialogue")),
+        }
+
+    def uses_entities(self, intent):
+        uses_entities = getattr(self.response_generator, "uses_entities", None)
+        return uses_entities is None or uses_entities(intent)
+
+    def _observe_stages(self, timings):
+        for stage, seconds in timings.items():
+            histogram = self.stage_seconds.get(stage)
+            if histogram is None:
+                histogram = self.stage_seconds[stage] = METRICS.histogram("codebot_stage_seconds", stage=stage)
+            histogram.observe(seconds)
+
+    def _collect_stats(self):
+        # Collector for METRICS: counts the pipeline and its caches already keep, read only at snapshot time
+        yield "codebot_inputs_total", "counter", "Inputs processed, one at a time or in batches.", {}, self.inputs
+        caches = [("response", self.response_cache)]
+        if "tokenizer" in self.__dict__:
+            caches.append(("code_lexer", self.tokenizer.code_lexer))
+        if "code_analyzer" in self.__dict__:
+            caches.append(("code_analyzer", self.code_analyzer))
+        for name, cache in caches:
+            if cache is not None:
+                yield "codebot_cache_hits_total", "counter", "Cache lookups that found an entry.", {"cache": name}, cache.hits
+                yield "codebot_cache_misses_total", "counter", "Cache lookups that missed.", {"cache": name}, cache.misses
+
+    def active_cache(self):
+        """Returns the response cache, or None when it is off or a stage depends on context."""
+        if self.response_cache is None:
+            return None
+        for stage in (self.intent_classifier, self.token_labeler, self.response_generator):
+            if getattr(stage, "context_dependent", False):
+                return None
+        return self.response_cache
+
+    def process_batch(self, user_inputs, chunk_size=256, workers=0):
+        """Lazily yields (response, intent) for every input, in input order.
+
+        Inputs are consumed chunk_size at a time, so any iterable works, including
+        generators over archived history that don't fit in memory. With workers > 0
+        chunks are fanned out to a process pool, keeping at most 2 * workers chunks
+        in flight.
+        """
+        chunks = _chunked(user_inputs, chunk_size)
+        if workers > 0:
+            yield from _process_chunks_in_pool(chunks, workers)
+            return
+        for chunk in chunks:
+            yield from PROFILER.run(self._process_chunk, chunk)
+
+    def _process_chunk(self, chunk):
+        # Look every stage up once per chunk instead of once per input
+        split_code = self.tokenizer.split_code
+        classify_intent = self.intent_classifier.classify_intent
+        classify_batch = getattr(self.intent_classifier, "classify_batch", None)
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        plan = self.plans["batch_debug" if debug else "batch"]
+        cache = self.active_cache()
+        self.inputs += len(chunk)
+        timed = METRICS.enabled  # One set of timings per chunk is cheap enough to never sample
+        if timed:
+            now = perf_counter()
+
+        results = [None] * len(chunk)
+        pending = []  # (position, user input, tokens, code) of inputs the cache didn't answer
+        for position, user_input in enumerate(chunk):
+            tokens, code = split_code(user_input)
+            if cache is not None:
+                cached = cache.get(tuple(tokens))
+                if cached is not None:
+                    results[position] = cached
+                    continue
+            pending.append((position, user_input, tokens, code))
+        if timed:
+            now = self._batch_lap("tokenize", now)
+
+        if classify_batch is not None:
+            # Classifiers that score a whole batch at once get every pending input together
+            intents = classify_batch([tokens for _, _, tokens, _ in pending])
+        else:
+            intents = [classify_intent(tokens) for _, _, tokens, _ in pending]
+        if timed:
+            self._batch_lap("intent", now)
+
+        timings = {} if timed else None
+        for (position, user_input, tokens, code), intent in zip(pending, intents):
+            values = plan.run({"tokens": tokens, "code": code, "intent": intent}, self.stage_executor, timings)
+            response = values["response"]
+            if debug:
+                logging.debug(f"Batch input: {user_input} -> tokens {tokens}, POS tags {values['pos_tags']}, "
+                              f"intent {intent}, entities {values['entities']}, response {response}")
+            if cache is not None:
+                cache.put(tuple(tokens), (response, intent))
+            results[position] = (response, intent)
+        if timed:
+            for stage, seconds in timings.items():
+                self.batch_stage_seconds[stage].observe(seconds)
+        return results
+
+    def _batch_lap(self, stage, started):
+        now = perf_counter()
+        self.batch_stage_seconds[stage].observe(now - started)
+        return now
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Each pool worker builds its own pipeline once and reuses it for every chunk
+_worker_pipeline = None
+
+def _init_worker():
+    global _worker_pipeline
+    _worker_pipeline = NLPPipeline()
+
+def _process_chunk_in_worker(chunk):
+    return _worker_pipeline._process_chunk(chunk)
+
+def _process_chunks_in_pool(chunks, workers):
+    from concurrent.futures import ProcessPoolExecutor  # Pulls in multiprocessing, only needed here
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(_process_chunk_in_worker, chunk))
+            if len(in_flight) >= 2 * workers:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
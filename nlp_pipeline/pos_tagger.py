@@ -1,11 +1,10 @@
+from nlp_pipeline.token_labels import POS_TAGS
+
 class POSTagger:
+    def __init__(self):
+        self.tag_map = POS_TAGS  # Built once at import, shared by every tagger
+
     def tag(self, tokens):
         """Simple POS tagging based on predefined rules."""
-        tag_map = {
-            "hello": "INTJ",
-            "I": "PRON",
-            "am": "VERB",
-            "a": "DET",
-            "developer": "NOUN",
-        }
-        return [(token, tag_map.get(token, "UNK")) for token in tokens]
\ No newline at end of file
+        get = self.tag_map.get
+        return [(token, get(token, "UNK")) for token in tokens]
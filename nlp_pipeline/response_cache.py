@@ -0,0 +1,53 @@
+from collections import OrderedDict
+from threading import Lock
+
+class ResponseCache:
+    """Bounded LRU cache of pipeline results keyed on the token tuple of an utterance.
+
+    The tokenizer already drops whitespace and stopwords, so "hi there",
+    " hi  there " and "hi the there" share one key. Case is kept: intent
+    matching is case-sensitive, so "Hi" and "hi" can get different replies.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # token tuple -> (response, intent), least recently used first
+        self.lock = Lock()  # The bot server shares one pipeline between threads
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,13 +1,55 @@
+import logging
+import os
+
+# Replies that don't depend on what the user mentioned
+FIXED_RESPONSES = {
+    "greet": "Hello! How can I assist you today?",
+    "bye": "Goodbye! Have a great day!",
+    "ask_for_help": "How can I help you?",
+    "self_intro": "Nice to meet you! I'm a bot designed to assist with coding tasks.",
+}
+
+
 class ResponseGenerator:
+    def __init__(self, doc_index_path=None, min_score=1.0):
+        # Directory built by `python -m nlp_pipeline.doc_index`; without one,
+        # unknown intents get the plain clarification reply
+        self.doc_index_path = doc_index_path or os.environ.get("DOC_INDEX_PATH")
+        self.min_score = min_score  # Weaker matches than this aren't worth answering with
+        self.doc_index = None
+
+    def load_doc_index(self):
+        """Opens the doc index on first use; returns None if there isn't a usable one."""
+        if self.doc_index is None and self.doc_index_path:
+            from nlp_pipeline.doc_index import DocIndex
+            try:
+                self.doc_index = DocIndex(self.doc_index_path)
+            except (OSError, ValueError) as e:
+                logging.error(f"Error loading doc index from {self.doc_index_path}: {e}")
+                self.doc_index_path = None  # Don't retry on every message
+        return self.doc_index
+
+    def lookup_docs(self, entities):
+        """Best matching docs section for the entity tokens, as a {"url", "title", "snippet"} dict, or None."""
+        doc_index = self.load_doc_index()
+        if doc_index is None:
+            return None
+        from nlp_pipeline.doc_index import index_terms
+        hits = doc_index.search(index_terms(token for token, _ in entities), k=1)
+        if not hits or hits[0][0] < self.min_score:
+            return None
+        return doc_index.document(hits[0][1])
+
+    def uses_entities(self, intent):
+        """False when generate() would ignore the entities for this intent, so the pipeline can skip them."""
+        return intent not in FIXED_RESPONSES and self.load_doc_index() is not None
+
     def generate(self, intent, entities):
         """Generate a response based on intent and entities."""
-        if intent == "greet":
-           return "Hello! How can I assist you today?"
-        elif intent == "bye":
-           return "Goodbye! Have a great day!"
-        elif intent == "ask_for_help":
-            return "How can I help you?"
-        elif intent == "self_intro":
-            return "Nice to meet you! I'm a bot designed to assist with coding tasks."
-        else:
-            return "I'm not sure I understand. Could you clarify?"
\ No newline at end of file
+        response = FIXED_RESPONSES.get(intent)
+        if response is not None:
+            return response
+        doc = self.lookup_docs(entities)
+        if doc is not None:
+            return f"{doc['title']}: {doc['snippet']}\nSee {doc['url']}"
+        return "I'm not sure I understand. Could you clarify?"
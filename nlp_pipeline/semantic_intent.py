@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import sys
+import zlib
+
+import numpy as np
+
+# A model is a directory written by save_model():
+#   weights.npy   float32[n_features, n_intents]  linear weights over hashed n-grams
+#   bias.npy      float32[n_intents]
+#   model.json    intent names (column order), n_features and max_n
+# The arrays are opened with np.load(mmap_mode="r"), so bot processes share
+# the pages instead of each holding a copy.
+DEFAULT_FEATURES = 1 << 16
+DEFAULT_MAX_N = 2
+
+
+def ngrams(tokens, max_n=DEFAULT_MAX_N):
+    """Lowercased 1..max_n-grams of tokens, joined by spaces."""
+    words = [token.lower() for token in tokens]
+    grams = list(words)
+    for n in range(2, max_n + 1):
+        grams.extend(" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+    return grams
+
+
+def hash_features(batch, n_features=DEFAULT_FEATURES, max_n=DEFAULT_MAX_N):
+    """Hashed bag-of-n-grams for a batch of token lists, as a CSR matrix.
+
+    Returns (indptr, indices, values): row i's features are
+    indices[indptr[i]:indptr[i + 1]]. crc32 keeps feature ids stable across
+    processes, unlike hash(). Rows are L2-normalized so long inputs don't
+    outscore short ones.
+    """
+    indptr = [0]
+    indices = []
+    values = []
+    for tokens in batch:
+        counts = {}
+        for gram in ngrams(tokens, max_n):
+            feature = zlib.crc32(gram.encode()) % n_features
+            counts[feature] = counts.get(feature, 0) + 1
+        norm = sum(count * count for count in counts.values()) ** 0.5
+        indices.extend(counts)
+        values.extend(count / norm for count in counts.values())
+        indptr.append(len(indices))
+    return (np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int64),
+            np.array(values, dtype=np.float32))
+
+
+def linear_scores(features, weights, bias):
+    """features @ weights + bias for CSR features, in one pass over the batch."""
+    indptr, indices, values = features
+    rows = len(indptr) - 1
+    scores = np.tile(bias, (rows, 1)).astype(np.float32)
+    nonempty = indptr[1:] > indptr[:-1]
+    if indices.size:
+        contributions = weights[indices] * values[:, None]
+        # reduceat sums each row's segment; empty rows would break its
+        # segment boundaries, so they keep the bias alone
+        scores[nonempty] += np.add.reduceat(contributions, indptr[:-1][nonempty], axis=0)
+    return scores
+
+
+def softmax(scores):
+    shifted = np.exp(scores - scores.max(axis=1, keepdims=True))
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+
+def train(examples, n_features=DEFAULT_FEATURES, max_n=DEFAULT_MAX_N, epochs=200, learning_rate=2.0, l2=1e-4):
+    """Fits a multinomial logistic regression on (tokens, intent) pairs.
+
+    Full-batch gradient descent; intent examples number in the hundreds, so
+    this takes well under a second. Returns (weights, bias, intents).
+    """
+    examples = list(examples)
+    intents = sorted({intent for _, intent in examples})
+    column = {intent: i for i, intent in enumerate(intents)}
+    features = hash_features([tokens for tokens, _ in examples], n_features, max_n)
+    indptr, indices, values = features
+    rows = np.repeat(np.arange(len(examples)), np.diff(indptr))
+    targets = np.zeros((len(examples), len(intents)), dtype=np.float32)
+    targets[np.arange(len(examples)), [column[intent] for _, intent in examples]] = 1
+
+    weights = np.zeros((n_features, len(intents)), dtype=np.float32)
+    bias = np.zeros(len(intents), dtype=np.float32)
+    for _ in range(epochs):
+        error = (softmax(linear_scores(features, weights, bias)) - targets) / len(examples)
+        gradient = np.zeros_like(weights)
+        np.add.at(gradient, indices, error[rows] * values[:, None])
+        weights -= learning_rate * (gradient + l2 * weights)
+        bias -= learning_rate * error.sum(axis=0)
+    return weights, bias, intents
+
+
+def save_model(path, weights, bias, intents, max_n=DEFAULT_MAX_N):
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "weights.npy"), weights.astype(np.float32))
+    np.save(os.path.join(path, "bias.npy"), bias.astype(np.float32))
+    with open(os.path.join(path, "model.json"), "w") as file:
+        json.dump({"intents": intents, "n_features": weights.shape[0], "max_n": max_n}, file)
+
+
+class SemanticIntentClassifier:
+    """Linear intent model over hashed n-grams, with the keyword rules as fallback.
+
+    Drop-in for IntentClassifier: classify_intent(tokens) returns an intent
+    name or "unknown". When the model's best probability is below threshold,
+    or there is no model, the rule-based classifier decides instead.
+    classify_batch scores a whole batch with one matrix product.
+    """
+
+    def __init__(self, model_path=None, threshold=0.6, fallback=None):
+        if fallback is None:
+            from nlp_pipeline.intent_classifier import IntentClassifier
+            fallback = IntentClassifier()
+        self.fallback = fallback
+        self.threshold = threshold
+        self.model_path = model_path or os.environ.get("INTENT_MODEL_PATH")
+        self.weights = None
+        if self.model_path:
+            self.load(self.model_path)
+
+    def load(self, path):
+        try:
+            with open(os.path.join(path, "model.json")) as file:
+                meta = json.load(file)
+            self.weights = np.load(os.path.join(path, "weights.npy"), mmap_mode="r")
+            self.bias = np.load(os.path.join(path, "bias.npy"))
+        except (OSError, ValueError) as e:
+            logging.error(f"Error loading intent model from {path}: {e}")
+            self.weights = None
+            return
+        self.intents = meta["intents"]
+        self.n_features = meta["n_features"]
+        self.max_n = meta["max_n"]
+
+    def predict(self, batch):
+        """(intent, probability) from the model alone for every token list in batch."""
+        probabilities = softmax(linear_scores(hash_features(batch, self.n_features, self.max_n), self.weights, self.bias))
+        best = probabilities.argmax(axis=1)
+        return [(self.intents[column], float(probabilities[row, column])) for row, column in enumerate(best)]
+
+    def classify_batch(self, batch):
+        batch = list(batch)
+        if self.weights is None or not batch:
+            return [self.fallback.classify_intent(tokens) for tokens in batch]
+        return [
+            intent if probability >= self.threshold else self.fallback.classify_intent(tokens)
+            for tokens, (intent, probability) in zip(batch, self.predict(batch))
+        ]
+
+    def classify_intent(self, tokens):
+        return self.classify_batch([tokens])[0]
+
+
+def read_examples(path, tokenize):
+    """(tokens, intent) pairs from a JSON-lines file of {"text": ..., "intent": ...}."""
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                example = json.loads(line)
+                yield tokenize(example["text"]), example["intent"]
+
+
+if __name__ == "__main__":
+    # python -m nlp_pipeline.semantic_intent nlp_pipeline/intent_examples.jsonl intent_model/
+    from nlp_pipeline.tokenizer import Tokenizer
+    examples_path, model_path = sys.argv[1], sys.argv[2]
+    examples = list(read_examples(examples_path, Tokenizer().tokenize))
+    weights, bias, intents = train(examples)
+    save_model(model_path, weights, bias, intents)
+    print(f"Trained on {len(examples)} examples for intents {', '.join(intents)}; saved to {model_path}")
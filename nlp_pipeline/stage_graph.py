@@ -0,0 +1,152 @@
+from time import perf_counter
+
+
+class Stage:
+    """One step of a StageGraph.
+
+    function(*inputs) returns the stage's value, or a tuple of values when it
+    has several outputs. With when=(names, predicate) the stage only runs if
+    predicate(*values of names) is true; otherwise its outputs are set to
+    skipped (one value per output, None by default) and function isn't called.
+    """
+
+    __slots__ = ("name", "function", "inputs", "outputs", "when_inputs", "predicate", "skipped")
+
+    def __init__(self, name, function, inputs, outputs, when=None, skipped=None):
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.when_inputs, self.predicate = when if when is not None else ((), None)
+        self.when_inputs = tuple(self.when_inputs)
+        self.skipped = tuple(skipped) if skipped is not None else (None,) * len(self.outputs)
+        if len(self.skipped) != len(self.outputs):
+            raise ValueError(f"Stage {name}: skipped needs one value per output")
+
+    @property
+    def requires(self):
+        return self.inputs + self.when_inputs
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, {self.inputs} -> {self.outputs})"
+
+
+class StageGraph:
+    """Stages that declare the values they read and write, compiled into ExecutionPlans.
+
+    Every value is written by exactly one stage, so the graph is known before
+    anything runs: compile() keeps only the stages whose outputs are wanted,
+    directly or through other stages, and orders them so every stage runs
+    after the ones it reads from.
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f"{output!r} is written by both {self.producers[output].name} and {stage.name}")
+                self.producers[output] = stage
+
+    def compile(self, wanted, given=()):
+        """Returns the ExecutionPlan computing the wanted values from the given ones.
+
+        Stages that only feed values nobody wants are dropped, and so are
+        stages whose outputs are all given. Raises ValueError when a wanted
+        value can't be computed.
+        """
+        given = frozenset(given)
+        needed = []  # Stages in dependency order, found depth first from the wanted values
+        visiting = set()
+        done = set()
+
+        def need(name, reader):
+            if name in given:
+                return
+            stage = self.producers.get(name)
+            if stage is None:
+                raise ValueError(f"Nothing produces {name!r}, needed by {reader}")
+            if stage.name in done:
+                return
+            if stage.name in visiting:
+                raise ValueError(f"Stage {stage.name} depends on itself")
+            visiting.add(stage.name)
+            for required in stage.requires:
+                need(required, stage.name)
+            visiting.discard(stage.name)
+            done.add(stage.name)
+            needed.append(stage)
+
+        for name in wanted:
+            need(name, "the caller")
+        # Keep the declared order where dependencies allow, so plans read like the graph
+        position = {stage.name: index for index, stage in enumerate(self.stages)}
+        level = {}
+        for stage in needed:
+            level[stage.name] = 1 + max((level[self.producers[name].name] for name in stage.requires if name not in given),
+                                        default=-1)
+        ordered = sorted(needed, key=lambda stage: (level[stage.name], position[stage.name]))
+        levels = []
+        for stage in ordered:
+            if len(levels) <= level[stage.name]:
+                levels.append([])
+            levels[level[stage.name]].append(stage)
+        return ExecutionPlan(ordered, levels, tuple(wanted), given)
+
+
+class ExecutionPlan:
+    """The stages one compile() kept, in an order that respects their dependencies.
+
+    levels groups the stages by dependency depth: stages in the same level
+    don't read each other's outputs, so run() can hand them to an executor
+    to run concurrently, which pays off for models that release the GIL.
+    """
+
+    def __init__(self, stages, levels, wanted, given):
+        self.stages = stages
+        self.levels = levels
+        self.wanted = wanted
+        self.given = given
+        self.names = tuple(stage.name for stage in stages)
+
+    def __repr__(self):
+        return f"ExecutionPlan({' -> '.join(self.names)})"
+
+    def run(self, values, executor=None, timings=None):
+        """Runs the plan over the values dict, which must hold the given values, and returns it.
+
+        With timings (a dict), the seconds each stage that ran took are added under its name.
+        """
+        if executor is not None:
+            return self._run_levels(values, executor, timings)
+        for stage in self.stages:
+            _run_stage(stage, values, timings)
+        return values
+
+    def _run_levels(self, values, executor, timings):
+        for level in self.levels:
+            if len(level) == 1:
+                _run_stage(level[0], values, timings)
+                continue
+            # Stages write disjoint keys, so they can share the values dict
+            futures = [executor.submit(_run_stage, stage, values, timings) for stage in level[1:]]
+            _run_stage(level[0], values, timings)
+            for future in futures:
+                future.result()
+        return values
+
+
+def _run_stage(stage, values, timings):
+    if stage.predicate is not None and not stage.predicate(*[values[name] for name in stage.when_inputs]):
+        outputs = stage.skipped
+    else:
+        if timings is not None:
+            started = perf_counter()
+        outputs = stage.function(*[values[name] for name in stage.inputs])
+        if timings is not None:
+            timings[stage.name] = timings.get(stage.name, 0.0) + perf_counter() - started
+        if len(stage.outputs) == 1:
+            values[stage.outputs[0]] = outputs
+            return
+    values.update(zip(stage.outputs, outputs))
@@ -4,4 +4,4 @@ import sys
 print(sys.path)
 
 classifier = IntentClassifier()
-print(classifier.classify(["hello"]))
+print(classifier.classify_intent(["hello"]))
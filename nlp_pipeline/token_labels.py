@@ -0,0 +1,92 @@
+import keyword
+import re
+from functools import lru_cache
+from token import EXACT_TOKEN_TYPES
+from types import MappingProxyType
+
+# Complete string literals as produced by the code lexer, with optional r/b/f/u prefixes
+STRING_LITERAL = re.compile(r"[rRbBfFuU]{0,2}('|\")[\s\S]*\1\Z")
+SINGLE_CHAR_OPERATORS = ("+", "-", "*", "/", "=", ":", ">", "<", "(", ")", "{", "}", "[", "]", "!", "|")
+
+KEYWORDS = frozenset(keyword.kwlist)
+# Multi-character operators ("==", "**=", "->") only ever come from lexed code; single
+# characters outside SINGLE_CHAR_OPERATORS ("." "," ";") are prose punctuation and stay "unknown"
+OPERATORS = frozenset(SINGLE_CHAR_OPERATORS).union(token for token in EXACT_TOKEN_TYPES if len(token) > 1)
+POS_TAGS = MappingProxyType({
+    "hello": "INTJ",
+    "I": "PRON",
+    "am": "VERB",
+    "a": "DET",
+    "developer": "NOUN",
+})
+LABEL_CACHE_SIZE = 8192
+
+def _entity_by_rules(token):
+    if STRING_LITERAL.match(token):
+        return "string"
+    elif token.isidentifier():
+        return "identifier"
+    elif token.isnumeric():
+        return "number"
+    return "unknown"
+
+def _build_token_labels():
+    """Builds the token -> (entity label, POS tag) table for every token with a fixed label."""
+    table = {}
+    for token in OPERATORS:
+        table[token] = ("operator", POS_TAGS.get(token, "UNK"))
+    for token in KEYWORDS:  # Keywords win over operators, as in the original checks
+        table[token] = ("keyword", POS_TAGS.get(token, "UNK"))
+    for token, tag in POS_TAGS.items():
+        table.setdefault(token, (_entity_by_rules(token), tag))
+    return MappingProxyType(table)
+
+# Frozen at import time and shared by EntityRecognizer, POSTagger and TokenLabeler
+TOKEN_LABELS = _build_token_labels()
+
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def _label_by_rules(token):
+    return _entity_by_rules(token), "UNK"
+
+def label_token(token):
+    """Returns (entity label, POS tag) for a single token."""
+    return TOKEN_LABELS.get(token) or _label_by_rules(token)
+
+class TokenLabeler:
+    """POS tagging and entity recognition fused into a single pass over the tokens."""
+
+    def label(self, tokens, code_entities=None):
+        """Returns (pos_tags, entities), the same lists POSTagger.tag and EntityRecognizer.recognize_entities build.
+
+        code_entities is an optional {name: "function" | "class"} from CodeAnalyzer;
+        identifiers found in it get that label instead of "identifier".
+        """
+        lookup = TOKEN_LABELS.get
+        by_rules = _label_by_rules
+        pos_tags = []
+        entities = []
+        for token in tokens:
+            entity, tag = lookup(token) or by_rules(token)
+            if code_entities and entity == "identifier":
+                entity = code_entities.get(token, entity)
+            pos_tags.append((token, tag))
+            entities.append((token, entity))
+        return pos_tags, entities
+
+    def entities(self, tokens, code_entities=None):
+        """Just the entities half of label(), for callers that never look at POS tags."""
+        lookup = TOKEN_LABELS.get
+        by_rules = _label_by_rules
+        entities = []
+        for token in tokens:
+            entity = (lookup(token) or by_rules(token))[0]
+            if code_entities and entity == "identifier":
+                entity = code_entities.get(token, entity)
+            entities.append((token, entity))
+        return entities
+
+    def tags(self, tokens):
+        """Just the POS tags half of label()."""
+        lookup = TOKEN_LABELS.get
+        by_rules = _label_by_rules
+        return [(token, (lookup(token) or by_rules(token))[1]) for token in tokens]
@@ -1,32 +1,130 @@
+import os
 import re
 import keyword
+from itertools import filterfalse, product
+from nlp_pipeline.code_lexer import CodeLexer
+
+# Runs of ASCII word characters, or any single symbol
+TOKEN_PATTERN = re.compile(r"[a-zA-Z0-9_]+|[^\s\w]")
+
+# Basic stopwords for natural language, used unless STOPWORDS_PATH names a list
+BASIC_STOPWORDS = frozenset({"the", "is", "a", "an", "in", "on", "of", "to", "and", "for"})
+# Stopwords up to this long get every upper/lower spelling listed up front (at most 2**8 each);
+# longer ones, rare in stopword lists, are matched by lowercasing the token instead
+CASE_VARIANT_LIMIT = 8
+
+
+def load_stopwords(path, language="english"):
+    """Reads a stopword list, one word per line, like NLTK's corpora/stopwords/<language>.
+
+    path can also be the stopwords directory itself, then language picks the file.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, language)
+    with open(path, encoding="utf-8") as file:
+        return {word for word in (line.strip().lower() for line in file) if word and not word.startswith("#")}
+
+
+def default_stopwords():
+    if os.environ.get("STOPWORDS_PATH"):
+        return load_stopwords(os.environ["STOPWORDS_PATH"])
+    return set(BASIC_STOPWORDS)
+
 
 class Tokenizer:
-    def __init__(self):
-        # Basic stopwords for natural language
-        self.stopwords = {"the", "is", "a", "an", "in", "on", "of", "to", "and", "for"}
+    def __init__(self, detect_code=True, stopwords=None):
+        # Stopwords for natural language; programming keywords are kept even when listed
+        self.stopwords = set(stopwords) if stopwords is not None else default_stopwords()
         # Programming language keywords (using Python as an example)
         self.programming_keywords = set(keyword.kwlist)
-    
+        # Lexes pasted Python code with the stdlib tokenizer, so "==" or a string literal stays one token
+        self.code_lexer = CodeLexer() if detect_code else None
+        self.compile()
+
+    def compile(self):
+        """Rebuilds the dropped-token table, call it after changing stopwords or programming_keywords.
+
+        A token is dropped when token.lower() is a stopword and the token itself is
+        not a programming keyword. For stopwords of up to CASE_VARIANT_LIMIT
+        characters every spelling that satisfies that is listed up front, so
+        filtering is a single set lookup per token with no lower() copy; longer
+        ones go in long_stopwords and are checked with lower().
+        """
+        dropped = set()
+        long_stopwords = set()
+        for word in self.stopwords:
+            # Tokens are ASCII, so only lowercase ASCII stopwords can ever match
+            if word.isascii() and word == word.lower():
+                if len(word) <= CASE_VARIANT_LIMIT:
+                    dropped.update(map("".join, product(*({c, c.upper()} for c in word))))
+                else:
+                    long_stopwords.add(word)
+        self.dropped = frozenset(dropped - self.programming_keywords)
+        self.long_stopwords = frozenset(long_stopwords)
+
+    def _is_long_stopword(self, token):
+        return (len(token) > CASE_VARIANT_LIMIT and token.lower() in self.long_stopwords
+                and token not in self.programming_keywords)
+
     def tokenize(self, text):
+        """Splits text into words and symbols, leaving out natural language stopwords.
+
+        Python code found in the text is lexed as code instead, and keeps every token.
+        """
+        return self.split_code(text)[0]
+
+    def split_code(self, text):
+        """Returns (tokens, code) where code is the text of every span lexed as Python, in order."""
+        if self.code_lexer is None or not self.code_lexer.may_contain_code(text):
+            return self.tokenize_prose(text), []
+        tokens = []
+        code = []
+        for is_code, span in self.code_lexer.split_spans(text):
+            code_tokens = self.code_lexer.lex(span) if is_code else None
+            if code_tokens is not None:
+                tokens.extend(code_tokens)
+                code.append(span)
+            else:
+                tokens.extend(self.tokenize_prose(span))
+        return tokens, code
+
+    def tokenize_prose(self, text):
+        """The regex fast path: words and single symbols, stopwords dropped."""
+        # findall, the stopword filter and list() all run in C, one pass over the tokens
+        tokens = list(filterfalse(self.dropped.__contains__, TOKEN_PATTERN.findall(text)))
+        if self.long_stopwords:
+            tokens = list(filterfalse(self._is_long_stopword, tokens))
+        return tokens
+
+    def iter_tokens(self, text, offsets=False):
+        """Lazily yields the same tokens as tokenize_prose(), or their (start, end) spans when offsets is True.
+
+        Unlike tokenize() there is no code detection: pasted code is split like prose.
+        """
+        dropped = self.dropped
+        is_long_stopword = self._is_long_stopword if self.long_stopwords else None
+        for match in TOKEN_PATTERN.finditer(text):
+            token = match.group()
+            if token not in dropped and not (is_long_stopword and is_long_stopword(token)):
+                yield match.span() if offsets else token
+
+    def iter_file_tokens(self, file, offsets=False):
+        """Yields tokens from a text file object line by line, without reading it all into memory.
 
-        # Split text into words and symbols
-        tokens = re.findall(r"[a-zA-Z0-9_]+|[^\s\w]", text)
-        
-        processed_tokens = []
-
-        for token in tokens:
-            # Preserve programming keywords
-            if token in self.programming_keywords:
-                processed_tokens.append(token)
-            # Exclude natural language stopwords for non-code tokens
-            elif token.lower() not in self.stopwords:
-                processed_tokens.append(token)
-        
-        return processed_tokens
+        Tokens never span a line break, so each line is tokenized on its own. With
+        offsets, spans are character positions from the start of the file.
+        """
+        position = 0
+        for line in file:
+            if offsets:
+                for start, end in self.iter_tokens(line, offsets=True):
+                    yield position + start, position + end
+            else:
+                yield from self.iter_tokens(line)
+            position += len(line)
 
 # if __name__ == "__main__":
     # tokenizer = Tokenizer()
     # sample_input = "The loop is written as: for i in range(10): print(i)"
     # tokens = tokenizer.tokenize(sample_input)
-    # print(tokens)
\ No newline at end of file
+    # print(tokens)
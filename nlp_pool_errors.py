@@ -0,0 +1,5 @@
+# Kept apart from nlp_worker_pool so bots can catch pool failures without importing the pool
+
+
+class NLPPoolError(Exception):
+    """The worker pool couldn't answer: it is unreachable, timed out or failed the batch."""
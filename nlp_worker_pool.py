@@ -0,0 +1,334 @@
+"""A pool of long-lived NLP worker processes that bot processes share over a Unix socket.
+
+The pool loads one NLPPipeline, with every stage built, then forks its
+workers from it, so the loaded stages are shared copy-on-write instead of
+each bot process holding its own copy. gc.freeze() before the fork keeps
+the garbage collector from touching (and so copying) those objects. The
+large read-only tables are already file-backed: the doc index and the
+semantic intent weights are memory-mapped, so every process on the
+machine reads the same page-cache pages.
+
+Protocol: one JSON object per line in each direction.
+  request:  {"id": 7, "items": [{"input": "hi"}, {"input": "what about it?", "dialogue": {...}}]}
+  reply:    {"id": 7, "results": [["Hello!...", "greet"], ["...", "unknown", {"entity": ..., "entities": ..., "topic": ...}]]}
+            {"id": 7, "error": "..."} when the request itself was malformed
+  An item that failed has {"error": "..."} in place of its result.
+An item with "dialogue" (a DialogueState.to_dict()) is run with process_turn().
+
+  python nlp_worker_pool.py --socket /tmp/codebot-nlp.sock --workers 4
+  NLP_POOL_SOCKET=/tmp/codebot-nlp.sock python code_bot.py
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from nlp_pool_errors import NLPPoolError
+
+MAX_LINE = 1 << 24  # Longest request or reply line, in bytes
+
+
+def handle_request(pipeline, request):
+    """The reply to one request, computed with pipeline; an item that fails gets an error of its own."""
+    items = request["items"]
+    results = [None] * len(items)
+    # Stateless inputs take the batch path together; turns need their own state each
+    plain = [(position, item) for position, item in enumerate(items) if "dialogue" not in item]
+    if plain:
+        try:
+            answers = [list(answer) for answer in pipeline.process_batch([item["input"] for _, item in plain],
+                                                                         chunk_size=len(plain))]
+        except Exception:
+            # One bad input fails the whole batch call; answer them one by one to find it
+            answers = [_answer(pipeline, item) for _, item in plain]
+        for (position, _), answer in zip(plain, answers):
+            results[position] = answer
+    for position, item in enumerate(items):
+        if "dialogue" in item:
+            results[position] = _answer(pipeline, item)
+    return {"id": request.get("id"), "results": results}
+
+
+def _answer(pipeline, item):
+    from nlp_pipeline.dialogue_state import DialogueState
+    try:
+        if "dialogue" not in item:
+            return list(pipeline.process_input(item["input"]))
+        dialogue = DialogueState()
+        dialogue.restore(item["dialogue"])
+        return list(pipeline.process_turn(item["input"], dialogue))
+    except Exception as e:
+        logging.error(f"NLP worker {os.getpid()} failed an input: {e}")
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+async def _serve_connection(pipeline, reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            request = None
+            try:
+                request = json.loads(line)
+                reply = handle_request(pipeline, request)
+            except Exception as e:
+                logging.error(f"NLP worker {os.getpid()} failed a request: {e}")
+                reply = {"id": request.get("id") if isinstance(request, dict) else None, "error": str(e)}
+            writer.write(json.dumps(reply).encode() + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def _worker_main(listener, pipeline):
+    # The parent stops the workers; Ctrl+C in a terminal reaches the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    async def serve():
+        # Every worker accepts on the same listening socket and the kernel spreads connections
+        server = await asyncio.start_unix_server(lambda reader, writer: _serve_connection(pipeline, reader, writer),
+                                                 sock=listener, limit=MAX_LINE)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+class NLPWorkerPool:
+    """Forks worker processes that serve one preloaded pipeline on a Unix socket.
+
+    pipeline_factory builds the pipeline once, in this process, before any
+    worker starts. Use start() and stop(), or the pool as a context manager;
+    check() replaces workers that died.
+    """
+
+    def __init__(self, socket_path, workers=2, pipeline_factory=None):
+        self.socket_path = socket_path
+        self.workers = workers
+        self.pipeline_factory = pipeline_factory
+        self.pipeline = None
+        self.listener = None
+        self.processes = []
+        self.context = multiprocessing.get_context("fork")  # Workers inherit the loaded pipeline, nothing is pickled
+
+    def start(self):
+        if self.pipeline_factory is None:
+            from nlp_pipeline.nlp_pipeline import NLPPipeline
+            self.pipeline = NLPPipeline().preload()
+        else:
+            self.pipeline = self.pipeline_factory()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # Left over from a pool that didn't shut down
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socket_path)
+        self.listener.listen(128)
+        gc.collect()
+        gc.freeze()  # Everything loaded so far stays out of the workers' collections, so its pages stay shared
+        self.processes = [self._spawn() for _ in range(self.workers)]
+        logging.info(f"NLP worker pool serving {self.socket_path} with {self.workers} workers.")
+        return self
+
+    def _spawn(self):
+        process = self.context.Process(target=_worker_main, args=(self.listener, self.pipeline),
+                                       name="nlp-worker", daemon=True)
+        process.start()
+        return process
+
+    def check(self):
+        """Replaces dead workers; returns how many were replaced."""
+        replaced = 0
+        for index, process in enumerate(self.processes):
+            if not process.is_alive():
+                logging.error(f"NLP worker {process.pid} exited with {process.exitcode}, starting a new one.")
+                process.join()
+                self.processes[index] = self._spawn()
+                replaced += 1
+        return replaced
+
+    def serve_forever(self, check_interval=1.0):
+        while True:
+            time.sleep(check_interval)
+            self.check()
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        self.processes = []
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        gc.unfreeze()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class NLPClient:
+    """Thin stand-in for NLPPipeline that sends work to an NLPWorkerPool.
+
+    process_input() and process_turn() calls from any number of threads are
+    batched: a sender thread sends everything that queued up while its last
+    request was out, up to batch_size items, as one request; batch_window
+    makes it also wait that many seconds for more. A call raises
+    NLPPoolError when the pool can't be reached or hasn't answered within
+    timeout seconds; the connection is dropped then, so a late reply can't
+    be mistaken for the next one, and reopened for the next batch.
+    """
+
+    def __init__(self, socket_path, timeout=5.0, batch_size=32, batch_window=0.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.pending = queue.Queue()  # (item, Future)
+        self.lock = threading.Lock()  # One request at a time on the connection
+        self.sender_lock = threading.Lock()
+        self.sender = None
+        self.connection = None
+        self.reader = None
+        self.next_id = 0
+
+    def process_input(self, user_input):
+        return tuple(self._call({"input": user_input}))
+
+    def process_turn(self, user_input, dialogue):
+        response, intent, turn = self._call({"input": user_input, "dialogue": dialogue.to_dict()})
+        turn["entities"] = [tuple(entity) for entity in turn["entities"]]
+        return response, intent, turn
+
+    def process_batch(self, user_inputs, chunk_size=256, workers=0):
+        """Like NLPPipeline.process_batch: chunks go out as one request each, in order."""
+        from nlp_pipeline.nlp_pipeline import _chunked
+        for chunk in _chunked(user_inputs, chunk_size):
+            for result in self._send([{"input": text} for text in chunk]):
+                yield tuple(_checked(result))
+
+    def _call(self, item):
+        future = Future()
+        with self.sender_lock:
+            if self.sender is None:
+                self.sender = threading.Thread(target=self._run_sender, name="nlp-client", daemon=True)
+                self.sender.start()
+        self.pending.put((item, future))
+        try:
+            return future.result(self.timeout * 2)  # The sender times out first; this only guards against a stuck sender
+        except FutureTimeout:
+            raise NLPPoolError(f"No reply from the NLP pool at {self.socket_path}") from None
+
+    def _run_sender(self):
+        while True:
+            batch = [self.pending.get()]
+            # Calls made while the last request was out are already waiting: a busy
+            # client sends big batches and a quiet one waits for nothing
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_size:
+                try:
+                    remaining = deadline - time.monotonic()
+                    batch.append(self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                results = self._send([item for item, _ in batch])
+            except NLPPoolError as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                try:
+                    future.set_result(_checked(result))
+                except NLPPoolError as e:
+                    future.set_exception(e)
+
+    def _send(self, items):
+        with self.lock:
+            self.next_id += 1
+            request = json.dumps({"id": self.next_id, "items": items}).encode() + b"\n"
+            reused = self.connection is not None
+            try:
+                try:
+                    reply = self._exchange(request)
+                except ConnectionError:
+                    if not reused:
+                        raise
+                    # The worker behind an idle connection may have been replaced since;
+                    # the pipeline has no side effects, so asking again is safe
+                    self._disconnect()
+                    reply = self._exchange(request)
+            except (OSError, ValueError) as e:  # socket.timeout is an OSError
+                self._disconnect()
+                raise NLPPoolError(f"NLP pool at {self.socket_path}: {type(e).__name__}: {e}") from e
+            if reply.get("id") != self.next_id:
+                self._disconnect()
+                raise NLPPoolError(f"NLP pool replied to request {reply.get('id')}, expected {self.next_id}")
+        if "error" in reply:
+            raise NLPPoolError(f"NLP pool failed the batch: {reply['error']}")
+        return reply["results"]
+
+    def _exchange(self, request):
+        if self.connection is None:
+            self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.connection.settimeout(self.timeout)
+            self.connection.connect(self.socket_path)
+            self.reader = self.connection.makefile("rb")
+        self.connection.sendall(request)
+        line = self.reader.readline(MAX_LINE)
+        if not line:
+            raise ConnectionResetError("the pool closed the connection")
+        return json.loads(line)
+
+    def _disconnect(self):
+        if self.connection is not None:
+            self.reader.close()
+            self.connection.close()
+            self.connection = self.reader = None
+
+    def close(self):
+        with self.lock:
+            self._disconnect()
+
+
+def _checked(result):
+    """An item's result from a reply, or NLPPoolError if the pool failed that item."""
+    if isinstance(result, dict):
+        raise NLPPoolError(f"NLP pool failed the input: {result['error']}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve one shared NLP pipeline to local bot processes.")
+    parser.add_argument("--socket", default="/tmp/codebot-nlp.sock", help="Unix socket path to listen on")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--cache-size", type=int, default=0, help="Cache results for this many distinct utterances")
+    args = parser.parse_args()
+
+    from context_manager import configure_logging
+    from nlp_pipeline.nlp_pipeline import NLPPipeline
+    configure_logging()
+    pool = NLPWorkerPool(args.socket, args.workers, lambda: NLPPipeline(cache_size=args.cache_size).preload())
+    pool.start()
+    try:
+        pool.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Stopping the NLP worker pool.")
+    finally:
+        pool.stop()
@@ -0,0 +1,145 @@
+# On-disk store for crawled documentation sections.
+#
+# A single SQLite file holds the pages that were crawled (with the content
+# hash and HTTP validators used to skip unchanged pages on re-crawls), the
+# sections extracted from them, and an inverted index from term to the
+# sections it appears in. Index tables are WITHOUT ROWID so each posting
+# costs only its primary key.
+
+import json
+import re
+import sqlite3
+import time
+from collections import Counter
+
+TERM_PATTERN = re.compile(r"[a-z0-9_]+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    title TEXT,
+    content_hash TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    links TEXT,
+    crawled_at REAL
+);
+CREATE TABLE IF NOT EXISTS sections (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    anchor TEXT NOT NULL,
+    title TEXT,
+    text TEXT,
+    length INTEGER,
+    UNIQUE (url, anchor)
+);
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT PRIMARY KEY,
+    id INTEGER NOT NULL UNIQUE
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (
+    term_id INTEGER NOT NULL,
+    section_id INTEGER NOT NULL,
+    frequency INTEGER NOT NULL,
+    PRIMARY KEY (term_id, section_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_by_section ON postings (section_id);
+"""
+
+
+def index_terms(text):
+    """Lowercased word terms used for the inverted index."""
+    return TERM_PATTERN.findall(text.lower())
+
+
+class DocsStore:
+    def __init__(self, path, batch_size=200):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        # WAL lets the spider read page state while the pipeline is mid-transaction
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self.batch_size = batch_size  # Pages written per transaction
+        self.pending = 0
+        self.term_ids = dict(self.connection.execute("SELECT term, id FROM terms"))
+
+    def page_state(self, url):
+        """Returns {"content_hash", "etag", "last_modified", "links"} for a crawled page, or None."""
+        row = self.connection.execute(
+            "SELECT content_hash, etag, last_modified, links FROM pages WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"content_hash": row[0], "etag": row[1], "last_modified": row[2], "links": json.loads(row[3] or "[]")}
+
+    def is_unchanged(self, url, content_hash):
+        state = self.page_state(url)
+        return state is not None and state["content_hash"] == content_hash
+
+    def _term_id(self, term):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = len(self.term_ids) + 1
+            self.term_ids[term] = term_id
+            self.connection.execute("INSERT INTO terms (term, id) VALUES (?, ?)", (term, term_id))
+        return term_id
+
+    def replace_page(self, url, title, content_hash, sections, etag=None, last_modified=None, links=()):
+        """Stores a page's sections and postings, replacing whatever an earlier crawl stored for it."""
+        execute = self.connection.execute
+        old_ids = [row[0] for row in execute("SELECT id FROM sections WHERE url = ?", (url,))]
+        if old_ids:
+            marks = ",".join("?" * len(old_ids))
+            execute(f"DELETE FROM postings WHERE section_id IN ({marks})", old_ids)
+            execute(f"DELETE FROM sections WHERE id IN ({marks})", old_ids)
+        anchors = set()
+        for section in sections:
+            if section["anchor"] in anchors:
+                continue  # Keep the first of any repeated id
+            anchors.add(section["anchor"])
+            terms = index_terms(f"{section['title']} {section['text']}")
+            cursor = execute(
+                "INSERT INTO sections (url, anchor, title, text, length) VALUES (?, ?, ?, ?, ?)",
+                (url, section["anchor"], section["title"], section["text"], len(terms)),
+            )
+            section_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO postings (term_id, section_id, frequency) VALUES (?, ?, ?)",
+                [(self._term_id(term), section_id, count) for term, count in Counter(terms).items()],
+            )
+        execute(
+            "INSERT OR REPLACE INTO pages (url, title, content_hash, etag, last_modified, links, crawled_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, title, content_hash, etag, last_modified, json.dumps(list(links)), time.time()),
+        )
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.commit()
+
+    def search(self, text, limit=10):
+        """Simple term-frequency lookup over the inverted index, mainly for checking a crawl."""
+        term_ids = [self.term_ids[term] for term in set(index_terms(text)) if term in self.term_ids]
+        if not term_ids:
+            return []
+        marks = ",".join("?" * len(term_ids))
+        return self.connection.execute(
+            f"SELECT s.url, s.anchor, s.title, SUM(p.frequency) AS score FROM postings p "
+            f"JOIN sections s ON s.id = p.section_id WHERE p.term_id IN ({marks}) "
+            f"GROUP BY s.id ORDER BY score DESC, s.id LIMIT ?",
+            (*term_ids, limit),
+        ).fetchall()
+
+    def iter_sections(self):
+        """Yields (id, url, anchor, title, text) for every stored section, in id order."""
+        yield from self.connection.execute("SELECT id, url, anchor, title, text FROM sections ORDER BY id")
+
+    def count_sections(self):
+        return self.connection.execute("SELECT COUNT(*) FROM sections").fetchone()[0]
+
+    def commit(self):
+        self.connection.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
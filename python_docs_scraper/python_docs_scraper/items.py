@@ -7,6 +7,13 @@ import scrapy
 
 
 class PythonDocsScraperItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # One crawled documentation page. The spider fills in the raw page;
+    # SectionNormalizerPipeline splits it into normalized sections.
+    url = scrapy.Field()
+    body = scrapy.Field()  # decoded HTML, dropped once sections are extracted
+    content_hash = scrapy.Field()
+    etag = scrapy.Field()
+    last_modified = scrapy.Field()
+    links = scrapy.Field()  # documentation pages this page links to
+    title = scrapy.Field()
+    sections = scrapy.Field()  # [{"anchor", "title", "text"}, ...]
@@ -7,7 +7,54 @@
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+from python_docs_scraper.docs_store import DocsStore
+from python_docs_scraper.sections import extract_sections
+
 
 class PythonDocsScraperPipeline:
     def process_item(self, item, spider):
         return item
+
+
+class SectionNormalizerPipeline:
+    """Splits each crawled page into normalized sections."""
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        title, sections = extract_sections(adapter["body"])
+        adapter["title"] = title
+        adapter["sections"] = sections
+        adapter["body"] = None  # The raw HTML isn't needed past this point
+        return item
+
+
+class DocsStorePipeline:
+    """Streams normalized pages into the on-disk DocsStore (DOCS_STORE_PATH)."""
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.store = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get("DOCS_STORE_PATH"))
+
+    def open_spider(self, spider):
+        self.store = DocsStore(self.store_path)
+
+    def close_spider(self, spider):
+        self.store.close()
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        self.store.replace_page(
+            adapter["url"],
+            adapter["title"],
+            adapter["content_hash"],
+            adapter["sections"],
+            etag=adapter.get("etag"),
+            last_modified=adapter.get("last_modified"),
+            links=adapter.get("links") or (),
+        )
+        spider.logger.debug(f"Stored {len(adapter['sections'])} sections from {adapter['url']}")
+        return item
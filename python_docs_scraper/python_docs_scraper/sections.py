@@ -0,0 +1,101 @@
+# Splits a Sphinx-generated Python docs page into its sections.
+#
+# Uses the stdlib HTML parser so the normalization step can run (and be
+# tested) without a crawler around it.
+
+import re
+from html.parser import HTMLParser
+
+HEADINGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+SKIPPED_TAGS = {"script", "style"}
+# Tags that break words apart even when the HTML has no whitespace between them
+BLOCK_TAGS = {"p", "br", "li", "dt", "dd", "pre", "div", "section", "tr", "td", "th", "table", "ul", "ol", "dl"}
+# Sphinx page chrome that isn't part of the documentation text
+SKIPPED_CLASSES = {"sphinxsidebar", "related", "footer", "headerlink", "navigation", "mobile-nav"}
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Collapses whitespace and drops Sphinx's pilcrow permalinks."""
+    return WHITESPACE.sub(" ", text.replace("¶", "")).strip()
+
+
+class SectionParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.page_title = []
+        self.in_title = False
+        self.containers = []  # open div/section tags: (is_section, is_skipped)
+        self.open_sections = []  # sections still open, innermost last
+        self.sections = []  # every section in document order
+        self.skip_depth = 0  # > 0 while inside script/style or skipped chrome
+        self.heading_for = None  # section whose heading is being read
+        self.in_skipped_link = False  # inside a permalink such as <a class="headerlink">
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BLOCK_TAGS and self.open_sections:
+            self.open_sections[-1]["text"].append(" ")
+        attrs = dict(attrs)
+        classes = set((attrs.get("class") or "").split())
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag == "title":
+            self.in_title = True
+        elif tag in ("div", "section"):
+            is_section = attrs.get("id") and (tag == "section" or "section" in classes)
+            is_skipped = bool(classes & SKIPPED_CLASSES) or attrs.get("role") == "navigation"
+            self.containers.append((bool(is_section), is_skipped))
+            if is_skipped:
+                self.skip_depth += 1
+            elif is_section:
+                section = {"anchor": attrs["id"], "title": [], "text": []}
+                self.sections.append(section)
+                self.open_sections.append(section)
+        elif tag == "a" and classes & SKIPPED_CLASSES:
+            self.in_skipped_link = True
+        elif tag in HEADINGS and self.open_sections and not self.open_sections[-1]["title"]:
+            self.heading_for = self.open_sections[-1]
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == "title":
+            self.in_title = False
+        elif tag in ("div", "section") and self.containers:
+            is_section, is_skipped = self.containers.pop()
+            if is_skipped:
+                self.skip_depth = max(0, self.skip_depth - 1)
+            elif is_section and self.open_sections:
+                self.open_sections.pop()
+        elif tag == "a":
+            self.in_skipped_link = False
+        elif tag in HEADINGS:
+            self.heading_for = None
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.page_title.append(data)
+        if self.skip_depth or self.in_skipped_link or not self.open_sections:
+            return
+        if self.heading_for is not None:
+            self.heading_for["title"].append(data)
+        else:
+            self.open_sections[-1]["text"].append(data)
+
+
+def extract_sections(html):
+    """Returns (page title, sections) where each section is {"anchor", "title", "text"}.
+
+    Text belongs to the innermost section it appears in, so nested sections
+    don't repeat their children's text. Sections without any text are dropped.
+    """
+    parser = SectionParser()
+    parser.feed(html)
+    parser.close()
+    sections = []
+    for section in parser.sections:
+        title = normalize_text("".join(section["title"]))
+        text = normalize_text("".join(section["text"]))
+        if title or text:
+            sections.append({"anchor": section["anchor"], "title": title, "text": text})
+    return normalize_text("".join(parser.page_title)), sections
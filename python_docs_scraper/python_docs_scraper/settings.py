@@ -62,9 +62,14 @@ ROBOTSTXT_OBEY = True
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "python_docs_scraper.pipelines.PythonDocsScraperPipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "python_docs_scraper.pipelines.SectionNormalizerPipeline": 300,
+    "python_docs_scraper.pipelines.DocsStorePipeline": 400,
+}
+
+# SQLite file that DocsStorePipeline writes sections and the inverted index to.
+# Re-crawls read it back to skip pages whose ETag or content hash is unchanged.
+DOCS_STORE_PATH = "python_docs.sqlite3"
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
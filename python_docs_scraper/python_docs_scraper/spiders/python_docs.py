@@ -0,0 +1,96 @@
+import hashlib
+from urllib.parse import urldefrag
+
+import scrapy
+
+from python_docs_scraper.docs_store import DocsStore
+from python_docs_scraper.items import PythonDocsScraperItem
+
+
+class PythonDocsSpider(scrapy.Spider):
+    """Crawls a local mirror of the Python HTML docs.
+
+    Usage:
+        scrapy crawl python_docs -a docs_root=file:///path/to/python-docs/html/
+        scrapy crawl python_docs -a docs_root=http://localhost:8000/
+
+    Only pages under docs_root are followed. On a re-crawl, pages are requested
+    with the ETag/Last-Modified validators stored last time; a 304, or a body
+    whose hash hasn't changed, is not re-indexed, but the page's links are
+    still followed so changed pages further down are found.
+    """
+
+    name = "python_docs"
+    handle_httpstatus_list = [304]
+
+    def __init__(self, docs_root=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not docs_root:
+            raise ValueError("Pass the docs mirror with -a docs_root=file:///... or http://...")
+        self.docs_root = docs_root if docs_root.endswith("/") else docs_root + "/"
+        self.store = None
+
+    async def start(self):
+        # Scrapy >= 2.13 entry point; older versions call start_requests() directly
+        for request in self.start_requests():
+            yield request
+
+    def start_requests(self):
+        # A read-only view of the store the pipeline writes to, for change detection
+        self.store = DocsStore(self.settings.get("DOCS_STORE_PATH"))
+        yield self.page_request(self.docs_root + "index.html")
+
+    def closed(self, reason):
+        if self.store is not None:
+            self.store.close()
+
+    def page_request(self, url):
+        headers = {}
+        state = self.store.page_state(url)
+        if state is not None:
+            if state["etag"]:
+                headers["If-None-Match"] = state["etag"]
+            if state["last_modified"]:
+                headers["If-Modified-Since"] = state["last_modified"]
+        return scrapy.Request(url, headers=headers, callback=self.parse, cb_kwargs={"state": state})
+
+    def follow_links(self, links):
+        for url in links:
+            yield self.page_request(url)
+
+    def parse(self, response, state=None):
+        if response.status == 304 and state is not None:
+            self.logger.debug(f"Not modified: {response.url}")
+            yield from self.follow_links(state["links"])
+            return
+
+        content_hash = hashlib.sha256(response.body).hexdigest()
+        links = self.doc_links(response)
+        if state is not None and state["content_hash"] == content_hash:
+            self.logger.debug(f"Unchanged: {response.url}")
+        else:
+            yield PythonDocsScraperItem(
+                url=response.url,
+                body=response.text,
+                content_hash=content_hash,
+                etag=self.header(response, b"ETag"),
+                last_modified=self.header(response, b"Last-Modified"),
+                links=links,
+            )
+        yield from self.follow_links(links)
+
+    def doc_links(self, response):
+        """Absolute, fragment-free links to other HTML pages under docs_root."""
+        links = []
+        seen = set()
+        for href in response.css("a::attr(href)").getall():
+            url = urldefrag(response.urljoin(href))[0]
+            if url.startswith(self.docs_root) and url.endswith(".html") and url not in seen:
+                seen.add(url)
+                links.append(url)
+        return links
+
+    @staticmethod
+    def header(response, name):
+        value = response.headers.get(name)
+        return value.decode("latin-1") if value else None
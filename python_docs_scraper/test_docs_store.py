@@ -0,0 +1,122 @@
+import functools
+import http.server
+import importlib.util
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from python_docs_scraper.docs_store import DocsStore
+from python_docs_scraper.sections import extract_sections
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+INDEX_PAGE = """<html><head><title>Python docs</title></head><body>
+<div class="related" role="navigation"><a href="library/json.html">json</a></div>
+<section id="welcome"><h1>Welcome<a class="headerlink" href="#welcome">¶</a></h1>
+<p>Start with the <a href="library/json.html#basic-usage">json module</a>.</p></section>
+</body></html>"""
+
+JSON_PAGE = """<html><head><title>json — JSON encoder and decoder</title></head><body>
+<div class="section" id="module-json"><h1>json — JSON encoder and decoder<a class="headerlink">¶</a></h1>
+<p>Encode   Python objects as JSON.</p>
+<div class="section" id="basic-usage"><h2>Basic Usage</h2><p>json.dumps(obj) serializes obj.</p></div>
+</div><div class="footer">Copyright</div></body></html>"""
+
+
+class TestSections(unittest.TestCase):
+
+    def test_nested_sections_keep_their_own_text(self):
+        title, sections = extract_sections(JSON_PAGE)
+        self.assertEqual(title, "json — JSON encoder and decoder")
+        self.assertEqual(sections, [
+            {"anchor": "module-json", "title": "json — JSON encoder and decoder", "text": "Encode Python objects as JSON."},
+            {"anchor": "basic-usage", "title": "Basic Usage", "text": "json.dumps(obj) serializes obj."},
+        ])
+
+    def test_navigation_is_skipped(self):
+        _, sections = extract_sections(INDEX_PAGE)
+        self.assertEqual(sections, [{"anchor": "welcome", "title": "Welcome", "text": "Start with the json module."}])
+
+
+class TestDocsStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = DocsStore(os.path.join(self.temp_dir.name, "docs.sqlite3"))
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def test_replace_page_updates_index(self):
+        _, sections = extract_sections(JSON_PAGE)
+        self.store.replace_page("file:///json.html", "json", "hash1", sections, links=["file:///index.html"])
+        self.assertEqual(self.store.search("dumps")[0][:2], ("file:///json.html", "basic-usage"))
+        self.assertTrue(self.store.is_unchanged("file:///json.html", "hash1"))
+        self.assertEqual(self.store.page_state("file:///json.html")["links"], ["file:///index.html"])
+
+        # A re-crawl of a changed page replaces its sections and postings
+        changed = [{"anchor": "module-json", "title": "json", "text": "loads parses JSON."}]
+        self.store.replace_page("file:///json.html", "json", "hash2", changed)
+        self.assertEqual(self.store.search("dumps"), [])
+        self.assertEqual(self.store.search("loads")[0][1], "module-json")
+        self.assertEqual(self.store.count_sections(), 1)
+        self.assertFalse(self.store.is_unchanged("file:///json.html", "hash1"))
+
+
+@unittest.skipUnless(importlib.util.find_spec("scrapy"), "scrapy is not installed")
+class TestCrawl(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.docs_dir = os.path.join(self.temp_dir.name, "html")
+        os.makedirs(os.path.join(self.docs_dir, "library"))
+        with open(os.path.join(self.docs_dir, "index.html"), "w") as file:
+            file.write(INDEX_PAGE)
+        with open(os.path.join(self.docs_dir, "library", "json.html"), "w") as file:
+            file.write(JSON_PAGE)
+        self.store_path = os.path.join(self.temp_dir.name, "docs.sqlite3")
+        handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=self.docs_dir)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def crawl(self, docs_root):
+        subprocess.run(
+            [sys.executable, "-m", "scrapy", "crawl", "python_docs", "-a", f"docs_root={docs_root}",
+             "-s", f"DOCS_STORE_PATH={self.store_path}", "-s", "LOG_LEVEL=WARNING"],
+            cwd=PROJECT_DIR, check=True,
+        )
+        connection = sqlite3.connect(self.store_path)
+        try:
+            return dict(connection.execute("SELECT url, crawled_at FROM pages")), connection.execute(
+                "SELECT anchor FROM sections ORDER BY anchor").fetchall()
+        finally:
+            connection.close()
+
+    def test_http_crawl_and_incremental_recrawl(self):
+        root = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        pages, anchors = self.crawl(root)
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(anchors, [("basic-usage",), ("module-json",), ("welcome",)])
+
+        # Nothing changed: both pages come back 304 and keep their stored rows
+        pages_again, _ = self.crawl(root)
+        self.assertEqual(pages_again, pages)
+
+    def test_file_crawl(self):
+        pages, anchors = self.crawl("file://" + self.docs_dir)
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(len(anchors), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,211 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+from urllib.parse import quote, unquote
+
+from history_log import HistoryLog
+
+# The files one session can have, by kind
+FILE_NAMES = {
+    "context": "session_context_{}.json",  # Encrypted snapshot
+    "history": "session_history_{}.log",  # Turns spilled out of memory by TurnHistory
+    "log": "session_context_{}.log",  # Update log, with ContextManager(append_log=True)
+}
+_NAME_PARTS = [tuple(name.split("{}")) for name in FILE_NAMES.values()]
+
+
+class SessionDirectory:
+    """Decides where each session's files live.
+
+    With root=None, files go in the working directory under their historical
+    names. With a root, they are sharded by a hash of the user id into
+    shard_depth levels of 256 subdirectories (root/3f/a2/ by default), so no
+    directory grows past a few files per 65536 users and finding a session
+    is a path computation plus one lookup in a small directory. User ids are
+    percent-encoded in sharded file names, so any id makes a safe name.
+    """
+
+    def __init__(self, root=None, shard_depth=2):
+        self.root = root
+        self.shard_depth = shard_depth
+
+    @property
+    def sharded(self):
+        return self.root is not None
+
+    def directory(self, user_id):
+        if not self.sharded:
+            return ""
+        digest = hashlib.blake2b(str(user_id).encode(), digest_size=8).hexdigest()
+        return os.path.join(self.root, *(digest[2 * level:2 * level + 2] for level in range(self.shard_depth)))
+
+    def path(self, user_id, kind="context"):
+        name = quote(str(user_id), safe="") if self.sharded else user_id
+        return os.path.join(self.directory(user_id), FILE_NAMES[kind].format(name))
+
+    def prepare(self, user_id):
+        """Creates the user's shard directory, before anything is written there."""
+        if self.sharded:
+            os.makedirs(self.directory(user_id), exist_ok=True)
+
+    def user_ids(self):
+        """Lazily yields the id of every session with any file on disk, one directory at a time.
+
+        A session saved with append_log may have only its update log until
+        the first compaction, so every kind in FILE_NAMES counts.
+        """
+        if not self.sharded:
+            yield from _session_files(".", unquote_names=False)
+            return
+        if os.path.isdir(self.root):
+            yield from self._walk(self.root, self.shard_depth)
+
+    def _walk(self, directory, depth):
+        if depth == 0:
+            yield from _session_files(directory, unquote_names=True)
+            return
+        with os.scandir(directory) as entries:
+            shards = sorted(entry.path for entry in entries if entry.is_dir() and len(entry.name) == 2)
+        for shard in shards:
+            yield from self._walk(shard, depth - 1)
+
+
+def _session_files(directory, unquote_names):
+    names = set()
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            for prefix, suffix in _NAME_PARTS:
+                if entry.name.startswith(prefix) and entry.name.endswith(suffix):
+                    names.add(entry.name[len(prefix):-len(suffix)])
+    # Sorted by context file name, the order key_rotation checkpoints in
+    for name in sorted(names, key=FILE_NAMES["context"].format):
+        yield unquote(name) if unquote_names else name
+
+
+def _read_session(storage, user_id, cipher, codec):
+    """Decodes one session's files into an in-memory ContextManager, without writing to any of them.
+
+    load_context() trims the spill file back to what the snapshot covers,
+    which would cut turns off a session a live process is still spilling
+    to; here the spilled turns the snapshot counts are read as they are and
+    the rest of the file is left alone. Raises if the snapshot can't be read.
+    """
+    from context_manager import ContextManager
+    context_manager = ContextManager(user_id, cipher=cipher, codec=codec, storage=storage, install_signal_handlers=False,
+                                     history_window=None, append_log=os.path.exists(storage.path(user_id, "log")))
+    context = {}
+    if os.path.exists(storage.path(user_id)):
+        with open(storage.path(user_id), "rb") as file:
+            context = context_manager.codec.decode(file.read(), cipher)
+    spilled = context.pop("history_spilled", 0)
+    context.pop("history_spill_size", None)
+    if spilled:
+        turns = []
+        for block in HistoryLog(storage.path(user_id, "history"), cipher).replay():
+            turns.extend(block["turns"])
+            if len(turns) >= spilled:
+                break
+        for input, response in turns[:spilled]:
+            context_manager.history.append(input, response)
+    context_manager.history.extend_dicts(context.pop("history", None) or [])
+    context_manager.dialogue.restore(context.pop("dialogue", None), len(context_manager.history))
+    context_manager.log_seq = context.pop("log_seq", 0)
+    context_manager.context.update(context)
+    if context_manager.history_log:
+        context_manager.replay_history_log()
+        context_manager.history_log.close()
+    return context_manager
+
+
+def export_sessions(storage, output, cipher, codec=None):
+    """Streams every session to output as JSON lines of {"user_id", "context"}, history included.
+
+    Sessions are decrypted and written one at a time, so memory holds a
+    single session whatever the number of users, and no session file is
+    modified, so exporting is safe while the bot is running. The output is
+    plaintext. Returns (sessions exported, sessions that failed to load).
+    """
+    exported = failed = 0
+    for user_id in storage.user_ids():
+        try:
+            context_manager = _read_session(storage, user_id, cipher, codec)
+        except Exception as e:
+            logging.error(f"Could not read session {user_id}: {type(e).__name__} {e}")
+            failed += 1
+            continue
+        context = dict(context_manager.context, history=[turn.as_dict() for turn in context_manager.history],
+                       dialogue=context_manager.dialogue.to_dict())
+        output.write(json.dumps({"user_id": user_id, "context": context}) + "\n")
+        exported += 1
+    return exported, failed
+
+
+def import_sessions(storage, lines, cipher, codec=None):
+    """Writes one session per JSON line from export_sessions(), replacing any saved one; returns the count."""
+    from context_manager import ContextManager
+    imported = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        context = record["context"]
+        context_manager = ContextManager(record["user_id"], cipher=cipher, codec=codec, storage=storage,
+                                         install_signal_handlers=False)
+        try:
+            stale_log = storage.path(record["user_id"], "log")
+            if os.path.exists(stale_log):
+                os.remove(stale_log)  # Its records belong to the session being replaced
+            context_manager.history.clear()
+            context_manager.history.extend_dicts(context.get("history") or [])
+            context_manager.dialogue.restore(context.get("dialogue"), len(context_manager.history))
+            context_manager.context.update((key, value) for key, value in context.items() if key not in ("history", "dialogue"))
+            context_manager.write_snapshot()
+        finally:
+            context_manager.history.close()
+        imported += 1
+    return imported
+
+
+def migrate_files(source, destination):
+    """Moves every session's files, still encrypted, from one SessionDirectory layout to another; returns the count."""
+    moved = 0
+    for user_id in list(source.user_ids()):
+        destination.prepare(user_id)
+        for kind in FILE_NAMES:
+            path = source.path(user_id, kind)
+            if os.path.exists(path):
+                shutil.move(path, destination.path(user_id, kind))
+        moved += 1
+    return moved
+
+
+def _storage(root):
+    return SessionDirectory(root if root != "." else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk export, import and migration of saved sessions.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Write every session as plaintext JSON lines to stdout")
+    export_parser.add_argument("--root", default=".", help="Session root; '.' is the flat working-directory layout")
+    import_parser = commands.add_parser("import", help="Read JSON lines from stdin and save them as sessions")
+    import_parser.add_argument("--root", default=".")
+    migrate_parser = commands.add_parser("migrate", help="Move session files between layouts")
+    migrate_parser.add_argument("--from", dest="source", default=".")
+    migrate_parser.add_argument("--to", dest="destination", required=True)
+    args = parser.parse_args()
+
+    from context_manager import LazyCipher, configure_logging
+    configure_logging()
+    logging.getLogger().handlers[0].setStream(sys.stderr)  # stdout carries the export
+    if args.command == "export":
+        exported, failed = export_sessions(_storage(args.root), sys.stdout, LazyCipher())
+        logging.info(f"Exported {exported} session(s), {failed} failed to load.")
+    elif args.command == "import":
+        logging.info(f"Imported {import_sessions(_storage(args.root), sys.stdin, LazyCipher())} session(s).")
+    else:
+        logging.info(f"Moved {migrate_files(_storage(args.source), _storage(args.destination))} session(s).")
@@ -0,0 +1,219 @@
+import heapq
+import itertools
+import logging
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from context_manager import ContextManager, LazyCipher
+
+
+class InactivityScheduler:
+    """Runs inactivity callbacks for every session from one background thread.
+
+    Deadlines live in a heap. Rescheduling a key only records its new deadline;
+    the stale heap entry is skipped when it comes up, so reset_timer() stays
+    O(log n) no matter how many sessions are active.
+    """
+
+    def __init__(self):
+        self.heap = []  # (deadline, seq, key); seq breaks ties, since keys mix user ids and ("flush", user id) tuples
+        self.sequence = itertools.count()
+        self.deadlines = {}  # key -> (deadline, callback) of the live entry
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def schedule(self, key, delay, callback, coalesce=False):
+        """(Re)schedules callback to run delay seconds from now, replacing any pending one for key.
+
+        With coalesce, a pending callback for key keeps its earlier deadline
+        instead, so a steady stream of calls can't postpone it forever.
+        """
+        deadline = time.monotonic() + delay
+        with self.condition:
+            if coalesce and key in self.deadlines:
+                return
+            self.deadlines[key] = (deadline, callback)
+            heapq.heappush(self.heap, (deadline, next(self.sequence), key))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="inactivity-scheduler", daemon=True)
+                self.thread.start()
+            elif self.heap[0][0] == deadline:
+                # The new deadline is now the earliest one, wake the thread up
+                self.condition.notify()
+
+    def cancel(self, key):
+        with self.condition:
+            self.deadlines.pop(key, None)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def _pop_due(self):
+        """Waits for the next live deadline and returns its callback, or None once stopped."""
+        with self.condition:
+            while not self.stopped:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                deadline, _, key = self.heap[0]
+                entry = self.deadlines.get(key)
+                if entry is None or entry[0] != deadline:
+                    heapq.heappop(self.heap)  # Cancelled or rescheduled since it was pushed
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                heapq.heappop(self.heap)
+                del self.deadlines[key]
+                return entry[1]
+        return None
+
+    def _run(self):
+        while True:
+            callback = self._pop_due()
+            if callback is None:
+                return
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Inactivity callback failed: {e}")
+
+
+class SessionStore:
+    """Keeps ContextManagers for many users in one process.
+
+    All sessions share one cipher, one inactivity scheduler thread and one
+    signal hook. At most max_sessions contexts stay in memory; the least
+    recently used one is saved to disk and dropped when that is exceeded.
+    Pass storage=SessionDirectory(root) to keep session files in a sharded tree.
+
+    The store-wide lock only guards the in-memory map. Loading a session from
+    disk and writing an evicted one back happen under one of lock_stripes
+    per-user locks instead, so slow disk work for one user never blocks
+    requests for users on other stripes, while two requests for the same
+    user still load it only once. A user dropped from the map stays in
+    evicting until its write-back is done, and loading it again waits for that.
+    """
+
+    def __init__(self, max_sessions=1000, timeout=300, cipher=None, lock_stripes=64, **context_options):
+        self.max_sessions = max_sessions
+        self.timeout = timeout
+        self.cipher = cipher if cipher is not None else LazyCipher()
+        self.scheduler = InactivityScheduler()
+        self.context_options = context_options  # Extra ContextManager arguments, e.g. append_log or storage
+        self.sessions = OrderedDict()  # user_id -> ContextManager, least recently used first
+        self.lock = threading.RLock()
+        self.stripes = [threading.Lock() for _ in range(lock_stripes)]
+        self.evicting = {}  # user_id -> Event set once its write-back is on disk
+
+    def stripe(self, user_id):
+        """The lock serializing disk loads and write-backs for user_id."""
+        return self.stripes[hash(user_id) % len(self.stripes)]
+
+    def get(self, user_id):
+        """Returns the context for user_id, loading it from disk if it isn't in memory."""
+        with self.lock:
+            context_manager = self._touch(user_id)
+        if context_manager is not None:
+            return context_manager
+        with self.stripe(user_id):
+            while True:
+                with self.lock:
+                    # Someone else may have loaded it while this thread waited for the stripe
+                    context_manager = self._touch(user_id)
+                    written = self.evicting.get(user_id)
+                if context_manager is not None:
+                    return context_manager
+                if written is None:
+                    break
+                written.wait()  # Its last updates have to reach the disk before they are loaded back
+            context_manager = ContextManager(
+                user_id,
+                timeout=self.timeout,
+                cipher=self.cipher,
+                scheduler=self.scheduler,
+                install_signal_handlers=False,
+                **self.context_options,
+            )
+            context_manager.load_context()
+            with self.lock:
+                self.sessions[user_id] = context_manager
+                evicted = self._pop_overflow()
+        for old in evicted:
+            self._write_back(old)
+        return context_manager
+
+    def _touch(self, user_id):
+        context_manager = self.sessions.get(user_id)
+        if context_manager is not None:
+            self.sessions.move_to_end(user_id)
+        return context_manager
+
+    def _pop_overflow(self):
+        evicted = []
+        while len(self.sessions) > self.max_sessions:
+            _, old = self.sessions.popitem(last=False)
+            self.scheduler.cancel(old.user_id)
+            self.evicting[old.user_id] = threading.Event()
+            evicted.append(old)
+        return evicted
+
+    def _write_back(self, context_manager):
+        try:
+            context_manager.flush()
+            if context_manager.history_log:
+                context_manager.history_log.close()
+            context_manager.history.close()
+        finally:
+            with self.lock:
+                self.evicting.pop(context_manager.user_id).set()
+        logging.debug(f"Evicted context for user {context_manager.user_id}.")
+
+    def evict(self, user_id):
+        """Saves the context for user_id if needed and drops it from memory."""
+        with self.lock:
+            context_manager = self.sessions.pop(user_id, None)
+            self.scheduler.cancel(user_id)
+            if context_manager is not None:
+                self.evicting[user_id] = threading.Event()
+        if context_manager is not None:
+            self._write_back(context_manager)
+
+    def flush_all(self):
+        """Saves every session with unsaved updates, including those waiting for a write-behind save."""
+        with self.lock:
+            dirty = [context_manager for context_manager in self.sessions.values() if context_manager.dirty]
+        for context_manager in dirty:
+            context_manager.flush()
+        logging.info(f"Flushed {len(dirty)} session(s).")
+
+    def install_signal_handlers(self):
+        """Installs one SIGINT/SIGTERM hook that flushes all sessions before exiting."""
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGTERM, self.signal_handler)
+
+    def signal_handler(self, sig, frame):
+        logging.info("Program terminated. Saving all sessions...")
+        self.flush_all()
+        sys.exit(0)
+
+    def close(self):
+        """Flushes everything and stops the scheduler thread."""
+        self.flush_all()
+        self.scheduler.stop()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, user_id):
+        return user_id in self.sessions
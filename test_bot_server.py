@@ -0,0 +1,189 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from cryptography.fernet import Fernet
+from bot_server import BotServer, percentile, run_load, start_metrics_server
+from nlp_pipeline.nlp_pipeline import NLPPipeline
+from session_store import SessionStore
+
+class TestBotServer(unittest.TestCase):
+
+    def setUp(self):
+        # Run inside a scratch directory so session files don't leak
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.store = SessionStore(cipher=Fernet(Fernet.generate_key()))
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def run_with_server(self, client):
+        async def scenario():
+            server = BotServer(self.store, batch_size=8)
+            await server.start("127.0.0.1", 0)
+            host, port = server.address[:2]
+            try:
+                return await client(host, port)
+            finally:
+                await server.close()
+        return asyncio.run(scenario())
+
+    def test_pipelined_requests_answered_in_order(self):
+        async def client(host, port):
+            reader, writer = await asyncio.open_connection(host, port)
+            inputs = ["hi", "help", "bye", "what is a loop"] * 5
+            for number, text in enumerate(inputs):
+                writer.write(json.dumps({"user_id": "user1", "id": number, "input": text}).encode() + b"\n")
+            await writer.drain()
+            replies = [json.loads(await reader.readline()) for _ in inputs]
+            writer.close()
+            return replies
+
+        replies = self.run_with_server(client)
+        self.assertEqual([reply["id"] for reply in replies], list(range(20)))
+        self.assertEqual(replies[0]["intent"], "greet")
+        self.assertEqual(replies[2]["intent"], "bye")
+        # The turns were recorded in the user's context in the order they were sent
+        history = self.store.get("user1").context["history"]
+        self.assertEqual([turn["input"] for turn in history[:3]], ["hi", "help", "bye"])
+
+    def test_follow_ups_resolve_against_the_session(self):
+        async def client(host, port):
+            reader, writer = await asyncio.open_connection(host, port)
+            for text in ["why does sort_items() crash", "what about that?"]:
+                writer.write(json.dumps({"user_id": "user1", "input": text}).encode() + b"\n")
+            await writer.drain()
+            replies = [json.loads(await reader.readline()) for _ in range(2)]
+            writer.close()
+            return replies
+
+        self.run_with_server(client)
+        context_manager = self.store.get("user1")
+        self.assertEqual(context_manager.dialogue.turn, 2)
+        self.assertEqual(context_manager.dialogue.last_mention("sort_items"), 2)  # "that" was resolved to it
+        self.assertEqual(context_manager.context["topic"], "sort_items")
+
+    def test_failed_writes_end_the_connection(self):
+        class BrokenWriter:
+            def write(self, data):
+                pass
+
+            async def drain(self):
+                raise ConnectionResetError("peer went away")
+
+            def close(self):
+                pass
+
+        async def scenario():
+            server = BotServer(self.store, max_in_flight=1)
+            await server.start("127.0.0.1", 0)
+            try:
+                reader = asyncio.StreamReader()
+                for number in range(5):
+                    reader.feed_data(json.dumps({"user_id": "user1", "id": number, "input": "hi"}).encode() + b"\n")
+                # Without freeing the slots of unanswerable requests this would wait forever
+                await asyncio.wait_for(server._handle_connection(reader, BrokenWriter()), 5)
+            finally:
+                await server.close()
+
+        asyncio.run(scenario())
+
+    def test_failed_batch_skips_cancelled_requests(self):
+        class FailingPipeline:
+            def process_turn(self, user_input, dialogue):
+                raise RuntimeError("model unavailable")
+
+        async def scenario():
+            server = BotServer(self.store, pipeline=FailingPipeline(), batch_window=0.05)
+            await server.start("127.0.0.1", 0)
+            try:
+                loop = asyncio.get_running_loop()
+                cancelled, waiting = loop.create_future(), loop.create_future()
+                await server.pending.put(("user1", "hi", cancelled))
+                await server.pending.put(("user2", "hi", waiting))
+                cancelled.cancel()  # The client hung up while its request was queued
+                with self.assertLogs(level="ERROR"), self.assertRaises(RuntimeError):
+                    await asyncio.wait_for(waiting, 5)
+                self.assertFalse(server.batcher.done())
+            finally:
+                await server.close()
+
+        asyncio.run(scenario())
+
+    def test_failed_turn_fails_only_its_own_request(self):
+        class FlakyPipeline(NLPPipeline):
+            def process_turn(self, user_input, dialogue):
+                if user_input == "boom":
+                    raise RuntimeError("model unavailable")
+                return super().process_turn(user_input, dialogue)
+
+        async def scenario():
+            server = BotServer(self.store, pipeline=FlakyPipeline(), batch_window=0.05)
+            await server.start("127.0.0.1", 0)
+            try:
+                loop = asyncio.get_running_loop()
+                futures = [loop.create_future() for _ in range(3)]
+                for (user_id, text), future in zip([("user1", "hi"), ("user2", "boom"), ("user1", "bye")], futures):
+                    await server.pending.put((user_id, text, future))
+                with self.assertLogs(level="ERROR"):
+                    await asyncio.wait(futures, timeout=5)
+                return futures
+            finally:
+                await server.close()
+
+        first, failed, last = asyncio.run(scenario())
+        self.assertEqual((first.result()[1], last.result()[1]), ("greet", "bye"))
+        self.assertIsInstance(failed.exception(), RuntimeError)
+        self.assertEqual([turn["input"] for turn in self.store.get("user1").context["history"]], ["hi", "bye"])
+
+    def test_invalid_request_gets_error_reply(self):
+        async def client(host, port):
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(b"not json\n")
+            await writer.drain()
+            reply = json.loads(await reader.readline())
+            writer.close()
+            return reply
+
+        self.assertIn("error", self.run_with_server(client))
+
+    def test_load_generator_reports_latency(self):
+        stats = self.run_with_server(lambda host, port: run_load(
+            lambda: asyncio.open_connection(host, port), sessions=10, requests_per_session=5))
+        self.assertEqual(stats["requests"], 50)
+        self.assertLessEqual(stats["p50_ms"], stats["p99_ms"])
+
+    def test_metrics_endpoint(self):
+        async def fetch(path):
+            server = await start_metrics_server("127.0.0.1", 0)
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+                writer.write(f"GET {path} HTTP/1.0\r\n\r\n".encode())
+                await writer.drain()
+                reply = await reader.read()
+                writer.close()
+                return reply.decode()
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        self.run_with_server(lambda host, port: run_load(lambda: asyncio.open_connection(host, port), sessions=2, requests_per_session=2))
+        text = asyncio.run(fetch("/metrics"))
+        self.assertTrue(text.startswith("HTTP/1.0 200 OK"))
+        self.assertIn("codebot_inputs_total", text)
+        snapshot = json.loads(asyncio.run(fetch("/metrics.json")).split("\r\n\r\n", 1)[1])
+        self.assertIn("codebot_batch_stage_seconds", snapshot["metrics"])
+        self.assertIn("samples", asyncio.run(fetch("/profile?seconds=0.05")))
+        self.assertIn("404", asyncio.run(fetch("/nowhere")).splitlines()[0])
+
+    def test_percentile(self):
+        self.assertEqual(percentile([1, 2, 3, 4], 0.5), 2)
+        self.assertEqual(percentile([1, 2, 3, 4], 0.99), 4)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+if __name__ == "__main__":
+    unittest.main()
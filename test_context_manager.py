@@ -1,7 +1,11 @@
 import unittest
 from unittest.mock import patch, mock_open, MagicMock
+import context_manager as context_manager_module
 from context_manager import ContextManager
 import os
+import tempfile
+import threading
+import time
 from cryptography.fernet import Fernet  # For encryption (requires installation via `pip install cryptography`)
 
 class TestContextManager(unittest.TestCase):
@@ -12,17 +16,23 @@ class TestContextManager(unittest.TestCase):
         self.encryption_key = Fernet.generate_key()
         self.context_manager = ContextManager(user_id=self.user_id, encryption_key=self.encryption_key)
 
-    @patch("builtins.open", new_callable=mock_open)  # Mock file opening
+    @patch("os.fsync")
+    @patch("os.replace")
+    @patch("os.fdopen", new_callable=mock_open)  # Mock file opening
+    @patch("tempfile.mkstemp", return_value=(7, "/data/session_context_user123.json.x1y2.tmp"))
     @patch("cryptography.fernet.Fernet.encrypt", return_value=b"encrypted_data")
-    def test_save_context(self, mock_encrypt, mock_file):
+    def test_save_context(self, mock_encrypt, mock_mkstemp, mock_file, mock_replace, mock_fsync):
         # Test saving the context
         self.context_manager.update(intent="greeting", entity="hello", topic="greeting", input_text="Hi", response="Hello, user!")
         self.context_manager.save_context()
         
-        # Verify encryption and file operations
+        # Verify encryption and file operations: written to a temp file, synced, then renamed over the context file
         mock_encrypt.assert_called_once()
-        mock_file.assert_called_once_with(f"session_context_{self.user_id}.json", "wb")
+        mock_mkstemp.assert_called_once_with(dir=os.getcwd(), prefix=f"session_context_{self.user_id}.json.", suffix=".tmp")
+        mock_file.assert_called_once_with(7, "wb")
         mock_file().write.assert_called_once_with(b"encrypted_data")
+        mock_replace.assert_called_once_with("/data/session_context_user123.json.x1y2.tmp", f"session_context_{self.user_id}.json")
+        self.assertTrue(mock_fsync.called)
 
     @patch("builtins.open", new_callable=mock_open, read_data=b"encrypted_data")
     @patch("cryptography.fernet.Fernet.decrypt", return_value=b'{"user_id": "user123", "last_intent": "greeting", "last_entity": "hello", "topic": "greeting", "history": []}')
@@ -50,9 +60,12 @@ class TestContextManager(unittest.TestCase):
         self.assertTrue(self.context_manager.is_terminated)
         mock_sys_exit.assert_called_once_with(0)  # Assert sys.exit(0) was called
 
-    @patch("builtins.open", new_callable=mock_open)  # Mock file opening
+    @patch("os.fsync")
+    @patch("os.replace")
+    @patch("os.fdopen", new_callable=mock_open)  # Mock file opening
+    @patch("tempfile.mkstemp", return_value=(7, "/data/session_context_user123.json.x1y2.tmp"))
     @patch("cryptography.fernet.Fernet.encrypt", return_value=b"encrypted_data")
-    def test_manual_save(self, mock_encrypt, mock_file):
+    def test_manual_save(self, mock_encrypt, mock_mkstemp, mock_file, mock_replace, mock_fsync):
         
         # Test manual saving of context with encryption
         self.context_manager.update(intent="greeting", entity="hello", topic="greeting", input_text="Hi", response="Hello, user!")
@@ -60,8 +73,10 @@ class TestContextManager(unittest.TestCase):
         
         # Verify encryption and file operations
         mock_encrypt.assert_called_once()
-        mock_file.assert_called_once_with(f"session_context_{self.user_id}.json", "wb")
+        mock_mkstemp.assert_called_once_with(dir=os.getcwd(), prefix=f"session_context_{self.user_id}.json.", suffix=".tmp")
+        mock_file.assert_called_once_with(7, "wb")
         mock_file().write.assert_called_once_with(b"encrypted_data")
+        mock_replace.assert_called_once_with("/data/session_context_user123.json.x1y2.tmp", f"session_context_{self.user_id}.json")
 
     @patch("builtins.open", new_callable=mock_open, read_data=b"encrypted_data")
     @patch("cryptography.fernet.Fernet.decrypt", side_effect=Exception("Decryption failed"))
@@ -109,5 +124,210 @@ class TestContextManager(unittest.TestCase):
         mock_timer_instance.cancel.assert_called_once()  # Timer should be canceled first
         mock_timer_instance.start.assert_called_once()  # Timer should be started
 
+class TestContextManagerHistoryLog(unittest.TestCase):
+
+    def setUp(self):
+        # Run inside a scratch directory so the snapshot and log files don't leak
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode())
+        self.user_id = "user123"
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def new_context_manager(self, compact_every=1000):
+        return ContextManager(user_id=self.user_id, append_log=True, compact_every=compact_every)
+
+    def test_updates_replayed_from_log(self):
+        context_manager = self.new_context_manager()
+        context_manager.update(intent="greet", input_text="hi", response="Hello!")
+        context_manager.update(intent="bye", input_text="bye", response="Goodbye!")
+        context_manager.save_context()
+
+        # Nothing was compacted, so the snapshot file was never written
+        self.assertFalse(os.path.exists(context_manager.context_file_path))
+
+        restored = self.new_context_manager()
+        restored.load_context()
+        self.assertEqual(restored.context["last_intent"], "bye")
+        self.assertEqual([turn["input"] for turn in restored.context["history"]], ["hi", "bye"])
+
+    def test_dialogue_state_survives_snapshot_and_log(self):
+        context_manager = self.new_context_manager(compact_every=2)
+        context_manager.update(intent="unknown", entity="sort_items", entities=[("sort_items", "function")],
+                               topic="sort_items", input_text="why does sort_items() fail", response="...")
+        context_manager.update(intent="unknown", input_text="and now?", response="...")
+        context_manager.save_context()  # Snapshot
+        context_manager.update(intent="unknown", entity="Parser", entities=[("Parser", "class")],
+                               topic="Parser", input_text="what about Parser", response="...")
+        context_manager.save_context()  # Only in the log
+
+        restored = self.new_context_manager()
+        restored.load_context()
+        self.assertEqual(restored.dialogue.to_dict(), context_manager.dialogue.to_dict())
+        self.assertEqual(restored.dialogue.last_mention("sort_items"), 1)
+        self.assertEqual(restored.context["history"][restored.dialogue.last_mention("Parser") - 1]["input"], "what about Parser")
+        self.assertEqual(list(restored.dialogue.topics), [(1, "sort_items"), (3, "Parser")])
+
+    def test_compaction_writes_snapshot_and_truncates_log(self):
+        context_manager = self.new_context_manager(compact_every=2)
+        context_manager.update(intent="greet", input_text="hi", response="Hello!")
+        context_manager.update(intent="greet", input_text="hey", response="Hello!")
+        context_manager.save_context()
+        context_manager.update(intent="bye", input_text="bye", response="Goodbye!")
+        context_manager.save_context()
+
+        self.assertTrue(os.path.exists(context_manager.context_file_path))
+        self.assertEqual(context_manager.history_log.record_count, 1)
+
+        restored = self.new_context_manager()
+        restored.load_context()
+        self.assertEqual([turn["input"] for turn in restored.context["history"]], ["hi", "hey", "bye"])
+        self.assertNotIn("log_seq", restored.context)
+
+    def test_records_already_in_snapshot_are_skipped(self):
+        context_manager = self.new_context_manager()
+        context_manager.update(intent="greet", input_text="hi", response="Hello!")
+        # Simulate a crash between writing the snapshot and truncating the log
+        context_manager.write_snapshot()
+        context_manager.history_log.sync()
+
+        restored = self.new_context_manager()
+        restored.load_context()
+        self.assertEqual(len(restored.context["history"]), 1)
+
+    def test_truncated_tail_record_is_ignored(self):
+        context_manager = self.new_context_manager()
+        context_manager.update(intent="greet", input_text="hi", response="Hello!")
+        context_manager.history_log.close()
+        with open(context_manager.history_log.log_file_path, "ab") as file:
+            file.write(b"\x00\x00\x01\x00partial")
+
+        restored = self.new_context_manager()
+        restored.load_context()
+        self.assertEqual(len(restored.context["history"]), 1)
+
+    def test_appends_after_a_truncated_tail_are_replayed(self):
+        context_manager = self.new_context_manager()
+        context_manager.update(intent="greet", input_text="hi", response="Hello!")
+        context_manager.history_log.close()
+        with open(context_manager.history_log.log_file_path, "ab") as file:
+            file.write(b"\x00\x00\x01\x00partial")
+
+        restarted = self.new_context_manager()
+        restarted.load_context()
+        restarted.update(intent="greet", input_text="hey", response="Hello!")
+        restarted.update(intent="bye", input_text="bye", response="Goodbye!")
+        restarted.history_log.close()
+
+        restored = self.new_context_manager()
+        restored.load_context()
+        self.assertEqual([turn["input"] for turn in restored.context["history"]], ["hi", "hey", "bye"])
+
+class TestContextManagerWriteBehind(unittest.TestCase):
+
+    def setUp(self):
+        # Run inside a scratch directory so the snapshot files don't leak
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.key = Fernet.generate_key()
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def new_context_manager(self, **options):
+        return ContextManager(user_id="user1", encryption_key=self.key, install_signal_handlers=False, **options)
+
+    def test_burst_of_updates_is_one_write(self):
+        context_manager = self.new_context_manager(write_behind=0.2)
+        with patch("context_manager.atomic_write", wraps=context_manager_module.atomic_write) as write:
+            for i in range(20):
+                context_manager.update(intent="greet", input_text=f"hi {i}", response="Hello!")
+            self.assertEqual(write.call_count, 0)
+            time.sleep(0.5)
+            self.assertEqual(write.call_count, 1)
+        self.assertFalse(context_manager.dirty)
+        context_manager.scheduler.stop()
+
+    def test_flush_writes_immediately(self):
+        context_manager = self.new_context_manager(write_behind=60)
+        context_manager.update(intent="greet", input_text="hi", response="Hello!")
+        context_manager.flush()
+        self.assertFalse(context_manager.dirty)
+        self.assertNotIn(("flush", "user1"), context_manager.scheduler.deadlines)
+        restored = self.new_context_manager()
+        restored.load_context()
+        self.assertEqual(len(restored.context["history"]), 1)
+        context_manager.scheduler.stop()
+
+    def test_failed_write_keeps_previous_file(self):
+        context_manager = self.new_context_manager()
+        context_manager.update(intent="greet", input_text="hi", response="Hello!")
+        context_manager.save_context()
+        context_manager.update(intent="bye", input_text="bye", response="Goodbye!")
+        with patch("os.replace", side_effect=OSError("disk full")), self.assertLogs(level="ERROR"):
+            context_manager.save_context()
+        self.assertTrue(context_manager.dirty)
+        self.assertEqual(os.listdir("."), ["session_context_user1.json"])  # The temp file is cleaned up
+
+        restored = self.new_context_manager()
+        restored.load_context()
+        self.assertEqual(restored.context["last_intent"], "greet")
+
+    def test_concurrent_saves_leave_newest_snapshot(self):
+        context_manager = self.new_context_manager()
+
+        def worker(thread):
+            for i in range(20):
+                context_manager.update(intent=f"intent {thread}", input_text=f"hi {thread} {i}", response="Hello!")
+                context_manager.save_context()
+
+        threads = [threading.Thread(target=worker, args=(thread,)) for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        context_manager.flush()
+
+        restored = self.new_context_manager()
+        restored.load_context()
+        self.assertEqual(len(restored.context["history"]), 80)
+        self.assertEqual(context_manager.written_seq, 80)
+
+    def test_concurrent_writers_use_their_own_temp_files(self):
+        payloads = [bytes([thread]) * 65536 for thread in range(4)]
+
+        def writer(payload):
+            for _ in range(50):
+                context_manager_module.atomic_write("shared.bin", payload, "none")
+
+        threads = [threading.Thread(target=writer, args=(payload,)) for payload in payloads]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with open("shared.bin", "rb") as file:
+            self.assertIn(file.read(), payloads)
+        self.assertEqual(os.listdir("."), ["shared.bin"])
+
+    def test_save_and_load_are_measured(self):
+        saves, loads = context_manager_module.SAVE_SECONDS.count, context_manager_module.LOAD_SECONDS.count
+        written = context_manager_module.BYTES_WRITTEN.value
+        read = context_manager_module.BYTES_READ.value
+        context_manager = self.new_context_manager()
+        context_manager.update(intent="greet", input_text="hi", response="Hello!")
+        context_manager.save_context()
+        self.new_context_manager().load_context()
+        size = os.path.getsize(context_manager.context_file_path)
+        self.assertEqual(context_manager_module.SAVE_SECONDS.count, saves + 1)
+        self.assertEqual(context_manager_module.LOAD_SECONDS.count, loads + 1)
+        self.assertEqual(context_manager_module.BYTES_WRITTEN.value, written + size)
+        self.assertEqual(context_manager_module.BYTES_READ.value, read + size)
+
 if __name__ == "__main__":
     unittest.main()
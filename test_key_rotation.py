@@ -0,0 +1,143 @@
+import json
+import os
+import tempfile
+import unittest
+from cryptography.fernet import Fernet, InvalidToken
+from context_codec import ContextCodec
+from context_manager import ContextManager, LazyCipher, load_cipher
+from key_rotation import fingerprint, sweep
+from session_storage import SessionDirectory
+
+class TestKeyRotation(unittest.TestCase):
+
+    def setUp(self):
+        # Run inside a scratch directory so session files don't leak
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.old_key = Fernet.generate_key().decode()
+        self.new_key = Fernet.generate_key().decode()
+        self.storage = SessionDirectory("sessions")
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def save_session(self, user_id, cipher, codec=None, turns=1, **options):
+        context_manager = ContextManager(user_id, cipher=cipher, codec=codec, storage=self.storage,
+                                         install_signal_handlers=False, **options)
+        for i in range(turns):
+            context_manager.update(intent="greet", input_text=f"hi {i}", response="Hello!")
+        context_manager.save_context()
+        context_manager.history.close()
+
+    def load_session(self, user_id, cipher, codec=None, **options):
+        context_manager = ContextManager(user_id, cipher=cipher, codec=codec, storage=self.storage,
+                                         install_signal_handlers=False, **options)
+        loaded = context_manager.load_context()
+        history = [turn.as_dict() for turn in context_manager.history]
+        context_manager.history.close()
+        return loaded, history
+
+    def test_multi_key_cipher_reads_old_sessions(self):
+        self.save_session("user1", load_cipher(self.old_key))
+        rotating = load_cipher(self.new_key, [self.old_key])
+        self.assertTrue(self.load_session("user1", rotating)[0])
+        token = rotating.encrypt(b"new")
+        self.assertEqual(Fernet(self.new_key).decrypt(token), b"new")  # Writes use the new key only
+
+    def test_sweep_lets_the_old_key_go(self):
+        old = load_cipher(self.old_key)
+        for i in range(5):
+            self.save_session(f"user{i}", old, turns=30, history_window=10)  # Spilled history too
+        counts = sweep(self.storage, [self.new_key, self.old_key], workers=0, batch_size=2, log_idle=0)
+        self.assertEqual(counts["rotated"], 10)
+        self.assertEqual(counts["failed"] + counts["busy"], 0)
+
+        loaded, history = self.load_session("user3", load_cipher(self.new_key), history_window=10)
+        self.assertTrue(loaded)
+        self.assertEqual(len(history), 30)
+        with self.assertLogs(level="ERROR"):
+            self.assertFalse(self.load_session("user3", load_cipher(self.old_key))[0])
+        # A second sweep finds nothing to do
+        self.assertEqual(sweep(self.storage, [self.new_key, self.old_key], workers=0, log_idle=0)["current"], 10)
+
+    def test_sweep_in_worker_processes(self):
+        old = load_cipher(self.old_key)
+        for i in range(6):
+            self.save_session(f"user{i}", old)
+        counts = sweep(self.storage, [self.new_key, self.old_key], workers=2, batch_size=2)
+        self.assertEqual(counts["rotated"], 6)
+        self.assertTrue(self.load_session("user5", load_cipher(self.new_key))[0])
+
+    def test_aesgcm_sessions_rotate(self):
+        codec = ContextCodec(serializer="binary", compression="zlib", encryption="aesgcm")
+        self.save_session("user1", LazyCipher(self.old_key), codec, turns=3)
+        self.assertEqual(sweep(self.storage, [self.new_key, self.old_key], workers=0)["rotated"], 1)
+        loaded, history = self.load_session("user1", LazyCipher(self.new_key), codec)
+        self.assertTrue(loaded)
+        self.assertEqual(len(history), 3)
+
+    def test_interrupted_sweep_resumes_after_checkpoint(self):
+        old = load_cipher(self.old_key)
+        user_ids = [f"user{i}" for i in range(6)]
+        for user_id in user_ids:
+            self.save_session(user_id, old)
+        ordered = list(self.storage.user_ids())
+        with open("state.json", "w") as file:
+            json.dump({"version": 1, "key": fingerprint(self.new_key), "done_through": ordered[3]}, file)
+        counts = sweep(self.storage, [self.new_key, self.old_key], workers=0, state_path="state.json")
+        self.assertEqual(counts["rotated"], 2)  # Only the sessions after the checkpoint
+        self.assertFalse(os.path.exists("state.json"))
+        with self.assertRaises(InvalidToken):
+            Fernet(self.new_key).decrypt(open(self.storage.path(ordered[0]), "rb").read())
+        self.assertTrue(self.load_session(ordered[5], load_cipher(self.new_key))[0])
+
+    def test_recently_written_logs_are_left_for_later(self):
+        self.save_session("user1", load_cipher(self.old_key), turns=30, history_window=10)
+        counts = sweep(self.storage, [self.new_key, self.old_key], workers=0, log_idle=3600)
+        self.assertEqual((counts["rotated"], counts["busy"]), (1, 1))
+
+    def test_sessions_with_only_a_log_rotate(self):
+        context_manager = ContextManager("user1", cipher=load_cipher(self.old_key), storage=self.storage,
+                                         install_signal_handlers=False, append_log=True)
+        for i in range(3):
+            context_manager.update(intent="greet", input_text=f"hi {i}", response="Hello!")
+        context_manager.save_context()  # Not yet compacted: no snapshot on disk
+        context_manager.history_log.close()
+        self.assertFalse(os.path.exists(self.storage.path("user1")))
+
+        counts = sweep(self.storage, [self.new_key, self.old_key], workers=0, log_idle=0)
+        self.assertEqual((counts["rotated"], counts["missing"]), (1, 1))
+        _, history = self.load_session("user1", load_cipher(self.new_key), append_log=True)
+        self.assertEqual([turn["input"] for turn in history], ["hi 0", "hi 1", "hi 2"])
+
+    def test_live_session_keeps_appending_after_its_logs_rotate(self):
+        earlier = ContextManager("user1", cipher=load_cipher(self.old_key), storage=self.storage,
+                                 install_signal_handlers=False, history_window=10, append_log=True, compact_every=1)
+        for i in range(30):
+            earlier.update(intent="greet", input_text=f"hi {i}", response="Hello!")
+        earlier.save_context()  # Snapshot plus spill file
+        earlier.update(intent="greet", input_text="logged", response="Hello!")  # And a log record, all under the old key
+        earlier.history.close()
+        earlier.history_log.close()
+
+        live = ContextManager("user1", cipher=load_cipher(self.new_key, [self.old_key]), storage=self.storage,
+                              install_signal_handlers=False, history_window=10, append_log=True, compact_every=1000)
+        self.assertTrue(live.load_context())
+        live.update(intent="greet", input_text="before", response="Hello!")  # Both logs are open now
+        counts = sweep(self.storage, [self.new_key, self.old_key], workers=0, log_idle=0)
+        self.assertEqual(counts["rotated"], 3)
+        for i in range(12):  # Spills more blocks and appends more records after the rotation
+            live.update(intent="greet", input_text=f"after {i}", response="Hello!")
+        live.save_context()
+        live.history.close()
+        live.history_log.close()
+
+        loaded, history = self.load_session("user1", load_cipher(self.new_key), history_window=10, append_log=True)
+        self.assertTrue(loaded)
+        self.assertEqual(len(history), 44)
+        self.assertEqual(history[-1]["input"], "after 11")
+
+if __name__ == "__main__":
+    unittest.main()
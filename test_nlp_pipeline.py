@@ -0,0 +1,653 @@
+import importlib.util
+import io
+import os
+import random
+import tempfile
+import unittest
+from nlp_pipeline.nlp_pipeline import NLPPipeline
+from nlp_pipeline.intent_classifier import IntentClassifier
+from nlp_pipeline.intent_matcher import IntentMatcher
+from nlp_pipeline.tokenizer import Tokenizer, load_stopwords
+from nlp_pipeline.code_lexer import CodeLexer
+from nlp_pipeline.code_analyzer import CodeAnalyzer
+from nlp_pipeline.entity_recognizer import EntityRecognizer
+from nlp_pipeline.pos_tagger import POSTagger
+from nlp_pipeline.token_labels import TOKEN_LABELS, TokenLabeler
+from nlp_pipeline.doc_index import DocIndex, build_index
+from nlp_pipeline.corpus import TokenCorpus, ingest, iter_brown, iter_cornell
+from nlp_pipeline.response_generator import ResponseGenerator
+from nlp_pipeline.metrics import METRICS, Histogram, Metrics, Profiler
+from nlp_pipeline.stage_graph import Stage, StageGraph
+from nlp_pipeline.dialogue_state import DialogueState
+
+class TestNLPPipelineLazyStages(unittest.TestCase):
+
+    def test_stages_built_on_first_use(self):
+        pipeline = NLPPipeline()
+        self.assertNotIn("tokenizer", vars(pipeline))
+        pipeline.process_input("hi")
+        self.assertIn("tokenizer", vars(pipeline))
+        self.assertNotIn("pos_tagger", vars(pipeline))
+        self.assertIs(pipeline.tokenizer, pipeline.tokenizer)
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_repeated_utterances_hit_cache(self):
+        pipeline = NLPPipeline(cache_size=2)
+        expected = NLPPipeline().process_input("hi there")
+        self.assertEqual(pipeline.process_input("hi there"), expected)
+        self.assertEqual(pipeline.process_input("hi   the there"), expected)  # Same tokens
+        self.assertEqual(list(pipeline.process_batch(["hi there", "bye", "help"])),
+                         [expected, pipeline.process_input("bye"), pipeline.process_input("help")])
+        stats = pipeline.response_cache.stats()
+        self.assertEqual((stats["hits"], stats["size"], stats["evictions"]), (4, 2, 1))
+
+    def test_key_ignores_whitespace_and_stopwords_but_not_case(self):
+        pipeline = NLPPipeline(cache_size=10)
+        for text in ["hi there", " hi  there ", "hi\tthe there", "Hi there"]:
+            self.assertEqual(pipeline.process_input(text), NLPPipeline().process_input(text))
+        self.assertEqual(len(pipeline.response_cache), 2)  # The first three collapse; "Hi" keeps its own entry
+
+    def test_cache_off_by_default(self):
+        self.assertIsNone(NLPPipeline().active_cache())
+
+    def test_context_dependent_stage_bypasses_cache(self):
+        pipeline = NLPPipeline(cache_size=10)
+        pipeline.response_generator.context_dependent = True
+        pipeline.process_input("hi")
+        pipeline.process_input("hi")
+        self.assertEqual(len(pipeline.response_cache), 0)
+
+class TestNLPPipelineBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.pipeline = NLPPipeline()
+        self.inputs = ["hi there", "can you help me", "bye", "for i in range(10): print(i)", ""] * 7
+
+    def test_batch_matches_process_input(self):
+        expected = [self.pipeline.process_input(text) for text in self.inputs]
+        self.assertEqual(list(self.pipeline.process_batch(self.inputs, chunk_size=4)), expected)
+
+    def test_batch_is_lazy(self):
+        consumed = []
+
+        def inputs():
+            for text in self.inputs:
+                consumed.append(text)
+                yield text
+
+        results = self.pipeline.process_batch(inputs(), chunk_size=3)
+        self.assertEqual(consumed, [])
+        next(results)
+        self.assertEqual(len(consumed), 3)
+
+    def test_batch_with_process_pool(self):
+        expected = [self.pipeline.process_input(text) for text in self.inputs]
+        self.assertEqual(list(self.pipeline.process_batch(self.inputs, chunk_size=4, workers=2)), expected)
+
+class TestIntentMatcher(unittest.TestCase):
+
+    def test_first_listed_intent_wins(self):
+        classifier = IntentClassifier()
+        self.assertEqual(classifier.classify_intent(["hello", "bye"]), "greet")
+        self.assertEqual(classifier.classify_intent(["help", "exit"]), "bye")
+        self.assertEqual(classifier.classify_intent(["loop"]), "unknown")
+
+    def test_multi_word_phrase(self):
+        classifier = IntentClassifier()
+        self.assertEqual(classifier.classify_intent(["ok", "see", "you"]), "bye")
+        self.assertEqual(classifier.classify_intent(["you", "see"]), "unknown")
+
+    def test_priorities_override_order(self):
+        classifier = IntentClassifier(priorities={"ask_for_help": 1})
+        self.assertEqual(classifier.classify_intent(["hi", "help"]), "ask_for_help")
+
+    def test_overlapping_phrases(self):
+        matcher = IntentMatcher({"long": ["x y z"], "short": ["y z w"], "single": ["z"]}, {"short": 5})
+        self.assertEqual(matcher.match(["x", "y", "z", "w"]), "short")
+        self.assertEqual(matcher.match(["q", "y", "z"]), "single")
+        self.assertEqual(matcher.match(["x", "y", "z"]), "long")
+
+class TestTokenizer(unittest.TestCase):
+
+    def setUp(self):
+        self.tokenizer = Tokenizer()
+        self.text = "The loop is written as: for i in range(10): print(i)\nIs THE élan For An x==y"
+
+    def test_stopwords_dropped_keywords_kept(self):
+        self.assertEqual(self.tokenizer.tokenize(self.text), [
+            "loop", "is", "written", "as", ":", "for", "i", "in", "range", "(", "10", ")", ":",
+            "print", "(", "i", ")", "lan", "x", "=", "=", "y"])
+
+    def test_offsets_point_at_tokens(self):
+        spans = list(self.tokenizer.iter_tokens(self.text, offsets=True))
+        self.assertEqual([self.text[start:end] for start, end in spans], self.tokenizer.tokenize(self.text))
+
+    def test_file_tokens_match_whole_text(self):
+        file = io.StringIO(self.text)
+        self.assertEqual(list(self.tokenizer.iter_file_tokens(file)), self.tokenizer.tokenize(self.text))
+        file.seek(0)
+        spans = list(self.tokenizer.iter_file_tokens(file, offsets=True))
+        self.assertEqual(spans, list(self.tokenizer.iter_tokens(self.text, offsets=True)))
+
+    def test_compile_picks_up_new_stopwords(self):
+        self.tokenizer.stopwords.add("loop")
+        self.tokenizer.compile()
+        self.assertNotIn("LOOP", self.tokenizer.tokenize("a LOOP here"))
+
+    def test_long_stopwords_match_any_case(self):
+        tokenizer = Tokenizer(stopwords={"the", "nevertheless", "notwithstanding" * 4})
+        self.assertLess(len(tokenizer.dropped), 100)  # No 2**60 spellings
+        text = "NeverTheLess the loop NOTWITHSTANDING" + "notwithstanding" * 3 + " ran"
+        self.assertEqual(tokenizer.tokenize(text), ["loop", "ran"])
+        self.assertEqual(list(tokenizer.iter_tokens(text)), ["loop", "ran"])
+
+    def test_stopwords_from_a_list(self):
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, "english"), "w") as file:
+                file.write("the\nhere\nnot\n")
+            tokenizer = Tokenizer(stopwords=load_stopwords(path))
+        self.assertEqual(tokenizer.tokenize("not the loop here a"), ["not", "loop", "a"])  # "not" is a keyword
+
+class TestCodeLexer(unittest.TestCase):
+
+    def setUp(self):
+        self.tokenizer = Tokenizer()
+        self.code = "def f(x):\n    return x ** 2 == 4\n\nclass A:\n    s = 'the text'\n"
+
+    def test_code_keeps_multi_char_operators_and_strings(self):
+        tokens = self.tokenizer.tokenize("Why does this fail?\n" + self.code)
+        self.assertEqual(tokens[:4], ["Why", "does", "this", "fail"])
+        self.assertIn("**", tokens)
+        self.assertIn("==", tokens)
+        self.assertIn("'the text'", tokens)
+
+    def test_fenced_block(self):
+        tokens = self.tokenizer.tokenize("```python\nx **= 2\n``` the end")
+        self.assertEqual(tokens, ["x", "**=", "2", "end"])
+
+    def test_prose_takes_regex_path(self):
+        self.assertEqual(self.tokenizer.tokenize("what is the loop: a for loop"), ["what", "is", "loop", ":", "for", "loop"])
+        self.assertEqual(self.tokenizer.code_lexer.misses, 0)
+
+    def test_edited_snippet_reuses_unchanged_chunks(self):
+        lexer = CodeLexer()
+        lexer.lex(self.code)
+        self.assertEqual((lexer.hits, lexer.misses), (0, 2))
+        lexer.lex(self.code.replace("'the text'", "'other'"))
+        self.assertEqual((lexer.hits, lexer.misses), (1, 3))
+
+    def test_chunk_split_inside_string_is_joined(self):
+        lexer = CodeLexer()
+        self.assertEqual(lexer.lex('x = """\nnot code\n"""\n'), ["x", "=", '"""\nnot code\n"""'])
+        self.assertIsNone(lexer.lex("x = (\n"))
+
+    def test_long_invalid_snippet_is_bounded_and_cached(self):
+        lexer = CodeLexer(max_pending_chars=200)
+        snippet = "x = (\n" + "y = 1\n" * 5000
+        self.assertIsNone(lexer.lex(snippet))
+        self.assertLess(lexer.misses, 50)  # Gave up once the unlexable prefix passed max_pending_chars
+        misses = lexer.misses
+        self.assertIsNone(lexer.lex(snippet))
+        self.assertEqual(lexer.misses, misses)  # Failed chunks come from the cache
+        self.assertIsNone(CodeLexer(max_code_chars=100).lex(snippet))
+        self.assertEqual(lexer.lex("# just a comment\n"), [])
+
+    def test_code_over_budget_is_tokenized_as_prose(self):
+        tokenizer = Tokenizer()
+        tokenizer.code_lexer.max_pending_chars = 50
+        tokens = tokenizer.tokenize("```\nx = (\n" + "y == 1\n" * 100 + "```")
+        self.assertNotIn("==", tokens)
+        self.assertIn("=", tokens)
+
+    def test_deeply_nested_lines_are_prose(self):
+        # Each of these overflows the parser (MemoryError or RecursionError) instead of failing to parse
+        for line in ("x = " + "-" * 200000 + "1", "x = " + "not " * 50000 + "1", "x = " + "lambda: " * 10000 + "1",
+                     "x = (" + "1+" * 300000 + "1)"):
+            self.assertEqual(self.tokenizer.tokenize(line)[:2], ["x", "="])
+            self.assertEqual(self.tokenizer.tokenize("why?\n" + line + "\ny = 2")[:3], ["why", "?", "x"])
+
+    def test_entities_for_lexed_code(self):
+        entities = EntityRecognizer().recognize_entities(self.tokenizer.tokenize("y = x ** 2 if x == 'a' else None"))
+        self.assertIn(("**", "operator"), entities)
+        self.assertIn(("==", "operator"), entities)
+        self.assertIn(("'a'", "string"), entities)
+
+class TestCodeAnalyzer(unittest.TestCase):
+
+    SOURCE = (
+        "import os\n"
+        "from .store import Store as S\n"
+        "\n"
+        "class Cache(S, base.Mixin):\n"
+        "    def save(self, path):\n"
+        "        os.path.join(path, 'x')\n"
+        "        self.flush()\n"
+        "\n"
+        "def main(argv=(1,\n"
+        "        2)):\n"
+        "    def inner():\n"
+        "        return Cache()\n"
+        "    print(inner())\n"
+        "\n"
+        "main()\n"
+    )
+
+    def setUp(self):
+        self.analyzer = CodeAnalyzer()
+
+    def test_extracts_records_and_call_graph(self):
+        analysis = self.analyzer.analyze(self.SOURCE)
+        self.assertEqual([(f.qualname, f.lineno, f.args) for f in analysis.functions],
+                         [("Cache.save", 5, ("self", "path")), ("main.inner", 11, ()), ("main", 9, ("argv",))])
+        self.assertEqual([(c.name, c.bases, c.methods) for c in analysis.classes],
+                         [("Cache", ("S", "base.Mixin"), ("save",))])
+        self.assertEqual([(i.module, i.names) for i in analysis.imports],
+                         [(None, (("os", None),)), (".store", (("Store", "S"),))])
+        self.assertEqual(analysis.call_graph(), {"Cache.save": ("os.path.join", "self.flush"), "main.inner": ("Cache",),
+                                                 "main": ("print", "inner"), "<module>": ("main",)})
+        self.assertFalse(hasattr(analysis.functions[0], "__dict__"))
+
+    def test_edited_code_reuses_unchanged_chunks(self):
+        self.analyzer.analyze(self.SOURCE)
+        misses = self.analyzer.misses
+        edited = self.analyzer.analyze("x = 1\n" + self.SOURCE.replace("self.flush()", "self.close()"))
+        self.assertEqual(self.analyzer.misses - misses, 2)  # The new line and the edited class
+        self.assertEqual(edited.functions[-1].lineno, 10)
+
+    def test_broken_chunk_is_skipped(self):
+        analysis = self.analyzer.analyze("def broken(:\n    pass\n\ndef ok():\n    pass\n")
+        self.assertEqual((analysis.errors, [f.name for f in analysis.functions]), (1, ["ok"]))
+
+    def test_budgets_truncate(self):
+        self.assertTrue(CodeAnalyzer(max_nodes=10).analyze(self.SOURCE).truncated)
+        self.assertTrue(CodeAnalyzer(max_source_chars=20).analyze(self.SOURCE).truncated)
+        timed_out = CodeAnalyzer(time_budget=-1).analyze(self.SOURCE)
+        self.assertEqual((timed_out.truncated, timed_out.functions), (True, []))
+
+    def test_names_feed_entity_labels(self):
+        recognizer = EntityRecognizer()
+        recognizer.add_code_analysis(self.analyzer.analyze(self.SOURCE))
+        self.assertEqual(recognizer.recognize_entities(["Cache", "inner", "path"]),
+                         [("Cache", "class"), ("inner", "function"), ("path", "identifier")])
+        pipeline = NLPPipeline()
+        tokens, code = pipeline.tokenizer.split_code("```\nclass Foo:\n    def bar(self):\n        baz()\n```")
+        _, entities = pipeline.token_labeler.label(tokens, pipeline.code_entities(code))
+        self.assertIn(("Foo", "class"), entities)
+        self.assertIn(("baz", "function"), entities)
+
+class TestTokenLabels(unittest.TestCase):
+
+    def test_fused_pass_matches_separate_stages(self):
+        tokens = ["hello", "I", "am", "a", "developer", "for", "==", "(", "'s'", "12", "x", "?", "print"]
+        pos_tags, entities = TokenLabeler().label(tokens)
+        self.assertEqual(pos_tags, POSTagger().tag(tokens))
+        self.assertEqual(entities, EntityRecognizer().recognize_entities(tokens))
+        self.assertEqual(entities[5:12], [("for", "keyword"), ("==", "operator"), ("(", "operator"), ("'s'", "string"),
+                                          ("12", "number"), ("x", "identifier"), ("?", "unknown")])
+
+    def test_prose_punctuation_keeps_baseline_labels(self):
+        punctuation = [".", ",", ";", "?", "%", "&", "@", "~", "^"]
+        entities = TokenLabeler().entities(Tokenizer().tokenize("Hi. Yes, ok; why? 5% & @me ~ ^"))
+        self.assertEqual({label for token, label in entities if token in punctuation}, {"unknown"})
+        self.assertEqual(EntityRecognizer().recognize_entities(punctuation), [(token, "unknown") for token in punctuation])
+
+    def test_table_is_frozen(self):
+        with self.assertRaises(TypeError):
+            TOKEN_LABELS["x"] = ("identifier", "UNK")
+
+class TestDocIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        rng = random.Random(0)
+        words = [f"w{i}" for i in range(200)]
+        sections = [("https://docs.python.org/3/library/json.html#json.dumps", "json.dumps",
+                     "Serialize obj to a JSON formatted str using the indent and sort_keys options.")]
+        sections += [(f"file:///s{i}", f"Section {i}", " ".join(rng.choices(words, [1 / (r + 1) for r in range(200)], k=30)))
+                     for i in range(300)]
+        build_index(sections, self.directory.name, Tokenizer(detect_code=False).tokenize_prose)
+        self.index = DocIndex(self.directory.name)
+        self.addCleanup(self.index.close)
+
+    def test_maxscore_matches_exhaustive_search(self):
+        self.index.exhaustive_limit = 0
+        rng = random.Random(1)
+        for _ in range(200):
+            terms = [f"w{rng.randrange(220)}" for _ in range(rng.randint(1, 4))]
+            expected = self.index.exhaustive_search(terms, 5)
+            found = self.index.search(terms, 5)
+            self.assertEqual([doc for _, doc in found], [doc for _, doc in expected], terms)
+            for (score, _), (expected_score, _) in zip(found, expected):
+                self.assertAlmostEqual(score, expected_score, places=4)
+
+    def test_kth_impact_comes_from_the_stored_prefix(self):
+        for term in ["w0", "w5", "w150", "json"]:
+            term_id = self.index.term_id(term)
+            start, end = self.index.term_postings[term_id], self.index.term_postings[term_id + 1]
+            impacts = sorted(self.index.postings_impact[start:end], reverse=True)
+            for k in (1, 5, 16, 17, 400):
+                self.assertEqual(self.index.kth_impact(term_id, k), impacts[k - 1] if k <= len(impacts) else 0.0)
+
+    def test_index_without_top_impacts_still_searches(self):
+        self.index.exhaustive_limit = 0
+        expected = self.index.search(["w0", "w3"], 5)
+        for name in ("term_top", "top_impacts"):
+            os.remove(os.path.join(self.directory.name, name))
+        older = DocIndex(self.directory.name)
+        self.addCleanup(older.close)
+        older.exhaustive_limit = 0
+        self.assertIsNone(older.term_top)
+        self.assertEqual(older.search(["w0", "w3"], 5), expected)
+
+    def test_unknown_terms(self):
+        self.assertEqual(self.index.search(["nosuchterm"]), [])
+        self.assertIsNone(self.index.term_id("nosuchterm"))
+
+    def test_response_generator_answers_from_docs(self):
+        generator = ResponseGenerator(doc_index_path=self.directory.name)
+        entities = [("json", "identifier"), ("indent", "identifier"), ("?", "unknown")]
+        response = generator.generate("unknown", entities)
+        self.assertIn("json.dumps", response)
+        self.assertIn("https://docs.python.org/3/library/json.html#json.dumps", response)
+        self.assertEqual(generator.generate("unknown", [("zzz", "identifier")]),
+                         "I'm not sure I understand. Could you clarify?")
+
+    def test_response_generator_without_index(self):
+        generator = ResponseGenerator(doc_index_path=None)
+        generator.doc_index_path = None  # Ignore DOC_INDEX_PATH from the environment
+        self.assertEqual(generator.generate("unknown", [("json", "identifier")]),
+                         "I'm not sure I understand. Could you clarify?")
+
+@unittest.skipUnless(importlib.util.find_spec("numpy"), "numpy is not installed")
+class TestCorpus(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, name, text, encoding="utf-8"):
+        with open(os.path.join(self.path, name), "w", encoding=encoding) as file:
+            file.write(text)
+        return os.path.join(self.path, name)
+
+    def test_readers(self):
+        cornell = self.write("movie_lines.txt", "L1 +++$+++ u0 +++$+++ m0 +++$+++ BIANCA +++$+++ They do not!\n"
+                             "L2 +++$+++ u1 +++$+++ m0 +++$+++ CAMERON +++$+++ Caf\xe9?\n", encoding="iso-8859-1")
+        self.assertEqual(list(iter_cornell(cornell)), ["They do not!", "Caf\xe9?"])
+        brown = os.path.join(self.path, "brown")
+        os.mkdir(brown)
+        with open(os.path.join(brown, "ca01"), "w") as file:
+            file.write("\n\tThe/at jury/nn said/vbd -LRB-/( it/pps -RRB-/) ./.\n\n")
+        with open(os.path.join(brown, "README"), "w") as file:
+            file.write("Not/np a/at corpus/nn file/nn\n")
+        self.assertEqual(list(iter_brown(brown)), ["The jury said ( it ) ."])
+
+    def test_ingest_dedupes_and_shards(self):
+        texts = [f"how do I sort list {i % 40} in python" for i in range(200)] + ["the"]
+        output = os.path.join(self.path, "corpus")
+        meta = ingest(iter(texts), output, chunk_size=16, shard_tokens=50)
+        self.assertEqual((meta["documents"], meta["duplicates"]), (41, 160))
+        self.assertGreater(len(meta["shards"]), 1)
+        corpus = TokenCorpus(output)
+        try:
+            self.assertEqual(len(corpus), 41)
+            self.assertEqual(corpus.decode(corpus.document(39)), Tokenizer(detect_code=False).tokenize(texts[39]))
+            self.assertEqual(len(corpus.document(40)), 0)  # All stopwords
+            self.assertEqual([list(document) for document in corpus][7], list(corpus.document(7)))
+            sort_id, missing = corpus.encode(["sort", "unseen"])
+            self.assertEqual((corpus.vocab_counts[sort_id], missing), (40, None))
+        finally:
+            corpus.close()
+
+    def test_worker_processes_write_the_same_corpus(self):
+        texts = [f"question {i} about the loop" for i in range(300)]
+        single = ingest(iter(texts), os.path.join(self.path, "single"), chunk_size=32, shard_tokens=200)
+        parallel = ingest(iter(texts), os.path.join(self.path, "parallel"), workers=2, chunk_size=32, shard_tokens=200)
+        self.assertEqual(single, parallel)
+        for shard in single["shards"]:
+            with open(os.path.join(self.path, "single", f"{shard['name']}.ids"), "rb") as first, \
+                    open(os.path.join(self.path, "parallel", f"{shard['name']}.ids"), "rb") as second:
+                self.assertEqual(first.read(), second.read())
+
+class TestSemanticIntentClassifier(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from nlp_pipeline.semantic_intent import read_examples, save_model, train
+        cls.directory = tempfile.TemporaryDirectory()
+        examples_path = os.path.join(os.path.dirname(__file__), "nlp_pipeline", "intent_examples.jsonl")
+        save_model(cls.directory.name, *train(read_examples(examples_path, Tokenizer().tokenize)))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def setUp(self):
+        from nlp_pipeline.semantic_intent import SemanticIntentClassifier
+        self.tokenizer = Tokenizer()
+        self.classifier = SemanticIntentClassifier(self.directory.name)
+
+    def test_classifies_paraphrases(self):
+        for text, intent in [("hello friend", "greet"), ("can you help me with this", "ask_for_help"),
+                             ("who are you exactly", "self_intro"), ("bye", "bye")]:
+            self.assertEqual(self.classifier.classify_intent(self.tokenizer.tokenize(text)), intent, text)
+
+    def test_batch_matches_single(self):
+        batch = [self.tokenizer.tokenize(text) for text in ["hi", "", "see you later", "what does yield do", "help"]]
+        self.assertEqual(self.classifier.classify_batch(batch), [self.classifier.classify_intent(t) for t in batch])
+        self.assertEqual(self.classifier.classify_batch([]), [])
+
+    def test_weights_are_memory_mapped(self):
+        import numpy
+        self.assertIsInstance(self.classifier.weights, numpy.memmap)
+
+    def test_falls_back_to_rules(self):
+        from nlp_pipeline.semantic_intent import SemanticIntentClassifier
+        self.classifier.threshold = 1.1  # The model is never confident enough
+        self.assertEqual(self.classifier.classify_intent(["hey"]), "greet")
+        with self.assertLogs(level="ERROR"):
+            missing = SemanticIntentClassifier(os.path.join(self.directory.name, "missing"))
+        self.assertEqual(missing.classify_batch([["bye"], ["xyz"]]), ["bye", "unknown"])
+
+class TestStageGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        def stage(name, function):
+            def run(*args):
+                self.calls.append(name)
+                return function(*args)
+            return run
+
+        self.graph = StageGraph([
+            Stage("double", stage("double", lambda x: x * 2), ("x",), ("doubled",)),
+            Stage("square", stage("square", lambda x: x * x), ("x",), ("squared",)),
+            Stage("split", stage("split", lambda d: (d // 10, d % 10)), ("doubled",), ("tens", "units")),
+            Stage("sum", stage("sum", lambda d, s: d + s), ("doubled", "squared"), ("total",),
+                  when=(("x",), lambda x: x > 0), skipped=(0,)),
+        ])
+
+    def test_unused_stages_are_pruned(self):
+        plan = self.graph.compile(("total",), given=("x",))
+        self.assertEqual(plan.names, ("double", "square", "sum"))
+        self.assertEqual(plan.run({"x": 3})["total"], 15)
+        self.assertEqual(self.calls, ["double", "square", "sum"])
+        self.assertEqual(self.graph.compile(("units",), given=("x",)).names, ("double", "split"))
+        self.assertEqual(self.graph.compile(("total",), given=("x", "doubled", "squared")).names, ("sum",))
+
+    def test_condition_skips_stage(self):
+        values = self.graph.compile(("total",), given=("x",)).run({"x": -3})
+        self.assertEqual(values["total"], 0)
+        self.assertNotIn("sum", self.calls)
+
+    def test_levels_run_concurrently(self):
+        from concurrent.futures import ThreadPoolExecutor
+        plan = self.graph.compile(("total", "tens"), given=("x",))
+        self.assertEqual([[stage.name for stage in level] for level in plan.levels],
+                         [["double", "square"], ["split", "sum"]])
+        timings = {}
+        with ThreadPoolExecutor(2) as executor:
+            values = plan.run({"x": 7}, executor, timings)
+        self.assertEqual((values["total"], values["tens"], values["units"]), (63, 1, 4))
+        self.assertEqual(set(timings), {"double", "square", "split", "sum"})
+
+    def test_invalid_graphs(self):
+        with self.assertRaises(ValueError):
+            self.graph.compile(("total",))  # x is never given
+        with self.assertRaises(ValueError):
+            StageGraph([Stage("a", abs, ("x",), ("y",)), Stage("b", abs, ("x",), ("y",))])
+        loop = StageGraph([Stage("a", abs, ("z",), ("y",)), Stage("b", abs, ("y",), ("z",))])
+        with self.assertRaises(ValueError):
+            loop.compile(("y",))
+
+    def test_pipeline_skips_entities_for_fixed_replies(self):
+        pipeline = NLPPipeline()
+        self.assertNotIn("tag", pipeline.plans["default"].names)
+        self.assertEqual(pipeline.process_input("hi\ndef f():\n    return 1\n")[1], "greet")
+        self.assertNotIn("code_analyzer", vars(pipeline))  # Greetings never need the pasted code analyzed
+
+    def test_replaced_stage_used_by_compiled_plan(self):
+        pipeline = NLPPipeline()
+        pipeline.process_input("hi")
+
+        class Always:
+            def classify_intent(self, tokens):
+                return "bye"
+
+        pipeline.intent_classifier = Always()
+        self.assertEqual(pipeline.process_input("hi")[1], "bye")
+
+class TestDialogueState(unittest.TestCase):
+
+    class Generator:
+        # Echoes what it was asked to answer, and always wants entities
+        def uses_entities(self, intent):
+            return True
+
+        def generate(self, intent, entities):
+            return intent, entities
+
+    def setUp(self):
+        self.pipeline = NLPPipeline()
+        self.pipeline.response_generator = self.Generator()
+        self.state = DialogueState()
+
+    def turn(self, text):
+        (intent, entities), resolved_intent, turn = self.pipeline.process_turn(text, self.state)
+        self.state.record(resolved_intent, turn["entities"], turn["topic"])
+        return resolved_intent, entities, turn
+
+    def test_reference_resolves_to_latest_entity(self):
+        self.turn("why does sort_items() crash")
+        intent, entities, turn = self.turn("what about that?")
+        self.assertIn(("sort_items", "identifier"), entities)
+        self.assertEqual(turn, {"entity": "sort_items", "entities": [("sort_items", "identifier")], "topic": "sort_items"})
+        self.assertEqual(self.state.last_mention("sort_items"), 2)
+
+    def test_entities_from_code_and_topic_changes(self):
+        self.turn("hi")
+        self.turn("help with this\ndef load_config(path):\n    return open(path).read()\n")
+        self.turn("and what about parseArgs")
+        self.assertEqual(self.state.last_entity(), ("parseArgs", "identifier"))
+        self.assertEqual(self.state.entities["load_config"], (2, "function"))
+        self.assertEqual(list(self.state.topics), [(2, "load_config"), (3, "parseArgs")])
+
+    def test_follow_up_keeps_intent_that_uses_entities(self):
+        self.state.record("ask_for_help")
+        self.assertEqual(self.turn("what about lists")[0], "ask_for_help")
+        self.pipeline.response_generator.uses_entities = lambda intent: False
+        self.state.record("greet")
+        self.assertEqual(self.turn("what about lists")[0], "unknown")
+
+    def test_oldest_entities_are_forgotten(self):
+        state = DialogueState(max_entities=2)
+        for turn, name in enumerate(["a_1", "b_2", "a_1", "c_3"], 1):
+            state.record("unknown", [(name, "identifier")])
+        self.assertEqual(list(state.entities), ["a_1", "c_3"])
+        restored = DialogueState()
+        restored.restore(state.to_dict())
+        self.assertEqual(restored.to_dict(), state.to_dict())
+
+    def test_process_input_is_unchanged(self):
+        self.assertEqual(self.pipeline.process_input("hi")[1], "greet")
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.sample_every = METRICS.sample_every
+        METRICS.sample_every = 1
+
+    def tearDown(self):
+        METRICS.sample_every = self.sample_every
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram((0.001, 0.01))
+        for value in (0.0005, 0.001, 0.005, 0.5):
+            histogram.observe(value)
+        self.assertEqual(histogram.cumulative(), [(0.001, 2), (0.01, 3), (float("inf"), 4)])
+        self.assertEqual(histogram.quantile(0.5), 0.001)
+        self.assertEqual(Histogram().quantile(0.5), 0.0)
+
+    def test_prometheus_and_json_export(self):
+        metrics = Metrics()
+        metrics.counter("requests_total", "Requests.", path="single").inc(3)
+        metrics.histogram("latency_seconds", "Latency.", buckets=(0.1,)).observe(0.05)
+        text = metrics.to_prometheus()
+        self.assertIn("# TYPE requests_total counter", text)
+        self.assertIn('requests_total{path="single"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 1', text)
+        self.assertIn("latency_seconds_count 1", text)
+        snapshot = metrics.snapshot()["metrics"]
+        self.assertEqual(snapshot["requests_total"]["series"], [{"labels": {"path": "single"}, "value": 3}])
+        self.assertEqual(snapshot["latency_seconds"]["series"][0]["count"], 1)
+        with self.assertRaises(ValueError):
+            metrics.histogram("requests_total")
+
+    def test_pipeline_records_stages_and_cache_hit_rate(self):
+        tokenize = METRICS.histogram("codebot_stage_seconds", stage="tokenize")
+        generate = METRICS.histogram("codebot_stage_seconds", stage="generate")
+        tokenized, generated = tokenize.count, generate.count
+        pipeline = NLPPipeline(cache_size=8)
+        pipeline.process_input("hi")
+        pipeline.process_input("hi")  # A cache hit skips every stage after the tokenizer
+        self.assertEqual(tokenize.count, tokenized + 2)
+        self.assertEqual(generate.count, generated + 1)
+        snapshot = METRICS.snapshot()
+        self.assertIn("codebot_inputs_total", snapshot["metrics"])
+        self.assertGreater(snapshot["cache_hit_rates"]["response"], 0)
+
+    def test_disabled_metrics_time_nothing(self):
+        tokenize = METRICS.histogram("codebot_stage_seconds", stage="tokenize")
+        count = tokenize.count
+        METRICS.enabled = False
+        try:
+            NLPPipeline().process_input("hi")
+        finally:
+            METRICS.enabled = True
+        self.assertEqual(tokenize.count, count)
+
+    def test_profiler_modes(self):
+        profiler = Profiler()
+        profiler.start("cprofile")
+        self.assertEqual(profiler.run(NLPPipeline().process_input, "hi")[1], "greet")
+        with self.assertRaises(RuntimeError):
+            profiler.start("sampling")
+        self.assertIn("process_input", profiler.stop())
+        self.assertIn("samples", profiler.profile_for(0.05, "sampling", interval=0.001))
+        with self.assertRaises(ValueError):
+            profiler.start("dtrace")
+        for seconds in (-1, float("nan"), float("inf")):
+            with self.assertRaises(ValueError):
+                profiler.profile_for(seconds)
+        self.assertFalse(profiler.active)
+        self.assertIn("samples", profiler.profile_for(0, "sampling"))
+
+if __name__ == "__main__":
+    unittest.main()
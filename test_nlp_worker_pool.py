@@ -0,0 +1,124 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from cryptography.fernet import Fernet
+from code_bot import CodeBot
+from context_manager import ContextManager
+from nlp_pipeline.dialogue_state import DialogueState
+from nlp_pipeline.nlp_pipeline import NLPPipeline
+from nlp_worker_pool import NLPClient, NLPPoolError, NLPWorkerPool, handle_request
+
+class SlowPipeline(NLPPipeline):
+    def process_batch(self, user_inputs, chunk_size=256, workers=0):
+        time.sleep(1)
+        return super().process_batch(user_inputs, chunk_size, workers)
+
+class FlakyPipeline(NLPPipeline):
+    def __init__(self):
+        super().__init__()
+        split_code = self.tokenizer.split_code
+
+        def flaky_split_code(text):
+            if text == "boom":
+                raise RuntimeError("tokenizer crashed")
+            return split_code(text)
+
+        self.tokenizer.split_code = flaky_split_code
+
+class TestNLPWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        # Run inside a scratch directory so the socket and session files don't leak
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.socket_path = os.path.join(self.temp_dir.name, "nlp.sock")
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_client_answers_like_the_pipeline(self):
+        with NLPWorkerPool(self.socket_path, workers=2):
+            client = NLPClient(self.socket_path)
+            self.assertEqual(client.process_input("hello"), NLPPipeline().process_input("hello"))
+            texts = ["hello", "bye", "help me with a function"]
+            self.assertEqual(list(client.process_batch(texts)), list(NLPPipeline().process_batch(texts)))
+            client.close()
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_concurrent_callers_share_a_client(self):
+        with NLPWorkerPool(self.socket_path, workers=2):
+            client = NLPClient(self.socket_path)
+            results = [None] * 40
+
+            def call(index):
+                results[index] = client.process_input("hello" if index % 2 else "bye")
+
+            threads = [threading.Thread(target=call, args=(i,)) for i in range(len(results))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            client.close()
+        self.assertEqual({intent for _, intent in results}, {"greet", "bye"})
+        self.assertEqual(results[1][1], "greet")
+
+    def test_turns_carry_the_dialogue_state(self):
+        with NLPWorkerPool(self.socket_path, workers=1):
+            client = NLPClient(self.socket_path)
+            dialogue = DialogueState()
+            dialogue.record("unknown", [("parse_config", "function")], "parse_config")
+            remote = client.process_turn("what does it return?", dialogue)
+            client.close()
+        self.assertEqual(remote, NLPPipeline().process_turn("what does it return?", dialogue))
+
+    def test_timeout_raises_and_bot_falls_back(self):
+        with NLPWorkerPool(self.socket_path, workers=1, pipeline_factory=SlowPipeline):
+            client = NLPClient(self.socket_path, timeout=0.2)
+            with self.assertRaises(NLPPoolError):
+                client.process_input("hello")
+            context_manager = ContextManager("user1", cipher=Fernet(Fernet.generate_key()),
+                                             install_signal_handlers=False)
+            bot = CodeBot("user1", nlp_pipeline=client)
+            bot.context_manager = context_manager
+            with self.assertLogs(level="ERROR"):
+                self.assertIn("try again", bot.handle_input("hello"))
+            self.assertEqual(len(context_manager.history), 0)  # Nothing recorded for the failed turn
+            client.close()
+
+    def test_failed_input_fails_only_itself(self):
+        dialogue = DialogueState().to_dict()
+        items = [{"input": "hello"}, {"input": "boom"}, {"input": "boom", "dialogue": dialogue},
+                 {"input": "bye", "dialogue": dialogue}]
+        with self.assertLogs(level="ERROR"):
+            reply = handle_request(FlakyPipeline(), {"id": 1, "items": items})
+        self.assertEqual(reply["results"][0][1], "greet")
+        self.assertIn("tokenizer crashed", reply["results"][1]["error"])
+        self.assertIn("error", reply["results"][2])
+        self.assertEqual(reply["results"][3][1], "bye")
+
+        with NLPWorkerPool(self.socket_path, workers=1, pipeline_factory=FlakyPipeline):
+            client = NLPClient(self.socket_path)
+            with self.assertRaises(NLPPoolError):
+                client.process_input("boom")
+            self.assertEqual(client.process_input("hello")[1], "greet")
+            with self.assertRaises(NLPPoolError):
+                list(client.process_batch(["hello", "boom"]))
+            client.close()
+
+    def test_dead_workers_are_replaced(self):
+        with NLPWorkerPool(self.socket_path, workers=2) as pool:
+            pool.processes[0].kill()
+            pool.processes[0].join()
+            self.assertEqual(pool.check(), 1)
+            self.assertTrue(all(process.is_alive() for process in pool.processes))
+            client = NLPClient(self.socket_path)
+            for _ in range(4):
+                self.assertEqual(client.process_input("hello")[1], "greet")
+            client.close()
+
+if __name__ == "__main__":
+    unittest.main()
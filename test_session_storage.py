@@ -0,0 +1,165 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from cryptography.fernet import Fernet
+from context_manager import ContextManager
+from session_storage import SessionDirectory, export_sessions, import_sessions, migrate_files
+from session_store import SessionStore
+
+class TestSessionDirectory(unittest.TestCase):
+
+    def setUp(self):
+        # Run inside a scratch directory so session files don't leak
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.cipher = Fernet(Fernet.generate_key())
+        self.storage = SessionDirectory("sessions")
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def save_session(self, user_id, storage, turns=1, **options):
+        context_manager = ContextManager(user_id, cipher=self.cipher, storage=storage, install_signal_handlers=False, **options)
+        for i in range(turns):
+            context_manager.update(intent="greet", input_text=f"hi {i}", response="Hello!")
+        context_manager.save_context()
+        context_manager.history.close()
+        return context_manager
+
+    def test_flat_layout_keeps_old_file_names(self):
+        flat = SessionDirectory()
+        self.assertEqual(flat.path("user1"), "session_context_user1.json")
+        self.assertEqual(flat.path("user1", "history"), "session_history_user1.log")
+
+    def test_sharded_paths_are_stable_and_safe(self):
+        path = self.storage.path("team/alice")
+        self.assertEqual(path, self.storage.path("team/alice"))
+        self.assertEqual(os.path.basename(path), "session_context_team%2Falice.json")
+        self.assertEqual(len(os.path.relpath(path, "sessions").split(os.sep)), 3)  # Two shard levels, then the file
+
+        self.save_session("team/alice", self.storage)
+        self.save_session("bob", self.storage)
+        self.assertEqual(sorted(self.storage.user_ids()), ["bob", "team/alice"])
+        self.assertEqual(list(SessionDirectory("missing").user_ids()), [])
+
+        restored = ContextManager("team/alice", cipher=self.cipher, storage=self.storage, install_signal_handlers=False)
+        self.assertTrue(restored.load_context())
+        self.assertEqual(restored.context["last_intent"], "greet")
+
+    def test_export_and_import_round_trip(self):
+        self.save_session("user1", self.storage, turns=30, history_window=10)  # Most turns spilled to disk
+        self.save_session("user2", self.storage)
+        output = io.StringIO()
+        self.assertEqual(export_sessions(self.storage, output, self.cipher), (2, 0))
+
+        target = SessionDirectory("imported")
+        self.assertEqual(import_sessions(target, io.StringIO(output.getvalue()), self.cipher), 2)
+        restored = ContextManager("user1", cipher=self.cipher, storage=target, install_signal_handlers=False)
+        restored.load_context()
+        self.assertEqual(len(restored.context["history"]), 30)
+        self.assertEqual(restored.context["history"][0], {"input": "hi 0", "response": "Hello!"})
+
+    def test_export_leaves_live_sessions_alone(self):
+        live = self.save_session("user1", self.storage, turns=15, history_window=10, append_log=True, compact_every=1)
+        live.compact_every = 1000
+        for i in range(15, 25):  # Spilled and logged after the snapshot
+            live.update(intent="greet", input_text=f"hi {i}", response="Hello!")
+        live.save_context()
+        spill_path = self.storage.path("user1", "history")
+        spill_size = os.path.getsize(spill_path)
+
+        output = io.StringIO()
+        self.assertEqual(export_sessions(self.storage, output, self.cipher), (1, 0))
+        history = json.loads(output.getvalue())["context"]["history"]
+        self.assertEqual([turn["input"] for turn in history], [f"hi {i}" for i in range(25)])
+        self.assertEqual(os.path.getsize(spill_path), spill_size)
+        live.history.close()
+        live.history_log.close()
+
+    def test_export_counts_unreadable_sessions(self):
+        self.save_session("user1", self.storage)
+        with open(self.storage.path("user1"), "wb") as file:
+            file.write(b"garbage")
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(export_sessions(self.storage, io.StringIO(), self.cipher), (0, 1))
+
+    def test_migrate_flat_to_sharded(self):
+        self.save_session("user1", SessionDirectory(), turns=3)
+        self.assertEqual(migrate_files(SessionDirectory(), self.storage), 1)
+        self.assertFalse(os.path.exists("session_context_user1.json"))
+        restored = ContextManager("user1", cipher=self.cipher, storage=self.storage, install_signal_handlers=False)
+        restored.load_context()
+        self.assertEqual(len(restored.context["history"]), 3)
+
+    def test_migrate_moves_sessions_with_only_a_log(self):
+        self.save_session("user1", SessionDirectory(), turns=3, append_log=True).history_log.close()
+        self.assertFalse(os.path.exists("session_context_user1.json"))  # Not compacted yet
+        self.assertEqual(migrate_files(SessionDirectory(), self.storage), 1)
+        self.assertFalse(os.path.exists("session_context_user1.log"))
+        restored = ContextManager("user1", cipher=self.cipher, storage=self.storage, install_signal_handlers=False,
+                                  append_log=True)
+        restored.load_context()
+        self.assertEqual(len(restored.context["history"]), 3)
+        restored.history_log.close()
+
+class TestSessionStoreStripes(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.store = SessionStore(cipher=Fernet(Fernet.generate_key()), storage=SessionDirectory("sessions"))
+
+    def tearDown(self):
+        self.store.scheduler.stop()
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_concurrent_gets_load_a_session_once(self):
+        original_load = ContextManager.load_context
+        loads = []
+
+        def counting_load(context_manager):
+            loads.append(context_manager.user_id)
+            return original_load(context_manager)
+
+        with patch.object(ContextManager, "load_context", counting_load):
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(self.store.get("user1"))) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(loads, ["user1"])
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_counting_load_does_not_block_other_stripes(self):
+        other = next(user for user in (f"user{i}" for i in range(100))
+                     if self.store.stripe(user) is not self.store.stripe("slow"))
+        started = threading.Event()
+        release = threading.Event()
+        original_load = ContextManager.load_context
+
+        def load(context_manager):
+            if context_manager.user_id == "slow":
+                started.set()
+                release.wait(5)
+            return original_load(context_manager)
+
+        with patch.object(ContextManager, "load_context", load):
+            thread = threading.Thread(target=self.store.get, args=("slow",))
+            thread.start()
+            started.wait(5)
+            self.assertEqual(self.store.get(other).user_id, other)
+            self.assertTrue(thread.is_alive())  # The other user didn't wait for the slow load
+            release.set()
+            thread.join()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from cryptography.fernet import Fernet
+from session_store import InactivityScheduler, SessionStore
+
+class TestInactivityScheduler(unittest.TestCase):
+
+    def test_reschedule_replaces_pending_callback(self):
+        scheduler = InactivityScheduler()
+        fired = []
+        done = threading.Event()
+        scheduler.schedule("user1", 0.05, lambda: fired.append("first"))
+        scheduler.schedule("user1", 0.05, lambda: (fired.append("second"), done.set()))
+        self.assertTrue(done.wait(2))
+        time.sleep(0.1)
+        self.assertEqual(fired, ["second"])
+        scheduler.stop()
+
+    def test_coalesce_keeps_first_deadline(self):
+        scheduler = InactivityScheduler()
+        fired = []
+        done = threading.Event()
+        scheduler.schedule("flush", 0.1, lambda: (fired.append("first"), done.set()), coalesce=True)
+        time.sleep(0.05)
+        scheduler.schedule("flush", 0.1, lambda: fired.append("second"), coalesce=True)
+        self.assertTrue(done.wait(0.09))
+        time.sleep(0.1)
+        self.assertEqual(fired, ["first"])
+        scheduler.stop()
+
+    def test_equal_deadlines_with_mixed_keys(self):
+        scheduler = InactivityScheduler()
+        fired = []
+        with patch("time.monotonic", return_value=100.0):  # A coarse clock gives both the same deadline
+            scheduler.schedule("user1", 0, lambda: fired.append("user1"))
+            scheduler.schedule(("flush", "user1"), 0, lambda: fired.append("flush"))
+        time.sleep(0.2)
+        self.assertEqual(sorted(fired), ["flush", "user1"])
+        scheduler.stop()
+
+    def test_cancel(self):
+        scheduler = InactivityScheduler()
+        fired = []
+        scheduler.schedule("user1", 0.05, lambda: fired.append("user1"))
+        scheduler.cancel("user1")
+        time.sleep(0.15)
+        self.assertEqual(fired, [])
+        self.assertEqual(len(scheduler), 0)
+        scheduler.stop()
+
+class TestSessionStore(unittest.TestCase):
+
+    def setUp(self):
+        # Run inside a scratch directory so session files don't leak
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.store = SessionStore(max_sessions=2, cipher=Fernet(Fernet.generate_key()))
+
+    def tearDown(self):
+        self.store.scheduler.stop()
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_sessions_share_cipher_and_scheduler(self):
+        first = self.store.get("user1")
+        second = self.store.get("user2")
+        self.assertIs(first.cipher, second.cipher)
+        self.assertIs(first.scheduler, second.scheduler)
+        self.assertIs(self.store.get("user1"), first)
+
+    def test_lru_session_is_saved_and_evicted(self):
+        self.store.get("user1").update(intent="greet", input_text="hi", response="Hello!")
+        self.store.get("user2")
+        self.store.get("user3")
+
+        self.assertNotIn("user1", self.store)
+        self.assertEqual(len(self.store), 2)
+        self.assertTrue(os.path.exists("session_context_user1.json"))
+
+        # Loading it again brings the saved history back
+        restored = self.store.get("user1")
+        self.assertEqual(restored.context["history"], [{"input": "hi", "response": "Hello!"}])
+
+    def test_flush_all_only_saves_dirty_sessions(self):
+        self.store.get("user1").update(intent="greet", input_text="hi", response="Hello!")
+        self.store.get("user2")
+        self.store.flush_all()
+
+        self.assertTrue(os.path.exists("session_context_user1.json"))
+        self.assertFalse(os.path.exists("session_context_user2.json"))
+        self.assertFalse(self.store.get("user1").dirty)
+
+    def test_reloading_waits_for_a_slow_write_back(self):
+        store = SessionStore(max_sessions=1, cipher=Fernet(Fernet.generate_key()))
+        first = store.get("user1")
+        first.update(intent="greet", input_text="hi", response="Hello!")
+        write_back = store._write_back
+        store._write_back = lambda context_manager: (time.sleep(0.2), write_back(context_manager))
+        evicting = threading.Thread(target=store.get, args=("user2",))
+        evicting.start()
+        time.sleep(0.05)  # user1 is out of the map, its save not even started
+
+        restored = store.get("user1")
+        evicting.join()
+        self.assertIsNot(restored, first)
+        self.assertEqual(restored.context["history"], [{"input": "hi", "response": "Hello!"}])
+        store.scheduler.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from cryptography.fernet import Fernet
+from context_manager import ContextManager
+from turn_history import Turn, TurnHistory
+
+class TestTurnHistory(unittest.TestCase):
+
+    def setUp(self):
+        # Run inside a scratch directory so spill files don't leak
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.cipher = Fernet(Fernet.generate_key())
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_old_turns_spill_to_disk(self):
+        history = TurnHistory(window=4, spill_path="spill.log", cipher=self.cipher)
+        for i in range(11):
+            history.append(f"input {i}", "Hello!")
+        self.assertEqual((len(history), history.size, history.spilled), (11, 3, 8))
+        self.assertEqual([turn.input for turn in history], [f"input {i}" for i in range(11)])
+        self.assertEqual(history[2], {"input": "input 2", "response": "Hello!"})
+        self.assertEqual(history[-1]["input"], "input 10")
+        self.assertEqual([turn["input"] for turn in history[:2]], ["input 0", "input 1"])
+        self.assertIs(history[9].response, history[10].response)  # Interned
+
+    def test_window_without_spill_file_drops_old_turns(self):
+        history = TurnHistory(window=4)
+        for i in range(7):
+            history.append(f"input {i}", "Hello!")
+        self.assertEqual([turn.input for turn in history], ["input 4", "input 5", "input 6"])
+        self.assertFalse(hasattr(Turn("a", "b"), "__dict__"))
+
+    def test_restore_cuts_blocks_spilled_after_the_snapshot(self):
+        history = TurnHistory(window=4, spill_path="spill.log", cipher=self.cipher)
+        for i in range(5):
+            history.append(f"input {i}", "Hello!")
+        snapshot = history.to_snapshot()
+        for i in range(5, 9):
+            history.append(f"lost {i}", "Hello!")  # Spilled, then the process dies before the next snapshot
+        history.close()
+
+        restored = TurnHistory(window=4, spill_path="spill.log", cipher=self.cipher)
+        restored.restore(*snapshot)
+        self.assertEqual([turn.input for turn in restored], [f"input {i}" for i in range(5)])
+
+    def test_failed_load_keeps_the_spill_file(self):
+        key = Fernet.generate_key()
+        context_manager = ContextManager("user1", encryption_key=key, history_window=4, install_signal_handlers=False)
+        for i in range(9):
+            context_manager.update(intent="greet", input_text=f"hi {i}", response="Hello!")
+        context_manager.save_context()
+        context_manager.history.close()
+        spill_size = os.path.getsize(context_manager.history.spill_log.log_file_path)
+
+        failing = ContextManager("user1", encryption_key=key, history_window=4, install_signal_handlers=False)
+        with patch("builtins.open", side_effect=IOError("disk busy")), self.assertLogs(level="ERROR"):
+            self.assertFalse(failing.load_context())
+        self.assertEqual(len(failing.history), 0)
+        self.assertEqual(os.path.getsize(failing.history.spill_log.log_file_path), spill_size)
+
+        retried = ContextManager("user1", encryption_key=key, history_window=4, install_signal_handlers=False)
+        self.assertTrue(retried.load_context())
+        self.assertEqual([turn.input for turn in retried.history], [f"hi {i}" for i in range(9)])
+
+        for i in range(5):  # Spilling after the failed load starts the file over instead of mixing in old turns
+            failing.update(intent="greet", input_text=f"new {i}", response="Hello!")
+        self.assertEqual([turn.input for turn in failing.history], [f"new {i}" for i in range(5)])
+        failing.history.close()
+        retried.history.close()
+
+    def test_spill_file_without_a_snapshot_starts_over(self):
+        key = Fernet.generate_key()
+        crashed = ContextManager("user1", encryption_key=key, history_window=4, install_signal_handlers=False)
+        for i in range(9):  # Spills blocks, then dies before any snapshot
+            crashed.update(intent="greet", input_text=f"old {i}", response="Hello!")
+        crashed.history.close()
+
+        fresh = ContextManager("user1", encryption_key=key, history_window=4, install_signal_handlers=False)
+        self.assertFalse(fresh.load_context())
+        for i in range(6):
+            fresh.update(intent="greet", input_text=f"new {i}", response="Hello!")
+        self.assertEqual([turn.input for turn in fresh.history], [f"new {i}" for i in range(6)])
+        self.assertEqual(len(list(fresh.history)), len(fresh.history))
+        fresh.history.close()
+
+    def test_context_manager_round_trip(self):
+        context_manager = ContextManager("user1", encryption_key=Fernet.generate_key(), history_window=4,
+                                         install_signal_handlers=False)
+        for i in range(9):
+            context_manager.update(intent="greet", input_text=f"hi {i}", response="Hello!")
+        context_manager.save_context()
+        context_manager.history.close()
+
+        restored = ContextManager("user1", encryption_key=context_manager.cipher.encryption_key, history_window=4,
+                                  install_signal_handlers=False)
+        restored.load_context()
+        self.assertEqual([turn["input"] for turn in restored.context["history"]], [f"hi {i}" for i in range(9)])
+        self.assertEqual(restored.history.size, 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+import logging
+import sys
+from itertools import islice
+
+from history_log import HistoryLog
+
+
+class Turn:
+    """One input/response pair. Reads like the {"input", "response"} dicts history used to hold."""
+
+    __slots__ = ("input", "response")
+
+    def __init__(self, input, response):
+        self.input = input
+        self.response = response
+
+    def __getitem__(self, key):
+        if key == "input":
+            return self.input
+        if key == "response":
+            return self.response
+        raise KeyError(key)
+
+    def as_dict(self):
+        return {"input": self.input, "response": self.response}
+
+    def __eq__(self, other):
+        if isinstance(other, Turn):
+            return self.input == other.input and self.response == other.response
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Turn({self.input!r}, {self.response!r})"
+
+
+class TurnHistory:
+    """Conversation history that keeps only the newest turns in memory.
+
+    The newest `window` turns live in a ring buffer of Turn records. When it
+    fills up, the oldest half is spilled as one encrypted block to an
+    append-only HistoryLog, so memory stays bounded however long a session
+    runs. Iterating walks the spilled blocks lazily, one block at a time,
+    then the ring. Responses are interned, so the few distinct bot replies
+    are stored once per process rather than once per turn.
+
+    With window=None every turn stays in memory and nothing is spilled.
+    """
+
+    def __init__(self, window=1000, spill_path=None, cipher=None):
+        if window is not None and window < 2:
+            raise ValueError("window must be at least 2 turns")
+        self.window = window
+        self.spill_block = window // 2 if window else 0  # Turns written per spilled block
+        self.spill_log = HistoryLog(spill_path, cipher) if window and spill_path else None
+        self.spilled = 0  # Turns on disk, all older than anything in the ring
+        self.stale_spill = False  # The spill file holds turns this history doesn't count, see reset()
+        self.ring = [None] * window if window else []
+        self.head = 0  # Ring slot of the oldest in-memory turn
+        self.size = 0
+
+    def append(self, input, response):
+        if self.window is None:
+            self.ring.append(Turn(input, sys.intern(response)))
+            self.size += 1
+            return
+        if self.size == self.window:
+            self._spill()
+        self.ring[(self.head + self.size) % self.window] = Turn(input, sys.intern(response))
+        self.size += 1
+
+    def _spill(self):
+        turns = []
+        for _ in range(self.spill_block):
+            turn = self.ring[self.head]
+            turns.append([turn.input, turn.response])
+            self.ring[self.head] = None
+            self.head = (self.head + 1) % self.window
+        self.size -= self.spill_block
+        if self.spill_log is None:
+            return  # No spill file: the window is a plain bound and the oldest turns are dropped
+        if self.stale_spill:
+            self.spill_log.truncate()  # New blocks would otherwise be read back after the old ones
+            self.stale_spill = False
+        self.spill_log.append({"turns": turns})
+        self.spilled += len(turns)
+
+    def in_memory(self):
+        """The turns still in the ring, oldest first."""
+        if self.window is None:
+            return iter(self.ring)
+        return (self.ring[(self.head + offset) % self.window] for offset in range(self.size))
+
+    def iter_spilled(self):
+        """Lazily yields the spilled turns, decrypting one block at a time."""
+        if self.spill_log is None or not self.spilled:
+            return
+        for block in self.spill_log.replay():
+            for input, response in block["turns"]:
+                yield Turn(input, response)
+
+    def __iter__(self):
+        yield from self.iter_spilled()
+        yield from self.in_memory()
+
+    def __len__(self):
+        """Every turn of the session, spilled ones included."""
+        return self.spilled + self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if (key.start or 0) >= 0 and (key.stop is None or key.stop >= 0) and (key.step or 1) > 0:
+                return list(islice(self, key.start, key.stop, key.step))
+            return list(self)[key]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("history index out of range")
+        if key >= self.spilled:
+            offset = key - self.spilled
+            return self.ring[offset] if self.window is None else self.ring[(self.head + offset) % self.window]
+        return next(islice(self.iter_spilled(), key, None))
+
+    def __eq__(self, other):
+        if isinstance(other, (list, TurnHistory)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f"TurnHistory({len(self)} turns, {self.size} in memory)"
+
+    def to_snapshot(self):
+        """Returns (in-memory turns as {"input", "response"} dicts, spilled turn count, spill file size).
+
+        Spilled turns stay in the spill file; the count and size tell restore()
+        how much of that file the snapshot covers.
+        """
+        spill_size = self.spill_log.size() if self.spill_log else 0
+        return [turn.as_dict() for turn in self.in_memory()], self.spilled, spill_size
+
+    def restore(self, turns, spilled=0, spill_size=0):
+        """Replaces the history with a snapshot's turns.
+
+        Blocks spilled after the snapshot was written (the process then died
+        before the next one) are cut off the spill file, since the snapshot's
+        own turns already include them or they were lost with the process.
+        """
+        self.clear(spill_size)
+        self.spilled = spilled if self.spill_log else 0
+        self.extend_dicts(turns)
+
+    def extend_dicts(self, turns):
+        """Appends turns from a snapshot or an old-style history list."""
+        for turn in turns:
+            self.append(turn["input"], turn["response"])
+
+    def sync(self):
+        """Forces spilled blocks onto disk, before a snapshot that counts them is written."""
+        if self.spill_log:
+            self.spill_log.sync()
+
+    def reset(self):
+        """Empties the history in memory only, e.g. after a snapshot couldn't be read.
+
+        The spill file is kept, so loading the session again can still find
+        its older turns; it is only cut once this history spills a block of its own.
+        """
+        self.ring = [None] * self.window if self.window else []
+        self.head = 0
+        self.size = 0
+        self.spilled = 0
+        self.stale_spill = self.spill_log is not None
+
+    def clear(self, spill_size=0):
+        """Empties the history and cuts the spill file down to its first spill_size bytes."""
+        self.reset()
+        self.stale_spill = False
+        if self.spill_log:
+            try:
+                self.spill_log.truncate(spill_size)
+            except OSError as e:
+                logging.error(f"Failed to truncate history spill file: {e}")
+
+    def close(self):
+        if self.spill_log:
+            self.spill_log.close()